@@ -0,0 +1,34 @@
+"""
+Offline environment of the benchmarks: Django is configured with in-memory caches, and
+the edx-platform modules that the xblock imports are stubbed when they are missing.
+Import this module before any `openedxscorm_v2` module.
+"""
+import os
+import sys
+import types
+
+import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+# pylint: disable=wrong-import-position
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure(
+        TEMPLATES=[{"BACKEND": "django.template.backends.django.DjangoTemplates"}],
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}
+        },
+    )
+    import django
+
+    django.setup()
+
+try:
+    import xmodule.contentstore.django  # pylint: disable=unused-import
+except ImportError:
+    # Benchmarks do not require edx-platform: the contentstore is mocked anyway
+    for module_name in ["xmodule", "xmodule.contentstore"]:
+        sys.modules[module_name] = types.ModuleType(module_name)
+    sys.modules["xmodule.contentstore.django"] = mock.Mock(contentstore=mock.Mock())
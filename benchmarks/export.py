@@ -0,0 +1,126 @@
+"""
+Measure the throughput and the memory usage of the bulk export of learner results.
+
+StudentModule records of synthetic learners are generated in memory and exported to
+CSV or JSONL, without a database. Results are printed as JSON:
+
+    python benchmarks/export.py [--learners 100000] [--format csv|jsonl]
+"""
+import argparse
+import datetime
+import json
+import random
+import time
+import tracemalloc
+
+import environment  # pylint: disable=unused-import
+
+# pylint: disable=wrong-import-position
+from openedxscorm_v2 import export, scormdata
+
+
+CMI_KEYS = ["cmi.location", "cmi.completion_status", "cmi.interactions.0.result"]
+
+
+def make_state(rng):
+    data = {
+        "cmi.location": "page{}".format(rng.randint(1, 50)),
+        "cmi.completion_status": rng.choice(["completed", "incomplete"]),
+        "cmi.suspend_data": "".join(
+            rng.choice("abcdef0123456789") for _ in range(rng.randint(100, 4000))
+        ),
+    }
+    for index in range(rng.randint(0, 10)):
+        data["cmi.interactions.{}.id".format(index)] = "q{}".format(index)
+        data["cmi.interactions.{}.result".format(index)] = rng.choice(
+            ["correct", "incorrect"]
+        )
+    return json.dumps(
+        {
+            "lesson_status": data["cmi.completion_status"],
+            "success_status": rng.choice(["passed", "failed", "unknown"]),
+            "lesson_score": rng.random(),
+            "scorm_data": scormdata.pack(data),
+        }
+    )
+
+
+def iter_records(learners, chunk_size, seed=0):
+    """
+    Iterate on chunks of synthetic StudentModule records. A pool of states is reused,
+    such that generating records does not dominate the measurements.
+    """
+    rng = random.Random(seed)
+    states = [make_state(rng) for _ in range(1000)]
+    modified = datetime.datetime(2024, 1, 1)
+    for start in range(0, learners, chunk_size):
+        yield [
+            (
+                user_id,
+                user_id,
+                "learner{}".format(user_id),
+                "block-v1:org+course+run+type@scorm_v2+block@abc",
+                states[user_id % len(states)],
+                rng.random(),
+                1.0,
+                modified,
+            )
+            for user_id in range(start, min(start + chunk_size, learners))
+        ]
+
+
+class NullWriter:
+    def write(self, data):
+        return len(data)
+
+    def writelines(self, lines):
+        for _line in lines:
+            pass
+
+
+def run(args):
+    """
+    Export the synthetic learner results and return the duration and the row count.
+    """
+    chunks = (
+        [export.get_row(record, CMI_KEYS) for record in records]
+        for records in iter_records(args.learners, args.chunk_size)
+    )
+    started = time.perf_counter()
+    if args.format == "csv":
+        count = export.write_csv(chunks, NullWriter(), cmi_keys=CMI_KEYS)
+    else:
+        count = export.write_jsonl(chunks, NullWriter())
+    return time.perf_counter() - started, count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--learners", type=int, default=100000)
+    parser.add_argument("--chunk-size", type=int, default=export.DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--format", choices=["csv", "jsonl"], default="csv")
+    args = parser.parse_args()
+
+    duration, count = run(args)
+    # Memory is measured in a separate run, as tracing slows down the export
+    tracemalloc.start()
+    run(args)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(
+        json.dumps(
+            {
+                "format": args.format,
+                "learners": count,
+                "chunk_size": args.chunk_size,
+                "duration": duration,
+                "rows_per_second": count / duration,
+                "peak_memory_bytes": peak_memory,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Measure the transfer savings and the extraction overhead of precompressed variants.
+
+A synthetic package is generated, unless the path to a real package is given, and it is
+extracted to a temporary local storage with and without precompression. Results are
+printed as JSON:
+
+    python benchmarks/precompression.py [package.zip] [--encodings gzip br]
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import zipfile
+
+import environment  # pylint: disable=unused-import
+
+# pylint: disable=wrong-import-position
+from django.core.files.storage import FileSystemStorage
+
+from openedxscorm_v2 import publishing
+from openedxscorm_v2.extraction import ZipExtractor
+
+
+WORDS = [
+    "function",
+    "return",
+    "var",
+    "this",
+    "document",
+    "window",
+    "scorm",
+    "lesson",
+    "score",
+    "status",
+    "interaction",
+    "objective",
+    "element",
+    "value",
+    "length",
+]
+
+
+def make_package(text_files=200, binary_files=20, seed=0):
+    """
+    Return a zip file that contains text assets, which are made of random
+    JavaScript-like statements, and incompressible binary assets.
+    """
+    rng = random.Random(seed)
+    package = io.BytesIO()
+    with zipfile.ZipFile(package, "w", zipfile.ZIP_DEFLATED) as scorm_zipfile:
+        scorm_zipfile.writestr("imsmanifest.xml", "<manifest></manifest>")
+        for index in range(text_files):
+            statements = [
+                "{} {}_{} = {}({});".format(
+                    rng.choice(WORDS),
+                    rng.choice(WORDS),
+                    rng.randint(0, 1000),
+                    rng.choice(WORDS),
+                    rng.randint(0, 1000),
+                )
+                for _ in range(rng.randint(50, 2000))
+            ]
+            extension = rng.choice([".js", ".css", ".html"])
+            scorm_zipfile.writestr(
+                "assets/file{}{}".format(index, extension), "\n".join(statements)
+            )
+        for index in range(binary_files):
+            size = rng.randint(10, 500) * 1024
+            scorm_zipfile.writestr("media/image{}.png".format(index), os.urandom(size))
+    package.seek(0)
+    return package
+
+
+def extract(package, encodings):
+    location = tempfile.mkdtemp()
+    try:
+        storage = FileSystemStorage(location=location)
+        publisher = publishing.AssetPublisher(storage, encodings=encodings)
+        with zipfile.ZipFile(package) as scorm_zipfile:
+            members = [
+                (zipinfo, zipinfo.filename)
+                for zipinfo in scorm_zipfile.infolist()
+                if not zipinfo.filename.endswith("/")
+            ]
+            extractor = ZipExtractor(storage, workers=4, publisher=publisher)
+            started = time.perf_counter()
+            extractor.extract(scorm_zipfile, members)
+            duration = time.perf_counter() - started
+        return {
+            "duration": duration,
+            "files": extractor.files_extracted,
+            "bytes": extractor.bytes_written,
+            "compressible_bytes": publisher.original_bytes,
+            "compressed_bytes": publisher.compressed_bytes,
+        }
+    finally:
+        shutil.rmtree(location)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("package", nargs="?", help="Path to a SCORM package")
+    parser.add_argument("--encodings", nargs="+", default=["gzip", "br"])
+    args = parser.parse_args()
+
+    if args.package:
+        with open(args.package, "rb") as f:
+            package = io.BytesIO(f.read())
+    else:
+        package = make_package()
+
+    baseline = extract(package, [])
+    precompressed = extract(package, args.encodings)
+    savings = {
+        encoding: 1 - size / precompressed["compressible_bytes"]
+        for encoding, size in precompressed["compressed_bytes"].items()
+        if precompressed["compressible_bytes"]
+    }
+    overhead = precompressed["duration"] / baseline["duration"] - 1
+    print(
+        json.dumps(
+            {
+                "baseline": baseline,
+                "precompressed": precompressed,
+                "transfer_savings": savings,
+                "extraction_overhead": overhead,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""
+Run performance benchmarks of package ingestion, rendering and runtime handlers.
+
+Benchmarks run offline: packages are synthetic, files are extracted to a temporary
+local storage and the Open edX contentstore is mocked. Results are printed as JSON, and
+they can be compared with the results of a previous run to detect regressions:
+
+    python benchmarks/suite.py [--quick] [--filter extract] [--output results.json]
+    python benchmarks/suite.py --baseline results.json [--tolerance 0.2]
+
+The comparison exits with a non-zero status when the median duration of a benchmark is
+larger than its baseline by more than the tolerance.
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+import mock
+
+import environment  # pylint: disable=unused-import
+
+# pylint: disable=wrong-import-position
+from django.core.files.storage import FileSystemStorage
+from xblock.field_data import DictFieldData
+
+from openedxscorm_v2 import hashing, packages, scormdata
+from openedxscorm_v2.scormxblock import ScormXBlock, spool_asset
+
+
+USAGE_ID = "block-v1:org+course+run+type@scorm_v2+block@benchmark"
+MANIFEST = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest identifier="benchmark" version="1.0"
+    xmlns="http://www.imsproject.org/xsd/imscp_rootv1p1p2"
+    xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_rootv1p2">
+  <metadata>
+    <schema>ADL SCORM</schema>
+    <schemaversion>1.2</schemaversion>
+  </metadata>
+  <organizations default="org">
+    <organization identifier="org">
+      <title>Benchmark</title>
+      <item identifier="item" identifierref="resource">
+        <title>Benchmark</title>
+        <adlcp:masteryscore>80</adlcp:masteryscore>
+      </item>
+    </organization>
+  </organizations>
+  <resources>
+    <resource identifier="resource" type="webcontent" adlcp:scormtype="sco"
+        href="index.html">
+      <file href="index.html"/>
+{files}
+    </resource>
+  </resources>
+</manifest>
+"""
+
+# name: (file count, file size)
+PACKAGES = {
+    "small": (20, 10 * 1024),
+    "many_files": (2000, 2 * 1024),
+    "large_files": (20, 2 * 1024 * 1024),
+}
+QUICK_PACKAGES = {
+    "small": (20, 10 * 1024),
+    "many_files": (200, 2 * 1024),
+    "large_files": (4, 1024 * 1024),
+}
+SET_VALUES_BATCH_SIZES = [1, 10, 100]
+HASH_ALGORITHMS = ["sha1", "blake2b", "sha256"]
+
+
+def make_package(file_count, file_size, seed=0):
+    """
+    Return a zip file that contains a SCORM 1.2 manifest, an index page and
+    `file_count` assets of `file_size` bytes. Assets are half text, half random bytes,
+    such that they are neither trivially compressible nor incompressible.
+    """
+    rng = random.Random(seed)
+    package = io.BytesIO()
+    paths = ["assets/file{}.js".format(index) for index in range(file_count)]
+    with zipfile.ZipFile(package, "w", zipfile.ZIP_DEFLATED) as scorm_zipfile:
+        scorm_zipfile.writestr(
+            "imsmanifest.xml",
+            MANIFEST.format(
+                files="\n".join(
+                    '      <file href="{}"/>'.format(path) for path in paths
+                )
+            ),
+        )
+        scorm_zipfile.writestr("index.html", "<html><body>Benchmark</body></html>")
+        for path in paths:
+            text = b"var value = 0;\n" * (file_size // 30)
+            scorm_zipfile.writestr(path, text + randbytes(rng, file_size - len(text)))
+    package.seek(0)
+    return package
+
+
+def randbytes(rng, size):
+    return rng.getrandbits(8 * size).to_bytes(size, "little") if size > 0 else b""
+
+
+def make_block(storage, **fields):
+    """
+    Return a ScormXBlock that stores its assets in `storage`.
+    """
+    runtime = mock.Mock()
+    runtime.publish = lambda *args, **kwargs: None
+    runtime.service.return_value.get_settings_bucket.return_value = {
+        "STORAGE_FUNC": lambda _xblock: storage,
+    }
+    block = ScormXBlock(runtime, DictFieldData(fields), mock.Mock(usage_id=USAGE_ID))
+    block.location = mock.Mock(
+        block_id="benchmark", org="org", course="course", block_type="scorm_v2"
+    )
+    return block
+
+
+def measure(func, repeat, number=1, setup=None):
+    """
+    Call `func` `number` times in each of `repeat` rounds, and return the statistics of
+    the durations of a single call, in seconds. `setup` is called before each round and
+    its result is passed to `func`.
+    """
+    durations = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        started = time.perf_counter()
+        for _ in range(number):
+            func(argument)
+        durations.append((time.perf_counter() - started) / number)
+    return {
+        "repeat": repeat,
+        "number": number,
+        "min": min(durations),
+        "median": statistics.median(durations),
+        "mean": statistics.mean(durations),
+        "max": max(durations),
+    }
+
+
+class Benchmarks:
+    """
+    Every `bench_*` method yields (name, params, stats) results.
+    """
+
+    def __init__(self, quick=False):
+        self.quick = quick
+        self.repeat = 3 if quick else 5
+        self.packages = {
+            name: make_package(file_count, file_size)
+            for name, (file_count, file_size) in (
+                QUICK_PACKAGES if quick else PACKAGES
+            ).items()
+        }
+        self.location = tempfile.mkdtemp()
+        self.storage = FileSystemStorage(location=self.location, base_url="/media/")
+
+    def close(self):
+        shutil.rmtree(self.location)
+
+    def bench_get_sha1(self):
+        for name, package in self.packages.items():
+            size = len(package.getvalue())
+            stats = measure(lambda _: ScormXBlock.get_sha1(package), self.repeat)
+            stats["megabytes_per_second"] = size / stats["median"] / 1e6
+            yield "get_sha1", {"package": name, "bytes": size}, stats
+
+    def bench_get_digest(self):
+        package = self.packages["large_files"]
+        size = len(package.getvalue())
+
+        def legacy_sha1(_):
+            # Reads of 8 kB blocks, as in previous versions
+            sha1 = hashlib.sha1()
+            for block in iter(lambda: package.read(8 * 1024), b""):
+                sha1.update(block)
+            package.seek(0)
+
+        stats = measure(legacy_sha1, self.repeat)
+        stats["megabytes_per_second"] = size / stats["median"] / 1e6
+        yield "get_digest", {"algorithm": "sha1", "buffer": 8 * 1024}, stats
+        for algorithm in HASH_ALGORITHMS:
+            stats = measure(
+                lambda _, algorithm=algorithm: hashing.get_digest(package, algorithm),
+                self.repeat,
+            )
+            stats["megabytes_per_second"] = size / stats["median"] / 1e6
+            yield "get_digest", {
+                "algorithm": algorithm,
+                "buffer": hashing.BUFFER_SIZE,
+            }, stats
+
+    def bench_spool_asset(self):
+        data = self.packages["large_files"].getvalue()
+        size = len(data)
+        chunk_size = 255 * 1024
+
+        def spool(hash_algorithm):
+            # Chunks of the size of GridFS chunks
+            with mock.patch("openedxscorm_v2.scormxblock.contentstore") as store:
+                store.return_value.find.return_value.stream_data.return_value = (
+                    data[start : start + chunk_size]
+                    for start in range(0, size, chunk_size)
+                )
+                with spool_asset(
+                    mock.sentinel.asset, hash_algorithm=hash_algorithm
+                ) as spooled:
+                    if hash_algorithm is None:
+                        hashing.get_digest(spooled)
+
+        for hash_algorithm, single_pass in [(None, False), ("sha1", True)]:
+            stats = measure(
+                lambda _, hash_algorithm=hash_algorithm: spool(hash_algorithm),
+                self.repeat,
+            )
+            stats["megabytes_per_second"] = size / stats["median"] / 1e6
+            yield "spool_asset", {"single_pass": single_pass, "bytes": size}, stats
+
+    def bench_extract_package(self):
+        for name, package in self.packages.items():
+            block = self.make_extracted_block(package)
+            folder = iter(range(self.repeat))
+
+            def setup():
+                # Every round extracts to a new folder, as on package updates
+                return os.path.join("scorm", "extract", name, str(next(folder)))
+
+            stats = measure(
+                lambda path, block=block, package=package: block.extract_package(
+                    package, extract_folder_path=path
+                ),
+                self.repeat,
+                setup=setup,
+            )
+            file_count, _file_size = (QUICK_PACKAGES if self.quick else PACKAGES)[name]
+            stats["files_per_second"] = (file_count + 2) / stats["median"]
+            yield "extract_package", {
+                "package": name,
+                "files": file_count + 2,
+                "bytes": len(package.getvalue()),
+            }, stats
+
+    def bench_update_package_fields(self):
+        block = self.make_extracted_block(self.packages["many_files"])
+        yield "update_package_fields", {"package": "many_files"}, measure(
+            lambda _: block.update_package_fields(), self.repeat, number=1000
+        )
+        # Packages that were extracted by previous versions have no manifest in their
+        # metadata, such that it is read from the storage
+        yield "update_package_fields", {
+            "package": "many_files",
+            "manifest": "storage",
+        }, measure(
+            lambda _: block.update_package_fields(),
+            self.repeat,
+            setup=lambda: block.package_meta.pop("manifest", None),
+        )
+
+    def bench_student_view(self):
+        block = self.make_extracted_block(self.packages["small"])
+        scorm_data = scormdata.pack(
+            {
+                "cmi.location": "page12",
+                "cmi.suspend_data": "0123456789abcdef" * 1000,
+                **{
+                    "cmi.interactions.{}.result".format(index): "correct"
+                    for index in range(50)
+                },
+            }
+        )
+
+        def render(_):
+            # Views are rendered by new xblock instances on every request
+            view_block = make_block(
+                self.storage,
+                package_meta=block.package_meta,
+                index_page_path=block.index_page_path,
+                scorm_version=block.scorm_version,
+                scorm_data=scorm_data,
+                has_score=True,
+            )
+            view_block.student_view()
+
+        render(None)
+        yield "student_view", {"package": "small"}, measure(
+            render, self.repeat, number=100
+        )
+
+    def bench_scorm_set_values(self):
+        for batch_size in SET_VALUES_BATCH_SIZES:
+            block = make_block(self.storage, has_score=True)
+            rng = random.Random(batch_size)
+
+            def make_request():
+                values = [
+                    {"name": "cmi.core.score.raw", "value": str(rng.randint(0, 100))},
+                    {"name": "cmi.suspend_data", "value": randbytes(rng, 2000).hex()},
+                ]
+                values += [
+                    {
+                        "name": "cmi.interactions.{}.result".format(index),
+                        "value": rng.choice(["correct", "wrong"]),
+                    }
+                    for index in range(batch_size - len(values))
+                ]
+                return mock.Mock(
+                    method="POST",
+                    body=json.dumps(values[:batch_size]).encode(),
+                )
+
+            stats = measure(
+                lambda request, block=block: block.scorm_set_values(request),
+                self.repeat,
+                number=1,
+                setup=make_request,
+            )
+            stats["values_per_second"] = batch_size / stats["median"]
+            yield "scorm_set_values", {"batch_size": batch_size}, stats
+
+    def make_extracted_block(self, package):
+        sha1 = ScormXBlock.get_sha1(package)
+        block = make_block(
+            self.storage,
+            package_meta={
+                "sha1": sha1,
+                "name": "package.zip",
+                "layout": packages.SHARED_LAYOUT,
+            },
+        )
+        if not self.storage.exists(block.extract_folder_path):
+            block.extract_package(package)
+        block.package_meta["manifest"] = block.read_extracted_manifest(
+            block.extract_folder_path
+        )
+        block.update_package_fields()
+        return block
+
+
+def compare(results, baseline, tolerance):
+    """
+    Return the list of results that are slower than in the baseline by more than the
+    tolerance. Each regression is a dict with the benchmark name, parameters and ratio
+    of median durations.
+    """
+
+    def key(result):
+        return result["name"], json.dumps(result["params"], sort_keys=True)
+
+    baseline_medians = {
+        key(result): result["stats"]["median"] for result in baseline["results"]
+    }
+    regressions = []
+    for result in results:
+        baseline_median = baseline_medians.get(key(result))
+        if not baseline_median:
+            continue
+        ratio = result["stats"]["median"] / baseline_median
+        result["baseline_ratio"] = ratio
+        if ratio > 1 + tolerance:
+            regressions.append(
+                {"name": result["name"], "params": result["params"], "ratio": ratio}
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument(
+        "--quick", action="store_true", help="Use smaller packages and fewer rounds"
+    )
+    parser.add_argument(
+        "--filter", help="Only run the benchmarks that include this string"
+    )
+    parser.add_argument("--output", help="Write the results to this file")
+    parser.add_argument("--baseline", help="Compare to the results of a previous run")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    benchmarks = Benchmarks(quick=args.quick)
+    results = []
+    try:
+        # Patched in case packages are not found in the storage
+        with mock.patch("openedxscorm_v2.scormxblock.contentstore"):
+            for attribute in dir(benchmarks):
+                if not attribute.startswith("bench_"):
+                    continue
+                if args.filter and args.filter not in attribute:
+                    continue
+                for name, params, stats in getattr(benchmarks, attribute)():
+                    results.append({"name": name, "params": params, "stats": stats})
+    finally:
+        benchmarks.close()
+
+    report = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": args.quick,
+        "results": results,
+    }
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        report["regressions"] = regressions
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(output)
+    print(output)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
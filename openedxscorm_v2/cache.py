@@ -0,0 +1,109 @@
+"""
+Caches that are shared by all xblocks of a process.
+
+By default, values are stored in a size-bounded, in-memory cache. To share cached values
+between processes, a Django cache alias may be configured instead::
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "CACHE_ALIAS": "default",
+        "CACHE_TIMEOUT": 300,
+        "CACHE_MAX_SIZE": 1024,
+    }
+"""
+from collections import OrderedDict
+import hashlib
+import threading
+import time
+
+from django.core.cache import caches
+
+
+DEFAULT_TIMEOUT = 300
+DEFAULT_MAX_SIZE = 1024
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class TTLCache:
+    """
+    Thread-safe, least-recently-used cache in which items expire after `timeout`
+    seconds. At most `max_size` items are stored.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, max_size=DEFAULT_MAX_SIZE):
+        self.timeout = timeout
+        self.max_size = max_size
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.timeout, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class DjangoCache:
+    """
+    Same interface as the TTLCache, backed by a Django cache. Keys are hashed, such
+    that they are valid for all cache backends.
+    """
+
+    def __init__(self, alias, namespace, timeout=DEFAULT_TIMEOUT):
+        self.alias = alias
+        self.namespace = namespace
+        self.timeout = timeout
+
+    def make_key(self, key):
+        return "openedxscorm_v2.{}.{}".format(
+            self.namespace, hashlib.sha1(str(key).encode()).hexdigest()
+        )
+
+    def get(self, key, default=None):
+        return caches[self.alias].get(self.make_key(key), default)
+
+    def set(self, key, value):
+        caches[self.alias].set(self.make_key(key), value, self.timeout)
+
+    def delete(self, key):
+        caches[self.alias].delete(self.make_key(key))
+
+
+def get_cache(namespace, xblock_settings):
+    """
+    Return the process-wide cache for the given namespace, configured with the
+    CACHE_ALIAS, CACHE_TIMEOUT and CACHE_MAX_SIZE xblock settings.
+    """
+    alias = xblock_settings.get("CACHE_ALIAS")
+    timeout = xblock_settings.get("CACHE_TIMEOUT", DEFAULT_TIMEOUT)
+    max_size = xblock_settings.get("CACHE_MAX_SIZE", DEFAULT_MAX_SIZE)
+    config = (namespace, alias, timeout, max_size)
+    with _caches_lock:
+        if config not in _caches:
+            if alias:
+                _caches[config] = DjangoCache(alias, namespace, timeout=timeout)
+            else:
+                _caches[config] = TTLCache(timeout=timeout, max_size=max_size)
+        return _caches[config]
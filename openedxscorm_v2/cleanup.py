@@ -0,0 +1,217 @@
+"""
+Garbage collection of extracted packages.
+
+Extracted packages are not always deleted as soon as they are no longer used: shared
+packages are kept until their last reference is removed, and xblocks that are deleted
+from a course leave their extraction folders behind. To collect them, run periodically,
+e.g. from a cron job or a Celery beat task::
+
+    from openedxscorm_v2 import cleanup
+
+    report = cleanup.collect_garbage(
+        storage, "scorm", xblocks=cleanup.iter_scorm_xblocks(), dry_run=True
+    )
+
+`xblocks` must include all the SCORM xblocks that store their packages in this storage
+location, in all their versions: draft and published versions may use different
+packages, while they hold a single reference. The packages that these xblocks use are
+never collected, whatever their references. The references that they do not hold are
+removed, and the shared packages that are no longer referenced are collected, as well as
+the folders that they do not use: per-xblock folders of deleted xblocks and previous
+package versions.
+
+The storage location may be shared with other SCORM xblocks, such as the original
+openedxscorm xblock, which use the same folder names. Thus, the package folders of
+unknown xblocks are only collected when they have a file index or a zip index, which
+are only written by this xblock. Other folders, such as old-style {location}/{block_id}
+folders and packages that were extracted by previous versions, are only collected when
+their name is in the `allowed` list of the caller.
+
+Folders and references that were modified less than `min_age` ago are never collected,
+as they might still be in the process of being extracted or saved.
+"""
+import itertools
+import logging
+import os
+import time
+
+from . import fileindex, packages, zipserving
+
+
+logger = logging.getLogger(__name__)
+
+
+def collect_garbage(
+    storage,
+    location,
+    xblocks,
+    min_age=packages.DEFAULT_MIN_AGE,
+    dry_run=False,
+    workers=packages.DEFAULT_DELETE_WORKERS,
+    allowed=None,
+):
+    """
+    Delete the extracted packages and references that are no longer used, in bulk.
+    Return a report dict, which includes the collected folders and references, as
+    well as deletion throughput.
+    """
+    started = time.monotonic()
+    deleter = packages.BulkDeleter(storage, workers=workers, dry_run=dry_run)
+    used_references, used_folders, used_packages = get_used_paths(xblocks)
+    references = list(
+        find_stale_references(storage, location, used_references, min_age)
+    )
+    folders = list(
+        find_unused_folders(storage, location, used_folders, min_age, allowed=allowed)
+    )
+    for sha1 in packages.find_unreferenced_packages(
+        storage, location, min_age=min_age, ignore=set(references)
+    ):
+        # References are not enough: they are shared by the versions of an xblock
+        if sha1 not in used_packages:
+            folders.append(packages.package_path(location, sha1))
+
+    for path in references + folders:
+        logger.info(
+            "%s SCORM storage path %s",
+            "Would collect" if dry_run else "Collecting",
+            path,
+        )
+    deleter.delete(references)
+    deleter.delete(
+        itertools.chain.from_iterable(
+            packages.list_folder_files(storage, folder) for folder in folders
+        )
+    )
+
+    duration = time.monotonic() - started
+    report = {
+        "dry_run": dry_run,
+        "references": references,
+        "folders": folders,
+        "files_deleted": deleter.files_deleted,
+        "requests": deleter.requests,
+        "errors": deleter.errors,
+        "duration": duration,
+        "files_per_second": deleter.files_deleted / duration if duration else 0,
+    }
+    logger.info(
+        "Collected %d SCORM folders and %d references: %d files deleted in %.1fs "
+        "(%.1f files/s, %d requests, %d errors)%s",
+        len(folders),
+        len(references),
+        report["files_deleted"],
+        duration,
+        report["files_per_second"],
+        report["requests"],
+        report["errors"],
+        " [dry run]" if dry_run else "",
+    )
+    return report
+
+
+def get_used_paths(xblocks):
+    """
+    Return the references that are held by the xblocks, as a set of paths, the
+    folders that they use, as a dict, and the sha1 of the packages that they use, as a
+    set. Keys of the dict are the names of the per-xblock folders; values are the sets
+    of package sub-folders that are in use, or None when the whole folder is in use.
+    """
+    used_references = set()
+    used_folders = {}
+    used_packages = set()
+    for xblock in xblocks:
+        location = xblock.scorm_location()
+        sha1 = xblock.package_meta.get("sha1")
+        layout = xblock.package_meta.get("layout")
+        used = used_folders.setdefault(xblock.hashed_usage_id, set())
+        if sha1:
+            used_packages.add(sha1)
+        if sha1 and layout == packages.SHARED_LAYOUT:
+            used_references.add(
+                os.path.join(
+                    packages.references_path(location, sha1), xblock.hashed_usage_id
+                )
+            )
+        elif sha1 and used is not None:
+            used.add(sha1)
+        # Files of old-style folders might be stored directly in the folder
+        used_folders[xblock.location.block_id] = None
+    return used_references, used_folders, used_packages
+
+
+def find_stale_references(storage, location, used_references, min_age):
+    """
+    Iterate on the paths of the shared package references that are not in use, and
+    that were added more than `min_age` ago.
+    """
+    root = os.path.join(location, packages.REFS_FOLDER)
+    if not storage.exists(root):
+        return
+    for sha1 in storage.listdir(root)[0]:
+        for ref in packages.get_references(storage, location, sha1):
+            path = os.path.join(packages.references_path(location, sha1), ref)
+            if path not in used_references and packages.is_file_older_than(
+                storage, path, min_age
+            ):
+                yield path
+
+
+def find_unused_folders(storage, location, used_folders, min_age, allowed=None):
+    """
+    Iterate on the per-xblock folders of `location`, or on their package sub-folders,
+    that are not in use. The folders of unknown xblocks are only collected when they
+    are in `allowed`; otherwise, only their package sub-folders that have an index are.
+    """
+    allowed = set(allowed or ())
+    if not storage.exists(location):
+        return
+    for name in storage.listdir(location)[0]:
+        if name in [packages.PACKAGES_FOLDER, packages.REFS_FOLDER]:
+            continue
+        path = os.path.join(location, name)
+        if name in used_folders and used_folders[name] is None:
+            continue
+        known = name in used_folders or name in allowed
+        used = used_folders.get(name)
+        if name in allowed and packages.is_older_than(storage, path, min_age):
+            yield path
+            continue
+        for subfolder in storage.listdir(path)[0]:
+            subfolder_path = os.path.join(path, subfolder)
+            if subfolder in (used or ()):
+                continue
+            if not known and not has_package_index(storage, subfolder_path):
+                continue
+            if packages.is_older_than(storage, subfolder_path, min_age):
+                yield subfolder_path
+
+
+def has_package_index(storage, path):
+    """
+    Return True if the `path` folder has a file index or a zip index.
+    """
+    return storage.exists(fileindex.index_path(path)) or storage.exists(
+        zipserving.index_path(path)
+    )
+
+
+def iter_scorm_xblocks():
+    """
+    Iterate on the draft and published versions of all the SCORM xblocks of the
+    platform, from the modulestore.
+    """
+    # pylint: disable=import-outside-toplevel
+    from xmodule.modulestore import ModuleStoreEnum
+    from xmodule.modulestore.django import modulestore
+
+    store = modulestore()
+    for course in store.get_courses():
+        for branch in [
+            ModuleStoreEnum.Branch.draft_preferred,
+            ModuleStoreEnum.Branch.published_only,
+        ]:
+            with store.branch_setting(branch, course.id):
+                yield from store.get_items(
+                    course.id, qualifiers={"category": "scorm_v2"}
+                )
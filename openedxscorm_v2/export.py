@@ -0,0 +1,167 @@
+"""
+Bulk export of the SCORM results of learners.
+
+Learner states are read from the courseware StudentModule table, by chunks of rows, such
+that memory usage does not depend on the number of learners. For instance, to export
+the results of all SCORM xblocks of a course, from an LMS shell::
+
+    from openedxscorm_v2 import export
+
+    with open("results.csv", "w", newline="") as f:
+        export.write_csv(
+            export.export_learner_states(
+                course_key="course-v1:org+course+run",
+                cmi_keys=["cmi.location", "cmi.completion_status"],
+            ),
+            f,
+            cmi_keys=["cmi.location", "cmi.completion_status"],
+        )
+
+Each exported row is a dict with the EXPORT_FIELDS keys, plus the requested CMI
+elements. Only the requested elements are decoded from the SCORM runtime data: in
+particular, compressed suspend data is only decompressed when it is requested.
+"""
+import csv
+import json
+
+from . import scormdata
+
+
+BLOCK_TYPE = "scorm_v2"
+DEFAULT_CHUNK_SIZE = 1000
+
+EXPORT_FIELDS = [
+    "user_id",
+    "username",
+    "usage_key",
+    "lesson_status",
+    "success_status",
+    "lesson_score",
+    "grade",
+    "max_grade",
+    "modified",
+]
+
+# Columns that are fetched from the StudentModule table, in this order
+RECORD_FIELDS = [
+    "id",
+    "student_id",
+    "student__username",
+    "module_state_key",
+    "state",
+    "grade",
+    "max_grade",
+    "modified",
+]
+
+
+def export_learner_states(
+    course_key=None, usage_key=None, cmi_keys=(), chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """
+    Iterate on the results of learners, by lists of at most `chunk_size` rows. Results
+    are exported for a single xblock, if `usage_key` is defined, or for all the SCORM
+    xblocks of a course.
+    """
+    for records in iter_student_module_records(
+        course_key=course_key, usage_key=usage_key, chunk_size=chunk_size
+    ):
+        yield [get_row(record, cmi_keys) for record in records]
+
+
+def iter_student_module_records(
+    course_key=None, usage_key=None, chunk_size=DEFAULT_CHUNK_SIZE
+):
+    """
+    Iterate on lists of StudentModule records, which are tuples of RECORD_FIELDS
+    values. Rows are fetched with keyset pagination on their id, which remains fast
+    on large tables, unlike offset pagination.
+    """
+    # pylint: disable=import-outside-toplevel
+    from lms.djangoapps.courseware.models import StudentModule
+    from opaque_keys.edx.keys import CourseKey, UsageKey
+
+    if usage_key is not None:
+        if isinstance(usage_key, str):
+            usage_key = UsageKey.from_string(usage_key)
+        queryset = StudentModule.objects.filter(
+            course_id=usage_key.course_key, module_state_key=usage_key
+        )
+    elif course_key is not None:
+        if isinstance(course_key, str):
+            course_key = CourseKey.from_string(course_key)
+        queryset = StudentModule.objects.filter(
+            course_id=course_key, module_type=BLOCK_TYPE
+        )
+    else:
+        raise ValueError("Either course_key or usage_key must be defined")
+
+    last_id = 0
+    while True:
+        records = list(
+            queryset.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list(*RECORD_FIELDS)[:chunk_size]
+        )
+        if not records:
+            return
+        yield records
+        last_id = records[-1][0]
+
+
+def get_row(record, cmi_keys=()):
+    """
+    Convert a StudentModule record to an exported row.
+    """
+    (
+        _id,
+        user_id,
+        username,
+        usage_key,
+        state,
+        grade,
+        max_grade,
+        modified,
+    ) = record
+    state = json.loads(state or "{}")
+    row = {
+        "user_id": user_id,
+        "username": username,
+        "usage_key": str(usage_key),
+        "lesson_status": state.get("lesson_status", "not attempted"),
+        "success_status": state.get("success_status", "unknown"),
+        "lesson_score": state.get("lesson_score", 0),
+        "grade": grade,
+        "max_grade": max_grade,
+        "modified": modified.isoformat() if modified else None,
+    }
+    packed = state.get("scorm_data") or {}
+    for key in cmi_keys:
+        row[key] = scormdata.get_value(packed, key)
+    return row
+
+
+def write_csv(chunks, fileobj, cmi_keys=()):
+    """
+    Write the exported rows to a CSV file object, with a header row. Return the number
+    of written rows.
+    """
+    writer = csv.DictWriter(fileobj, fieldnames=EXPORT_FIELDS + list(cmi_keys))
+    writer.writeheader()
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def write_jsonl(chunks, fileobj):
+    """
+    Write the exported rows to a file object, as one JSON object per line. Return the
+    number of written rows.
+    """
+    count = 0
+    for rows in chunks:
+        fileobj.writelines(json.dumps(row) + "\n" for row in rows)
+        count += len(rows)
+    return count
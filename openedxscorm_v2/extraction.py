@@ -0,0 +1,421 @@
+"""
+Extraction of SCORM package members to a Django storage backend.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import logging
+import posixpath
+import shutil
+import tempfile
+import threading
+
+from django.core.files.base import File
+
+from . import instrumentation
+
+
+logger = logging.getLogger(__name__)
+
+# Decompressed members that are smaller than this are buffered in memory before they
+# are uploaded; larger members are spooled to a temporary file.
+SPOOL_MAX_MEMORY = 1024 * 1024
+
+# Limits that protect workers from zip bombs. The compression ratio of members that are
+# smaller than RATIO_CHECK_MIN_SIZE is not checked, as small text files are often very
+# compressible.
+ExtractionLimits = namedtuple(
+    "ExtractionLimits", ["max_uncompressed_size", "max_file_count", "max_ratio"]
+)
+DEFAULT_LIMITS = ExtractionLimits(
+    max_uncompressed_size=2 * 1024 * 1024 * 1024,
+    max_file_count=20000,
+    max_ratio=100,
+)
+RATIO_CHECK_MIN_SIZE = 1024 * 1024
+# Manifests are parsed before the package is extracted, and they are never that large
+MAX_MANIFEST_SIZE = 16 * 1024 * 1024
+
+
+class UnsafePackageError(Exception):
+    """
+    The package exceeds the extraction limits, or contains members with unsafe paths.
+    """
+
+
+class BoundedReader:
+    """
+    Wrapper of a zip member file object, which raises an UnsafePackageError when more
+    than `max_size` bytes are read from it, whatever the declared size of the member.
+    """
+
+    def __init__(self, fileobj, max_size, name=""):
+        self.fileobj = fileobj
+        self.max_size = max_size
+        self.name = name
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        remaining = self.max_size + 1 - self.bytes_read
+        data = self.fileobj.read(remaining if size < 0 else min(size, remaining))
+        self.bytes_read += len(data)
+        if self.bytes_read > self.max_size:
+            raise UnsafePackageError(
+                "Invalid package: '{}' is too large (> {} bytes)".format(
+                    self.name, self.max_size
+                )
+            )
+        return data
+
+
+def get_member_path(filename, root_path):
+    """
+    Return the path of a zip member relative to the `root_path` folder, or None if it
+    is not below this folder. Raise an UnsafePackageError if the member path is
+    absolute or goes up the folder hierarchy.
+    """
+    name = filename.replace("\\", "/")
+    path = posixpath.normpath(name)
+    if (
+        posixpath.isabs(name)
+        or path == ".."
+        or path.startswith("../")
+        or ":" in path.split("/")[0]
+    ):
+        raise UnsafePackageError(
+            "Invalid package: unsafe file path '{}'".format(filename)
+        )
+    root_path = posixpath.normpath(root_path.replace("\\", "/")) if root_path else "."
+    if root_path != ".":
+        if not path.startswith(root_path + "/"):
+            return None
+        path = path[len(root_path) + 1 :]
+    return path
+
+
+def check_limits(members, limits):
+    """
+    Raise an UnsafePackageError if the members, which are (ZipInfo, destination path)
+    tuples, exceed the limits. Only the zip central directory is read, such that
+    packages are rejected before any file is decompressed or written.
+    """
+    if len(members) > limits.max_file_count:
+        raise UnsafePackageError(
+            "Invalid package: too many files ({} > {})".format(
+                len(members), limits.max_file_count
+            )
+        )
+    total_size = sum(zipinfo.file_size for zipinfo, _dest_path in members)
+    if total_size > limits.max_uncompressed_size:
+        raise UnsafePackageError(
+            "Invalid package: uncompressed size is too large ({} > {} bytes)".format(
+                total_size, limits.max_uncompressed_size
+            )
+        )
+    total_compressed_size = sum(
+        zipinfo.compress_size for zipinfo, _dest_path in members
+    )
+    for zipinfo, _dest_path in members:
+        if zipinfo.file_size >= RATIO_CHECK_MIN_SIZE and zipinfo.file_size > (
+            limits.max_ratio * max(zipinfo.compress_size, 1)
+        ):
+            raise UnsafePackageError(
+                "Invalid package: suspicious compression ratio for '{}'".format(
+                    zipinfo.filename
+                )
+            )
+    if total_size >= RATIO_CHECK_MIN_SIZE and total_size > (
+        limits.max_ratio * max(total_compressed_size, 1)
+    ):
+        raise UnsafePackageError("Invalid package: suspicious compression ratio")
+
+
+class ZipExtractor:
+    """
+    Write zip members to a storage backend.
+
+    With a single worker, members are streamed one after the other from the zip file
+    to the storage. With more workers, members are decompressed in the calling thread
+    and uploaded by a bounded thread pool, such that decompression overlaps with
+    uploads. At most `2 * workers` decompressed members are buffered at any time.
+
+    Members are saved to the same destination paths, whatever the number of workers.
+    If any member fails to be saved, no further upload is started, the members that
+    were already saved are deleted, unless `rollback` is False, and the error is raised.
+
+    The optional `on_progress` callback is called with the extractor as argument
+    after every saved member. The optional `on_saved` callback is called with the
+    destination path and the list of precompressed variants of every saved member.
+    Both may be called concurrently from different threads.
+
+    Members are checked against the extraction `limits` before anything is written.
+    The decompressed bytes are also counted while they are streamed, such that members
+    that decompress to more than their declared size are rejected.
+
+    Members that are identical to files which are already in the storage may be copied
+    from these files with the `copy` function, which takes the source and destination
+    paths as arguments. This is useful when the storage supports server-side copies.
+    When a copy fails, the member is extracted from the zip file instead.
+
+    Members are saved by the optional `publisher`, which is a
+    `publishing.AssetPublisher`, or else with `storage.save`. The precompressed variants
+    written by the publisher are stored in the `variants` dict, indexed by member
+    destination path.
+    """
+
+    def __init__(
+        self,
+        storage,
+        workers=1,
+        on_progress=None,
+        limits=DEFAULT_LIMITS,
+        copy=None,
+        publisher=None,
+        on_saved=None,
+        rollback=True,
+    ):
+        self.storage = storage
+        self.workers = max(1, workers)
+        self.on_progress = on_progress
+        self.on_saved = on_saved
+        self.rollback = rollback
+        self.limits = limits
+        self.copy = copy
+        self.publisher = publisher
+        self.variants = {}
+        self.total_files = 0
+        self.total_bytes = 0
+        self.bytes_read = 0
+        self.files_extracted = 0
+        self.bytes_written = 0
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self._lock = threading.Lock()
+
+    def extract(self, scorm_zipfile, members, sources=None):
+        """
+        Extract the members of an open ZipFile. `members` is a list of
+        (ZipInfo, destination path) tuples. Return the list of saved paths, in the
+        same order as `members`.
+
+        `sources` is an optional dict of storage paths, indexed by destination path,
+        of files that are identical to the members. These members are copied from
+        their source, provided that the extractor has a `copy` function.
+        """
+        self.check(members)
+        sources = (sources or {}) if self.copy else {}
+        saved = [None] * len(members)
+        self.total_files = len(members)
+        self.total_bytes = sum(zipinfo.file_size for zipinfo, _dest_path in members)
+        try:
+            if self.workers == 1:
+                for index, (zipinfo, dest_path) in enumerate(members):
+                    if dest_path in sources:
+                        self._copy(
+                            index, scorm_zipfile, zipinfo, dest_path, sources, saved
+                        )
+                        continue
+                    self._extract(index, scorm_zipfile, zipinfo, dest_path, saved)
+            else:
+                self._extract_concurrently(scorm_zipfile, members, sources, saved)
+        except BaseException:
+            if self.rollback:
+                self._rollback(saved)
+            raise
+        return saved
+
+    def check(self, members):
+        """
+        Raise an UnsafePackageError if the members exceed the extraction limits. This is
+        also done by `extract`, before anything is written.
+        """
+        check_limits(members, self.limits)
+
+    def _extract_concurrently(self, scorm_zipfile, members, sources, saved):
+        buffers = {}
+        # Storage requests of the workers are attributed to the current operation
+        copy = instrumentation.propagate(self._copy)
+        upload = instrumentation.propagate(self._upload)
+        with ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="scorm-extract"
+        ) as executor:
+            pending = set()
+            try:
+                for index, (zipinfo, dest_path) in enumerate(members):
+                    while len(pending) >= 2 * self.workers:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            future.result()
+                    if dest_path in sources:
+                        pending.add(
+                            executor.submit(
+                                copy,
+                                index,
+                                scorm_zipfile,
+                                zipinfo,
+                                dest_path,
+                                sources,
+                                saved,
+                            )
+                        )
+                        continue
+                    buffer = self._decompress(scorm_zipfile, zipinfo)
+                    future = executor.submit(
+                        upload, index, dest_path, buffer, zipinfo.file_size, saved
+                    )
+                    buffers[future] = buffer
+                    pending.add(future)
+                for future in wait(pending).done:
+                    future.result()
+            except BaseException:
+                for future in pending:
+                    if future.cancel() and future in buffers:
+                        buffers[future].close()
+                raise
+
+    def _copy(self, index, scorm_zipfile, zipinfo, dest_path, sources, saved):
+        """
+        Copy a member from its source file. Fall back to extracting it from the zip
+        file, which supports concurrent reads, if the copy fails.
+        """
+        try:
+            saved[index] = self.copy(sources[dest_path], dest_path)
+        except Exception:  # pylint: disable=broad-except
+            logger.warning(
+                "Could not copy %s to %s", sources[dest_path], dest_path, exc_info=True
+            )
+            self._extract(index, scorm_zipfile, zipinfo, dest_path, saved)
+            return
+        with self._lock:
+            self.files_extracted += 1
+            self.bytes_written += zipinfo.file_size
+            self.files_copied += 1
+            self.bytes_copied += zipinfo.file_size
+        if self.on_saved:
+            self.on_saved(dest_path, [])
+        if self.on_progress:
+            self.on_progress(self)
+
+    def _extract(self, index, scorm_zipfile, zipinfo, dest_path, saved):
+        """
+        Stream a member from the zip file to the storage.
+        """
+        if self._is_compressible(dest_path, zipinfo.file_size):
+            # Variants are compressed from the decompressed member
+            buffer = self._decompress(scorm_zipfile, zipinfo)
+            self._upload(index, dest_path, buffer, zipinfo.file_size, saved)
+            return
+        with self._open(scorm_zipfile, zipinfo) as member:
+            saved[index] = self._save(dest_path, member, zipinfo.file_size)
+
+    def _open(self, scorm_zipfile, zipinfo):
+        return MemberReader(self, scorm_zipfile.open(zipinfo), zipinfo)
+
+    def _decompress(self, scorm_zipfile, zipinfo):
+        buffer = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_MEMORY)
+        try:
+            with self._open(scorm_zipfile, zipinfo) as member:
+                shutil.copyfileobj(member, buffer)
+        except BaseException:
+            buffer.close()
+            raise
+        buffer.seek(0)
+        return buffer
+
+    def _upload(self, index, dest_path, buffer, size, saved):
+        with buffer:
+            saved[index] = self._save(dest_path, buffer, size, buffered=True)
+
+    def _is_compressible(self, dest_path, size):
+        return self.publisher is not None and self.publisher.is_compressible(
+            dest_path, size
+        )
+
+    def _save(self, dest_path, fileobj, size, buffered=False):
+        """
+        Save a member to the storage. Variants can only be compressed from `buffered`
+        members, which can be read again.
+        """
+        content = File(fileobj)
+        content.size = size
+        variants = []
+        if self.publisher is None:
+            path = self.storage.save(dest_path, content)
+        else:
+            path = self.publisher.publish(dest_path, content)
+            if buffered and self._is_compressible(dest_path, size):
+                variants = self.publisher.publish_variants(dest_path, fileobj, size)
+                with self._lock:
+                    self.variants[dest_path] = variants
+        with self._lock:
+            self.files_extracted += 1
+            self.bytes_written += size
+        if self.on_saved:
+            self.on_saved(dest_path, variants)
+        if self.on_progress:
+            self.on_progress(self)
+        return path
+
+    def _rollback(self, saved):
+        variant_paths = [
+            variant[0] for variants in self.variants.values() for variant in variants
+        ]
+        for path in saved + variant_paths:
+            if path is None:
+                continue
+            try:
+                self.storage.delete(path)
+            except Exception:  # pylint: disable=broad-except
+                logger.warning("Could not delete partially extracted file %s", path)
+
+
+class MemberReader:
+    """
+    File object that counts the bytes that are read from a zip member. An
+    UnsafePackageError is raised as soon as the member is larger than its declared size,
+    or the total of bytes read by the extractor exceeds the limits.
+    """
+
+    def __init__(self, extractor, member, zipinfo):
+        self.extractor = extractor
+        self.member = member
+        self.zipinfo = zipinfo
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.member.read(size)
+        self.bytes_read += len(data)
+        if self.bytes_read > self.zipinfo.file_size:
+            raise UnsafePackageError(
+                "Invalid package: '{}' is larger than declared".format(
+                    self.zipinfo.filename
+                )
+            )
+        with self.extractor._lock:  # pylint: disable=protected-access
+            self.extractor.bytes_read += len(data)
+            if self.extractor.bytes_read > self.extractor.limits.max_uncompressed_size:
+                raise UnsafePackageError(
+                    "Invalid package: uncompressed size is too large"
+                )
+        return data
+
+    @staticmethod
+    def readable():
+        return True
+
+    @staticmethod
+    def seekable():
+        # Seeking back would decompress the member again
+        return False
+
+    @property
+    def closed(self):
+        return self.member.closed
+
+    def close(self):
+        self.member.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
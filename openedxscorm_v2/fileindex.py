@@ -0,0 +1,163 @@
+"""
+Index of the files of an extracted package.
+
+When a package is extracted, the list of its files is written to a sidecar object at
+the root of the extraction folder, such as::
+
+    {
+        "version": 1,
+        "file_count": 2,
+        "size": 21504,
+        "files": {
+            "index.html": [1024, 2736563821, "text/html"],
+            "js/app.js": [20480, 401212943, "application/javascript"],
+        },
+    }
+
+Each file is described by its size, CRC-32 and content type. Thanks to this index, files
+can be looked up and deleted without listing the storage folders, which is slow on
+remote storage backends such as S3: every listdir call is a paginated request. The
+number of files and the total size of the package members, excluding precompressed
+variants, are stored as well.
+
+The index is saved after all files were extracted, such that it also marks the
+extraction as complete. Folders that were extracted by previous versions do not have
+an index: callers must then fall back to listing the storage.
+
+While a package is being extracted, a partial index of the files that were saved so far
+may be saved periodically as a `Checkpoint`, from which an interrupted extraction can
+be resumed.
+"""
+import json
+import mimetypes
+import os
+import threading
+
+from django.core.files.base import ContentFile
+
+
+INDEX_FILENAME = ".scorm-index.json"
+CHECKPOINT_FILENAME = ".scorm-checkpoint.json"
+FORMAT_VERSION = 1
+
+
+def index_path(folder):
+    return os.path.join(folder, INDEX_FILENAME)
+
+
+def make_index(entries, file_count=None, size=None):
+    """
+    Create an index from (path, size, crc) tuples, where paths are relative to the
+    extraction folder. `file_count` and `size` describe the package members; they
+    default to the totals of all entries.
+    """
+    files = {
+        path: [entry_size, crc, mimetypes.guess_type(path)[0]]
+        for path, entry_size, crc in entries
+    }
+    return {
+        "version": FORMAT_VERSION,
+        "file_count": len(files) if file_count is None else file_count,
+        "size": sum(entry[0] for entry in files.values()) if size is None else size,
+        "files": files,
+    }
+
+
+def get_totals(index):
+    """
+    Return the number of files and the total size of the package members of an index.
+    """
+    if "file_count" in index:
+        return index["file_count"], index["size"]
+    return len(index["files"]), sum(entry[0] for entry in index["files"].values())
+
+
+def save_index(storage, folder, index):
+    save_json(storage, index_path(folder), index)
+
+
+def load_index(storage, folder):
+    """
+    Return the index of the package extracted in `folder`, or None if the folder does
+    not have one.
+    """
+    return load_json(storage, index_path(folder))
+
+
+def save_json(storage, path, index):
+    if storage.exists(path):
+        # Otherwise, the storage would save the index under a different name
+        storage.delete(path)
+    storage.save(path, ContentFile(json.dumps(index, separators=(",", ":"))))
+
+
+def load_json(storage, path):
+    if not storage.exists(path):
+        return None
+    with storage.open(path) as f:
+        index = json.loads(f.read())
+    if index.get("version") != FORMAT_VERSION:
+        return None
+    return index
+
+
+def find_file(index, filename):
+    """
+    Return the relative path of the least nested file with the given name, or None.
+    """
+    paths = [
+        path for path in index["files"] if os.path.basename(path) == filename
+    ]
+    if not paths:
+        return None
+    return min(paths, key=lambda path: (path.count("/"), path))
+
+
+class Checkpoint:
+    """
+    Partial index of a package that is being extracted. Files are added once they are
+    saved, and the checkpoint is saved to the storage after every `interval` additions,
+    such that an interrupted extraction can be resumed from the last saved checkpoint.
+    """
+
+    def __init__(self, storage, folder, interval):
+        self.storage = storage
+        self.path = os.path.join(folder, CHECKPOINT_FILENAME)
+        self.interval = max(1, interval)
+        self.files = {}
+        self._unsaved = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Load the files of the checkpoint that was saved by an interrupted extraction, if
+        any, and return them.
+        """
+        checkpoint = load_json(self.storage, self.path)
+        self.files = checkpoint["files"] if checkpoint else {}
+        return self.files
+
+    def add(self, entries):
+        """
+        Add (path, size, crc) entries of saved files.
+        """
+        with self._lock:
+            for path, size, crc in entries:
+                self.files[path] = [size, crc, mimetypes.guess_type(path)[0]]
+            self._unsaved += 1
+            if self._unsaved >= self.interval:
+                self._save()
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        save_json(
+            self.storage, self.path, {"version": FORMAT_VERSION, "files": self.files}
+        )
+        self._unsaved = 0
+
+    def delete(self):
+        if self.storage.exists(self.path):
+            self.storage.delete(self.path)
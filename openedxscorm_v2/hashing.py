@@ -0,0 +1,64 @@
+"""
+Fingerprints of SCORM packages.
+
+Packages are identified by the digest of their zip file, which names their extraction
+folder. SHA-1 is used by default, as in previous versions. Other algorithms may be
+faster on some hardware, such as BLAKE2b on 64-bit CPUs without SHA extensions::
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "HASH_ALGORITHM": "blake2b",
+    }
+
+BLAKE2 digests are truncated to 20 bytes, like SHA-1 digests, such that folder names
+keep the same length. Changing the algorithm does not affect packages that were already
+extracted: their digest is stored in the package metadata. Packages are then extracted
+again when they are next uploaded.
+"""
+import hashlib
+
+
+DEFAULT_ALGORITHM = "sha1"
+BUFFER_SIZE = 1024 * 1024
+
+# Digest sizes of the algorithms with a variable digest size
+DIGEST_SIZES = {"blake2b": 20, "blake2s": 20}
+
+
+def is_supported(algorithm):
+    """
+    Return True if `algorithm` is available and has a fixed digest size. Extendable
+    output functions, such as SHAKE, require a digest length.
+    """
+    if algorithm not in hashlib.algorithms_available:
+        return False
+    return new_hash(algorithm).digest_size > 0
+
+
+def new_hash(algorithm=DEFAULT_ALGORITHM):
+    if algorithm in DIGEST_SIZES:
+        return getattr(hashlib, algorithm)(digest_size=DIGEST_SIZES[algorithm])
+    return hashlib.new(algorithm)
+
+
+def get_digest(fileobj, algorithm=DEFAULT_ALGORITHM, buffer_size=BUFFER_SIZE):
+    """
+    Return the hex digest of a file object, which is read from its current position
+    with a single reusable buffer, and then rewound to the start.
+    """
+    digest = new_hash(algorithm)
+    buffer = bytearray(buffer_size)
+    view = memoryview(buffer)
+    readinto = getattr(fileobj, "readinto", None)
+    while True:
+        if readinto is not None:
+            size = readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+        else:
+            block = fileobj.read(buffer_size)
+            if not block:
+                break
+            digest.update(block)
+    fileobj.seek(0)
+    return digest.hexdigest()
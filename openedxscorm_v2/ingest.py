@@ -0,0 +1,145 @@
+"""
+Background ingestion of SCORM packages.
+
+Ingestion jobs are run by an executor, which is a function that takes the xblock and
+the job id as arguments and must eventually call `xblock.run_ingest_job(job_id)`. By
+default, jobs are run by a pool of threads in the current process. To run them with
+Celery, define a task that loads the xblock from the modulestore::
+
+    @shared_task
+    def ingest_scorm_package(usage_id, job_id):
+        from openedxscorm_v2.ingest import run_ingest_job_for_usage
+
+        run_ingest_job_for_usage(usage_id, job_id)
+
+    def celery_executor(xblock, job_id):
+        ingest_scorm_package.delay(str(xblock.scope_ids.usage_id), job_id)
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "ASYNC_INGEST": True,
+        "INGEST_EXECUTOR": celery_executor,
+    }
+
+Job status is stored in the Django cache, such that it can be polled from any process.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+import uuid
+
+from django.core.cache import cache
+
+
+JOB_CACHE_KEY = "openedxscorm_v2.ingest.{}"
+# Jobs that are not polled for a day are forgotten
+JOB_TIMEOUT = 24 * 60 * 60
+THREAD_POOL_WORKERS = 2
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+
+def create_job(usage_id, scorm_file):
+    """
+    Create a pending ingestion job and return its id.
+    """
+    job_id = uuid.uuid4().hex
+    save_job(
+        job_id,
+        {
+            "state": PENDING,
+            "usage_id": usage_id,
+            "scorm_file": scorm_file,
+            "files_extracted": 0,
+            "bytes_written": 0,
+            "total_files": 0,
+            "total_bytes": 0,
+            "bytes_copied": 0,
+            "result": None,
+        },
+    )
+    return job_id
+
+
+def get_job(job_id):
+    """
+    Return the job status dict, or None if the job does not exist or expired.
+    """
+    return cache.get(JOB_CACHE_KEY.format(job_id))
+
+
+def save_job(job_id, job):
+    cache.set(JOB_CACHE_KEY.format(job_id), job, JOB_TIMEOUT)
+
+
+def thread_pool_executor(xblock, job_id):
+    """
+    Default executor: run the job in a pool of threads of the current process.
+    """
+    global _thread_pool  # pylint: disable=global-statement
+    with _thread_pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(
+                max_workers=THREAD_POOL_WORKERS, thread_name_prefix="scorm-ingest"
+            )
+    _thread_pool.submit(xblock.run_ingest_job, job_id)
+
+
+def run_ingest_job_for_usage(usage_id, job_id):
+    """
+    Load the xblock from the modulestore, run the ingestion job and save its result to
+    the modulestore. This is meant to be called from a task queue worker, where all
+    arguments must be serializable.
+    """
+    # pylint: disable=import-outside-toplevel
+    from opaque_keys.edx.keys import UsageKey
+    from xmodule.modulestore import ModuleStoreEnum
+    from xmodule.modulestore.django import modulestore
+
+    store = modulestore()
+    with store.branch_setting(ModuleStoreEnum.Branch.draft_preferred):
+        xblock = store.get_item(UsageKey.from_string(usage_id))
+        xblock.run_ingest_job(job_id, apply=True)
+        if "ingest_job" not in xblock.package_meta:
+            store.update_item(xblock, ModuleStoreEnum.UserID.mgmt_command)
+
+
+class ProgressReporter:
+    """
+    Extraction progress callback that saves the job progress, at most once every
+    `interval` seconds.
+    """
+
+    def __init__(self, job_id, job, interval=1):
+        self.job_id = job_id
+        self.job = job
+        self.interval = interval
+        self.extractor = None
+        self.last_saved = None
+        self.lock = threading.Lock()
+
+    def __call__(self, extractor):
+        now = time.monotonic()
+        with self.lock:
+            self.extractor = extractor
+            if self.last_saved is not None and now - self.last_saved < self.interval:
+                return
+            self.last_saved = now
+            self.update_job()
+            save_job(self.job_id, self.job)
+
+    def update_job(self):
+        """
+        Copy the latest extraction progress to the job, without saving it.
+        """
+        if self.extractor is None:
+            return
+        self.job["files_extracted"] = self.extractor.files_extracted
+        self.job["bytes_written"] = self.extractor.bytes_written
+        self.job["total_files"] = self.extractor.total_files
+        self.job["total_bytes"] = self.extractor.total_bytes
+        self.job["bytes_copied"] = self.extractor.bytes_copied
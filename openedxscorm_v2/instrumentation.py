@@ -0,0 +1,365 @@
+"""
+Instrumentation of the xblock lifecycle.
+
+The main xblock operations, such as `student_view`, `extract_package` or the
+`scorm_set_values` handler, are timed, and their latency is attributed to storage
+requests, contentstore requests and CPU time. Metrics are sent to the sink that is
+defined by the METRICS xblock setting, which is a `Metrics` instance, or a function that
+returns one, or the dotted path to either of them. By default, metrics are discarded and
+operations are not instrumented at all. To send metrics to statsd or to expose them to
+Prometheus::
+
+    import statsd
+    from openedxscorm_v2.instrumentation import PrometheusMetrics, StatsdMetrics
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "METRICS": StatsdMetrics(statsd.StatsClient("localhost", 8125)),
+        # or
+        "METRICS": PrometheusMetrics(),
+    }
+
+For every operation, the following metrics are recorded, prefixed with "scorm.":
+
+- "{operation}": wall-clock duration, in seconds
+- "{operation}.storage", "{operation}.contentstore": cumulated durations of the storage
+  and contentstore requests that were made during the operation. Requests that are made
+  concurrently by worker threads may add up to more than the wall-clock duration.
+- "{operation}.cpu": CPU time of the thread that ran the operation
+- "storage.calls": number of storage requests, tagged by operation and method
+- "{operation}.{name}": values that are recorded with `add`, e.g. byte counts
+
+Operations may be nested: requests are attributed to all the operations in progress.
+"""
+import contextlib
+import contextvars
+import functools
+import logging
+import re
+import threading
+import time
+
+from django.utils.module_loading import import_string
+
+try:
+    import prometheus_client
+except ImportError:  # pragma: no cover
+    prometheus_client = None
+
+
+logger = logging.getLogger(__name__)
+
+PREFIX = "scorm"
+
+# Methods of Django storages that are timed by InstrumentedStorage
+STORAGE_METHODS = frozenset(
+    [
+        "delete",
+        "exists",
+        "get_modified_time",
+        "listdir",
+        "open",
+        "save",
+        "size",
+        "url",
+    ]
+)
+
+_current_operation = contextvars.ContextVar("scorm_operation", default=None)
+_sinks = {}
+_sinks_lock = threading.Lock()
+
+
+class Metrics:
+    """
+    Base class of metrics sinks, which must override these three methods. Durations are
+    in seconds; `tags` is a dict of strings, or None.
+    """
+
+    enabled = True
+
+    def timing(self, name, seconds, tags=None):
+        pass
+
+    def increment(self, name, value=1, tags=None):
+        pass
+
+    def gauge(self, name, value, tags=None):
+        pass
+
+
+class NullMetrics(Metrics):
+    """
+    Default sink, which disables instrumentation.
+    """
+
+    enabled = False
+
+
+NULL_METRICS = NullMetrics()
+
+
+class StatsdMetrics(Metrics):
+    """
+    Send metrics with a statsd client, which is typically a `statsd.StatsClient`.
+    Tag values are appended to metric names, as plain statsd does not support tags.
+    """
+
+    def __init__(self, client, prefix=PREFIX):
+        self.client = client
+        self.prefix = prefix
+
+    def get_name(self, name, tags):
+        parts = [self.prefix, name] if self.prefix else [name]
+        parts += [
+            re.sub(r"[^\w-]", "_", str(tags[key])) for key in sorted(tags or {})
+        ]
+        return ".".join(parts)
+
+    def timing(self, name, seconds, tags=None):
+        self.client.timing(self.get_name(name, tags), seconds * 1000)
+
+    def increment(self, name, value=1, tags=None):
+        self.client.incr(self.get_name(name, tags), value)
+
+    def gauge(self, name, value, tags=None):
+        self.client.gauge(self.get_name(name, tags), value)
+
+
+class PrometheusMetrics(Metrics):
+    """
+    Record metrics in a Prometheus registry, which defaults to the global registry of
+    the "prometheus_client" package. Timings are recorded in histograms, increments in
+    counters. Metrics are created on first use, with the tag names as labels.
+    """
+
+    def __init__(self, registry=None, prefix=PREFIX, buckets=None):
+        if prometheus_client is None:
+            raise ImportError(
+                "PrometheusMetrics requires the prometheus_client package"
+            )
+        self.registry = registry or prometheus_client.REGISTRY
+        self.prefix = prefix
+        self.buckets = buckets or prometheus_client.Histogram.DEFAULT_BUCKETS
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def get_metric(self, metric_class, name, tags, **kwargs):
+        name = re.sub(r"\W", "_", "{}_{}".format(self.prefix, name).strip("_"))
+        labels = tuple(sorted(tags or {}))
+        key = (metric_class, name, labels)
+        with self._lock:
+            if key not in self._metrics:
+                self._metrics[key] = metric_class(
+                    name, name, labels, registry=self.registry, **kwargs
+                )
+            metric = self._metrics[key]
+        return metric.labels(**tags) if tags else metric
+
+    def timing(self, name, seconds, tags=None):
+        self.get_metric(
+            prometheus_client.Histogram,
+            name + "_seconds",
+            tags,
+            buckets=self.buckets,
+        ).observe(seconds)
+
+    def increment(self, name, value=1, tags=None):
+        self.get_metric(prometheus_client.Counter, name, tags).inc(value)
+
+    def gauge(self, name, value, tags=None):
+        self.get_metric(prometheus_client.Gauge, name, tags).set(value)
+
+
+def get_metrics(xblock_settings):
+    """
+    Return the metrics sink that is configured by the METRICS xblock setting. Sinks
+    that are built from a dotted path or a function are built once per setting value,
+    such that Prometheus metrics, for instance, are only registered once.
+    """
+    metrics = xblock_settings.get("METRICS") or NULL_METRICS
+    if isinstance(metrics, Metrics):
+        return metrics
+    with _sinks_lock:
+        if metrics not in _sinks:
+            sink = import_string(metrics) if isinstance(metrics, str) else metrics
+            if not isinstance(sink, Metrics) and callable(sink):
+                sink = sink()
+            _sinks[metrics] = sink
+        return _sinks[metrics]
+
+
+class Operation:
+    """
+    Time spent in storage and contentstore requests during an operation. Requests may
+    be tracked by worker threads, so that updates are thread-safe.
+    """
+
+    def __init__(self, name, parent=None):
+        self.name = name
+        self.parent = parent
+        self.durations = {"storage": 0, "contentstore": 0}
+        self.storage_calls = {}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def add_request(self, kind, method, duration):
+        with self._lock:
+            self.durations[kind] = self.durations.get(kind, 0) + duration
+            if kind == "storage":
+                self.storage_calls[method] = self.storage_calls.get(method, 0) + 1
+
+    def add_value(self, name, value):
+        with self._lock:
+            self.values[name] = self.values.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def operation(metrics, name):
+    """
+    Time an operation and report its metrics to the `metrics` sink when it ends. This
+    is a no-op when metrics are disabled.
+    """
+    if not getattr(metrics, "enabled", True):
+        yield
+        return
+    current = Operation(name, parent=_current_operation.get())
+    token = _current_operation.set(current)
+    started = time.perf_counter()
+    cpu_started = time.thread_time()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        cpu = time.thread_time() - cpu_started
+        _current_operation.reset(token)
+        report(metrics, current, duration, cpu)
+
+
+def report(metrics, current, duration, cpu):
+    try:
+        metrics.timing(current.name, duration)
+        metrics.timing(current.name + ".cpu", cpu)
+        for kind, kind_duration in current.durations.items():
+            metrics.timing("{}.{}".format(current.name, kind), kind_duration)
+        for method, count in current.storage_calls.items():
+            metrics.increment(
+                "storage.calls",
+                count,
+                tags={"operation": current.name, "method": method},
+            )
+        for name, value in current.values.items():
+            metrics.gauge("{}.{}".format(current.name, name), value)
+    except Exception:  # pylint: disable=broad-except
+        # Metrics must never break the xblock
+        logger.exception("Could not report the metrics of %s", current.name)
+    logger.debug(
+        "SCORM %s: %.3fs (storage: %.3fs, contentstore: %.3fs, cpu: %.3fs), "
+        "storage calls: %s",
+        current.name,
+        duration,
+        current.durations["storage"],
+        current.durations["contentstore"],
+        cpu,
+        current.storage_calls,
+    )
+
+
+def timed(name):
+    """
+    Decorator of xblock methods, which runs them as the `name` operation with the
+    metrics sink of the xblock.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(xblock, *args, **kwargs):
+            with operation(xblock.metrics, name):
+                return func(xblock, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+@contextlib.contextmanager
+def track(kind, method):
+    """
+    Attribute the duration of a "storage" or "contentstore" request to the operations
+    in progress, if any.
+    """
+    current = _current_operation.get()
+    if current is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - started
+        while current is not None:
+            current.add_request(kind, method, duration)
+            current = current.parent
+
+
+def add(name, value):
+    """
+    Add a value, such as a number of bytes, to the operations in progress, if any.
+    """
+    current = _current_operation.get()
+    while current is not None:
+        current.add_value(name, value)
+        current = current.parent
+
+
+def propagate(func):
+    """
+    Return a function that runs `func` in the operations that are currently in
+    progress. This is required for requests that are made by worker threads to be
+    attributed to these operations.
+    """
+    current = _current_operation.get()
+    if current is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_operation.set(current)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_operation.reset(token)
+
+    return wrapper
+
+
+def instrument_storage(storage, metrics):
+    """
+    Return a proxy of the storage that tracks its requests, if metrics are enabled.
+    """
+    if not getattr(metrics, "enabled", True):
+        return storage
+    if isinstance(storage, InstrumentedStorage):
+        return storage
+    return InstrumentedStorage(storage)
+
+
+class InstrumentedStorage:
+    """
+    Proxy of a Django storage, which tracks the calls to the STORAGE_METHODS. Other
+    attributes, such as the bucket of S3 storages, are those of the storage.
+    """
+
+    def __init__(self, storage):
+        self._storage = storage
+
+    def __getattr__(self, name):
+        attribute = getattr(self._storage, name)
+        if name not in STORAGE_METHODS:
+            return attribute
+
+        @functools.wraps(attribute)
+        def tracked(*args, **kwargs):
+            with track("storage", name):
+                return attribute(*args, **kwargs)
+
+        return tracked
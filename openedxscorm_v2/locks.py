@@ -0,0 +1,192 @@
+"""
+Locks that prevent concurrent extractions of the same package.
+
+When an extracted package is missing from the storage, for instance after a course
+import, it is extracted again when it is first viewed. Concurrent views then wait for a
+single worker to extract it: workers of the same process are coordinated by a
+per-process lock, and workers of different processes by the lock that is defined by the
+EXTRACT_LOCK xblock setting. Views that wait for more than EXTRACT_WAIT seconds display
+a placeholder message instead of the package::
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "EXTRACT_LOCK": "openedxscorm_v2.locks.CacheLock",
+        "EXTRACT_LOCK_TIMEOUT": 600,
+        "EXTRACT_WAIT": 5,
+    }
+
+EXTRACT_LOCK is a class, or a function, that takes the lock key and the lock timeout as
+arguments and returns a lock with the same interface as `CacheLock`; or the dotted
+path to either of them. Cross-process locks expire after EXTRACT_LOCK_TIMEOUT seconds,
+such that the crash of a worker does not prevent the extraction forever. Set
+EXTRACT_LOCK to None to only coordinate the workers of the same process.
+"""
+import contextlib
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import uuid
+import weakref
+
+from django.core.cache import caches
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+
+DEFAULT_TIMEOUT = 600
+DEFAULT_WAIT = 5
+POLL_INTERVAL = 0.1
+
+# Locks are dropped once they are no longer used by any thread
+_process_locks = weakref.WeakValueDictionary()
+_process_locks_lock = threading.Lock()
+
+
+class CacheLock:
+    """
+    Lock that is shared by all processes through a Django cache, which must support
+    atomic `add` operations, such as Memcached, Redis or database caches.
+    """
+
+    def __init__(self, key, timeout=DEFAULT_TIMEOUT, alias="default"):
+        self.key = "openedxscorm_v2.lock.{}".format(
+            hashlib.sha1(key.encode()).hexdigest()
+        )
+        self.timeout = timeout
+        self.alias = alias
+        self.token = uuid.uuid4().hex
+
+    def acquire(self, timeout=0):
+        """
+        Return True if the lock was acquired within `timeout` seconds.
+        """
+        cache = caches[self.alias]
+        deadline = time.monotonic() + timeout
+        while not cache.add(self.key, self.token, self.timeout):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(POLL_INTERVAL, remaining))
+        return True
+
+    def release(self):
+        # The lock may have expired and been acquired by another process
+        cache = caches[self.alias]
+        if cache.get(self.key) == self.token:
+            cache.delete(self.key)
+
+
+class FileLock:
+    """
+    Lock that is shared by the processes of the same host, through a lock file in
+    `directory`. The lock is released when the process exits, such that it does not
+    expire.
+    """
+
+    def __init__(self, key, timeout=DEFAULT_TIMEOUT, directory=None):
+        if fcntl is None:
+            raise ImportError("FileLock is only supported on POSIX platforms")
+        directory = directory or os.path.join(
+            tempfile.gettempdir(), "openedxscorm_v2-locks"
+        )
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(
+            directory, hashlib.sha1(key.encode()).hexdigest() + ".lock"
+        )
+        self.timeout = timeout
+        self._file = None
+
+    def acquire(self, timeout=0):
+        """
+        Return True if the lock was acquired within `timeout` seconds.
+        """
+        deadline = time.monotonic() + timeout
+        lock_file = open(self.path, "a")  # pylint: disable=consider-using-with
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    lock_file.close()
+                    return False
+                time.sleep(min(POLL_INTERVAL, remaining))
+            else:
+                self._file = lock_file
+                return True
+
+    def release(self):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+
+class ProcessLock:
+    """
+    Lock of the threads of the current process. Unlike `threading.Lock` objects, these
+    locks can be weakly referenced.
+    """
+
+    __slots__ = ("_lock", "__weakref__")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=-1):
+        return self._lock.acquire(blocking, timeout)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self._lock.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+def get_process_lock(key):
+    """
+    Return the process lock of `key`. The same lock is returned to all the threads
+    that hold a reference to it.
+    """
+    with _process_locks_lock:
+        lock = _process_locks.get(key)
+        if lock is None:
+            lock = _process_locks[key] = ProcessLock()
+        return lock
+
+
+@contextlib.contextmanager
+def single_flight(key, lock_factory=None, wait=DEFAULT_WAIT, timeout=DEFAULT_TIMEOUT):
+    """
+    Context manager that yields True if the `key` lock was acquired within `wait`
+    seconds, both in this process and across processes with the lock that is returned
+    by `lock_factory(key, timeout)`. Otherwise, it yields False, and the caller must not
+    perform the guarded operation.
+    """
+    deadline = time.monotonic() + wait
+    process_lock = get_process_lock(key)
+    if not process_lock.acquire(timeout=wait):
+        yield False
+        return
+    try:
+        lock = lock_factory(key, timeout) if lock_factory else None
+        if lock is not None and not lock.acquire(
+            timeout=max(0, deadline - time.monotonic())
+        ):
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            if lock is not None:
+                lock.release()
+    finally:
+        process_lock.release()
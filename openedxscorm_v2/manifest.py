@@ -0,0 +1,147 @@
+"""
+Parsing of imsmanifest.xml files.
+
+The manifest is parsed in a single streaming pass into a structured model, which is a
+JSON-serializable dict such as::
+
+    {
+        "identifier": "com.example.course",
+        "schemaversion": "1.2",
+        "scorm_version": "SCORM_12",
+        "default_organization": "org1",
+        "organizations": [
+            {
+                "identifier": "org1",
+                "title": "Course",
+                "items": [
+                    {
+                        "identifier": "item1",
+                        "identifierref": "res1",
+                        "title": "Lesson 1",
+                        "masteryscore": "80",
+                        "items": [],
+                    }
+                ],
+            }
+        ],
+        "resources": [
+            {
+                "identifier": "res1",
+                "type": "webcontent",
+                "scormtype": "sco",
+                "href": "index.html",
+                "files": ["index.html", "app.js"],
+            }
+        ],
+        "scos": ["res1"],
+        "index_page_path": "index.html",
+    }
+
+Elements are matched by local name, whatever their namespace.
+"""
+import re
+import xml.etree.ElementTree as ET
+
+
+# Manifests may list every file of the package: to keep the model small, we stop
+# recording resource files beyond this number.
+MAX_FILES = 1000
+
+
+def parse_manifest(fileobj):
+    """
+    Parse a manifest file object and return the manifest model. The "index_page_path"
+    is the href of the first resource that has one, or None.
+    """
+    model = {
+        "identifier": None,
+        "schemaversion": None,
+        "default_organization": None,
+        "organizations": [],
+        "resources": [],
+        "scos": [],
+        "index_page_path": None,
+    }
+    path = []
+    # Stack of the items that are being parsed
+    items = []
+    file_count = 0
+    for event, element in ET.iterparse(fileobj, events=("start", "end")):
+        name = local_name(element.tag)
+        if event == "start":
+            path.append(name)
+            if path == ["manifest"]:
+                model["identifier"] = element.get("identifier")
+            elif path == ["manifest", "organizations"]:
+                model["default_organization"] = element.get("default")
+            elif path == ["manifest", "organizations", "organization"]:
+                organization = {
+                    "identifier": element.get("identifier"),
+                    "title": None,
+                    "items": [],
+                }
+                model["organizations"].append(organization)
+                items = [organization]
+            elif name == "item" and items:
+                item = {
+                    "identifier": element.get("identifier"),
+                    "identifierref": element.get("identifierref"),
+                    "title": None,
+                    "masteryscore": None,
+                    "items": [],
+                }
+                items[-1]["items"].append(item)
+                items.append(item)
+            elif path == ["manifest", "resources", "resource"]:
+                attributes = local_attributes(element)
+                resource = {
+                    "identifier": attributes.get("identifier"),
+                    "type": attributes.get("type"),
+                    "scormtype": (attributes.get("scormtype") or "").lower() or None,
+                    "href": attributes.get("href"),
+                    "files": [],
+                }
+                model["resources"].append(resource)
+                if resource["scormtype"] == "sco":
+                    model["scos"].append(resource["identifier"])
+                if resource["href"] and model["index_page_path"] is None:
+                    model["index_page_path"] = resource["href"]
+            elif path[-2:] == ["resource", "file"] and len(path) == 4:
+                file_count += 1
+                if file_count <= MAX_FILES:
+                    model["resources"][-1]["files"].append(element.get("href"))
+        else:
+            text = (element.text or "").strip()
+            if path == ["manifest", "metadata", "schemaversion"]:
+                model["schemaversion"] = text
+            elif name == "title" and items and path[-2] in ["organization", "item"]:
+                items[-1]["title"] = text
+            elif name == "masteryscore" and items and path[-2] == "item":
+                items[-1]["masteryscore"] = text
+            elif name == "item" and items:
+                items.pop()
+            elif path == ["manifest", "organizations", "organization"]:
+                items = []
+            path.pop()
+            # Free memory, as we do not need the element tree
+            element.clear()
+    model["scorm_version"] = get_scorm_version(model["schemaversion"])
+    return model
+
+
+def get_scorm_version(schemaversion):
+    if schemaversion is not None and re.match("^1.2$", schemaversion) is None:
+        return "SCORM_2004"
+    return "SCORM_12"
+
+
+def local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def local_attributes(element):
+    """
+    Return the element attributes, indexed by their lower-case local name. For instance,
+    "adlcp:scormType" is returned as "scormtype".
+    """
+    return {local_name(key).lower(): value for key, value in element.attrib.items()}
@@ -0,0 +1,328 @@
+"""
+Content-addressed storage of extracted packages.
+
+Packages are extracted once per sha1 in {location}/packages/{sha1}, and this folder is
+shared by all the xblocks that use the same package, for instance in course reruns.
+Every xblock that uses a package adds a reference to it, which is an object stored in
+{location}/refs/{sha1}/{ref}. Packages that no longer have any reference can then be
+garbage-collected.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+import logging
+import os
+import posixpath
+import shutil
+
+from django.core.files.base import ContentFile
+from django.utils import timezone
+
+from . import fileindex, instrumentation, zipserving
+
+
+logger = logging.getLogger(__name__)
+
+# Values of package_meta["layout"]
+SHARED_LAYOUT = "shared"
+BLOCK_LAYOUT = "block"
+
+PACKAGES_FOLDER = "packages"
+REFS_FOLDER = "refs"
+
+# Unreferenced packages that were modified more recently than this are not collected,
+# as they might still be in the process of being extracted.
+DEFAULT_MIN_AGE = datetime.timedelta(days=1)
+
+DEFAULT_DELETE_WORKERS = 8
+# Maximum number of objects that are deleted by a single S3 DeleteObjects request
+S3_DELETE_BATCH_SIZE = 1000
+
+
+def package_path(location, sha1):
+    return os.path.join(location, PACKAGES_FOLDER, sha1)
+
+
+def references_path(location, sha1):
+    return os.path.join(location, REFS_FOLDER, sha1)
+
+
+def add_reference(storage, location, sha1, ref):
+    path = os.path.join(references_path(location, sha1), ref)
+    if not storage.exists(path):
+        storage.save(path, ContentFile(b""))
+
+
+def remove_reference(storage, location, sha1, ref):
+    path = os.path.join(references_path(location, sha1), ref)
+    if storage.exists(path):
+        storage.delete(path)
+
+
+def get_references(storage, location, sha1):
+    path = references_path(location, sha1)
+    if not storage.exists(path):
+        return []
+    return storage.listdir(path)[1]
+
+
+def delete_folder(
+    storage, root, exclude=None, workers=DEFAULT_DELETE_WORKERS, keep=None
+):
+    """
+    Recursively delete the contents of a directory in a Django storage. Unfortunately,
+    this will not delete empty folders, as the default FileSystemStorage implementation
+    does not allow it. The `exclude` sub-directory of the root, if any, is preserved,
+    as well as the files of the root whose names are in `keep`. Return the number of
+    deleted files.
+    """
+    paths = list_folder_files(storage, root, exclude=exclude)
+    if keep:
+        paths = (path for path in paths if os.path.relpath(path, root) not in keep)
+    deleter = BulkDeleter(storage, workers=workers)
+    deleter.delete(paths)
+    return deleter.files_deleted
+
+
+def list_folder_files(storage, root, exclude=None):
+    """
+    Iterate on the paths of all files in a directory of a Django storage, except in
+    the `exclude` sub-directory. Extracted packages are listed from their file index,
+    without listing the storage. The same folder may also contain the zip file of the
+    package, when it is served from its zip file by other xblocks.
+    """
+    if exclude is None:
+        index = fileindex.load_index(storage, root)
+        if index is not None:
+            for path in index["files"]:
+                yield os.path.join(root, path)
+            yield from zipserving.list_files(storage, root)
+            yield fileindex.index_path(root)
+            return
+    directories, files = storage.listdir(root)
+    for directory in directories:
+        if directory != exclude:
+            yield from list_folder_files(storage, os.path.join(root, directory))
+    for f in files:
+        yield os.path.join(root, f)
+
+
+class BulkDeleter:
+    """
+    Delete files from a Django storage in bulk.
+
+    Storages that are backed by an S3 bucket, such as the S3Boto3Storage of
+    django-storages, delete up to 1000 objects with every request. Other storages delete
+    files one by one. In both cases, requests are sent concurrently by `workers`
+    threads. With `dry_run=True`, files are counted but not deleted.
+
+    File indexes are deleted after all other files, such that an interrupted deletion
+    can be resumed from the index.
+    """
+
+    def __init__(self, storage, workers=DEFAULT_DELETE_WORKERS, dry_run=False):
+        self.storage = storage
+        self.workers = max(1, workers)
+        self.dry_run = dry_run
+        self.files_deleted = 0
+        self.requests = 0
+        self.errors = 0
+
+    def delete(self, paths):
+        files = []
+        indexes = []
+        for path in paths:
+            if os.path.basename(path) in [
+                fileindex.INDEX_FILENAME,
+                zipserving.INDEX_FILENAME,
+            ]:
+                indexes.append(path)
+            else:
+                files.append(path)
+        self._delete(files)
+        self._delete(indexes)
+
+    def _delete(self, paths):
+        if not paths:
+            return
+        if self.dry_run:
+            self.files_deleted += len(paths)
+            return
+        bucket = get_s3_bucket(self.storage)
+        if bucket is None:
+            batches = [[path] for path in paths]
+            delete_batch = self._delete_files
+        else:
+            batches = [
+                paths[start : start + S3_DELETE_BATCH_SIZE]
+                for start in range(0, len(paths), S3_DELETE_BATCH_SIZE)
+            ]
+            delete_batch = self._delete_objects
+        if self.workers == 1 or len(batches) == 1:
+            deleted = [delete_batch(batch) for batch in batches]
+        else:
+            with ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="scorm-delete"
+            ) as executor:
+                deleted = list(
+                    executor.map(instrumentation.propagate(delete_batch), batches)
+                )
+        self.requests += len(batches)
+        self.files_deleted += sum(deleted)
+        self.errors += len(paths) - sum(deleted)
+
+    def _delete_files(self, paths):
+        for path in paths:
+            self.storage.delete(path)
+        return len(paths)
+
+    def _delete_objects(self, paths):
+        with instrumentation.track("storage", "delete_objects"):
+            response = get_s3_bucket(self.storage).delete_objects(
+                Delete={
+                    "Objects": [
+                        # pylint: disable=protected-access
+                        {"Key": self.storage._normalize_name(posixpath.normpath(path))}
+                        for path in paths
+                    ],
+                    "Quiet": True,
+                }
+            )
+        errors = response.get("Errors", [])
+        for error in errors:
+            logger.warning(
+                "Could not delete %s: %s", error.get("Key"), error.get("Message")
+            )
+        return len(paths) - len(errors)
+
+
+def get_s3_bucket(storage):
+    """
+    Return the boto3 bucket of storages that are backed by S3, or None.
+    """
+    if not hasattr(storage, "_normalize_name"):
+        return None
+    bucket = getattr(storage, "bucket", None)
+    if bucket is None or not hasattr(bucket, "delete_objects"):
+        return None
+    return bucket
+
+
+def get_copy_function(storage):
+    """
+    Return a function that copies a file of the storage to another path without
+    downloading it, and returns the destination path. Return None if the storage does
+    not support such copies.
+
+    Objects of S3 storages are copied server-side. Files of local filesystem storages
+    are hard-linked, or copied when hard links are not supported.
+    """
+    bucket = get_s3_bucket(storage)
+    if bucket is not None:
+        # pylint: disable=protected-access
+        extra_args = None
+        if getattr(storage, "default_acl", None):
+            # ACLs are not copied with the objects
+            extra_args = {"ACL": storage.default_acl}
+
+        def copy_object(source, dest):
+            with instrumentation.track("storage", "copy"):
+                bucket.copy(
+                    {
+                        "Bucket": bucket.name,
+                        "Key": storage._normalize_name(posixpath.normpath(source)),
+                    },
+                    storage._normalize_name(posixpath.normpath(dest)),
+                    ExtraArgs=extra_args,
+                )
+            return dest
+
+        return copy_object
+
+    try:
+        storage.path("")
+    except NotImplementedError:
+        return None
+
+    def copy_file(source, dest):
+        source_path = storage.path(source)
+        dest_path = storage.path(dest)
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(source_path, dest_path)
+        except OSError:
+            shutil.copyfile(source_path, dest_path)
+        return dest
+
+    return copy_file
+
+
+def find_unreferenced_packages(storage, location, min_age=DEFAULT_MIN_AGE, ignore=()):
+    """
+    Iterate on the sha1 of the shared packages that are no longer referenced by any
+    xblock and that were last modified more than `min_age` ago. References with a path
+    in `ignore` are considered as removed.
+    """
+    root = os.path.join(location, PACKAGES_FOLDER)
+    if not storage.exists(root):
+        return
+    for sha1 in storage.listdir(root)[0]:
+        references = [
+            ref
+            for ref in get_references(storage, location, sha1)
+            if os.path.join(references_path(location, sha1), ref) not in ignore
+        ]
+        if references:
+            continue
+        path = package_path(location, sha1)
+        if is_older_than(storage, path, min_age):
+            yield sha1
+
+
+def collect_unreferenced_packages(
+    storage, location, min_age=DEFAULT_MIN_AGE, dry_run=False
+):
+    """
+    Delete the shared packages that are no longer referenced by any xblock. Return the
+    list of sha1 of the collected packages. See also `cleanup.collect_garbage`.
+    """
+    collected = []
+    for sha1 in find_unreferenced_packages(storage, location, min_age=min_age):
+        path = package_path(location, sha1)
+        logger.info("Collecting unreferenced SCORM package %s", path)
+        if not dry_run:
+            delete_folder(storage, path)
+        collected.append(sha1)
+    return collected
+
+
+def is_older_than(storage, path, min_age):
+    """
+    Return True if the `path` folder was last modified more than `min_age` ago. The
+    modification time of the file index is used, when available. Otherwise, the
+    modification time of the first file at the top of the folder is used. Return False
+    when the folder is empty, or when the storage does not provide this information.
+    """
+    reference_path = fileindex.index_path(path)
+    if not storage.exists(reference_path):
+        files = storage.listdir(path)[1]
+        if not files:
+            # Empty folders are left behind by the local filesystem storage
+            return False
+        reference_path = os.path.join(path, files[0])
+    return is_file_older_than(storage, reference_path, min_age)
+
+
+def is_file_older_than(storage, path, min_age):
+    """
+    Return True if the `path` file was last modified more than `min_age` ago, and
+    False when the storage does not provide this information.
+    """
+    try:
+        modified_time = storage.get_modified_time(path)
+    except NotImplementedError:
+        return False
+    if timezone.is_naive(modified_time):
+        modified_time = timezone.make_aware(modified_time)
+    return timezone.now() - modified_time > min_age
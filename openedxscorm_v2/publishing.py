@@ -0,0 +1,210 @@
+"""
+Publishing of extracted files to the storage backend.
+
+Packages are extracted to folders that are named after their checksum, such that their
+files never change. Extracted files are thus saved with their Content-Type and with a
+long-lived, immutable Cache-Control header, on storages that support it. Compressible
+text files may also be saved with precompressed variants: for instance, "app.js" is
+saved together with "app.js.gz" and "app.js.br". The web server or CDN is then
+responsible for serving these variants to browsers that accept them, e.g. with the
+nginx "gzip_static" and "brotli_static" directives::
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "PRECOMPRESS": ["gzip", "br"],
+        "CACHE_CONTROL": "public, max-age=31536000, immutable",
+    }
+
+Brotli variants require the "brotli" package. Files are saved by the PUBLISH_FUNC xblock
+setting, which is a function that takes the storage, the file path, a Django File and a
+dict of HTTP headers as arguments, and returns the saved path. See `publish_file` for
+the default implementation.
+"""
+import gzip
+import logging
+import mimetypes
+import posixpath
+import shutil
+import tempfile
+import threading
+import zlib
+
+from django.core.files.base import File
+
+from . import instrumentation, packages
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+# Files that are smaller than this are not worth compressing
+COMPRESSION_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = [
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "image/svg+xml",
+    "text/",
+]
+ENCODINGS = {"gzip": ".gz", "br": ".br"}
+
+# HTTP headers, as named in the ExtraArgs of boto3 uploads
+S3_HEADER_ARGS = {
+    "Cache-Control": "CacheControl",
+    "Content-Encoding": "ContentEncoding",
+    "Content-Type": "ContentType",
+}
+
+
+def publish_file(storage, name, content, headers):
+    """
+    Default publish function. S3 storages from django-storages upload the file with the
+    headers, together with the object parameters of the storage. Other storages only
+    receive the Content-Type, as the "content_type" attribute of the content, which is
+    also what Django uploaded files provide.
+    """
+    bucket = packages.get_s3_bucket(storage)
+    if bucket is None:
+        content.content_type = headers.get("Content-Type")
+        return storage.save(name, content)
+    # pylint: disable=protected-access
+    key = storage._normalize_name(posixpath.normpath(name))
+    if hasattr(storage, "get_object_parameters"):
+        extra_args = storage.get_object_parameters(name)
+    else:
+        extra_args = dict(getattr(storage, "object_parameters", None) or {})
+    if getattr(storage, "default_acl", None):
+        extra_args.setdefault("ACL", storage.default_acl)
+    for header, value in headers.items():
+        extra_args[S3_HEADER_ARGS[header]] = value
+    with instrumentation.track("storage", "upload_fileobj"):
+        bucket.upload_fileobj(content, key, ExtraArgs=extra_args)
+    return name
+
+
+class AssetPublisher:
+    """
+    Save extracted files to the storage with `publish_func`, with HTTP headers, and
+    write their precompressed variants for the given `encodings`. Unsupported encodings
+    are ignored.
+    """
+
+    def __init__(
+        self,
+        storage,
+        publish_func=None,
+        encodings=(),
+        cache_control=IMMUTABLE_CACHE_CONTROL,
+    ):
+        self.storage = storage
+        self.publish_func = publish_func or publish_file
+        self.encodings = []
+        for encoding in encodings:
+            if encoding not in ENCODINGS:
+                logger.warning("Unknown precompression encoding: %s", encoding)
+            elif encoding == "br" and brotli is None:
+                logger.warning("Brotli variants require the brotli package")
+            else:
+                self.encodings.append(encoding)
+        self.cache_control = cache_control
+        self.original_bytes = 0
+        self.compressed_bytes = {encoding: 0 for encoding in self.encodings}
+        self._lock = threading.Lock()
+
+    def get_headers(self, path, encoding=None):
+        headers = {}
+        content_type = mimetypes.guess_type(path)[0]
+        if content_type:
+            headers["Content-Type"] = content_type
+        if self.cache_control:
+            headers["Cache-Control"] = self.cache_control
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return headers
+
+    def is_compressible(self, path, size):
+        """
+        Return True if precompressed variants should be written for this file.
+        """
+        if not self.encodings or size < COMPRESSION_MIN_SIZE:
+            return False
+        content_type = mimetypes.guess_type(path)[0] or ""
+        return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+    def publish(self, path, content):
+        return self.publish_func(self.storage, path, content, self.get_headers(path))
+
+    def publish_variants(self, path, fileobj, size):
+        """
+        Write the precompressed variants of a file, which is read from `fileobj`.
+        Variants that are not smaller than the original file are not written. Return
+        the list of (path, size, crc) tuples of the saved variants.
+        """
+        variants = []
+        for encoding in self.encodings:
+            fileobj.seek(0)
+            with tempfile.SpooledTemporaryFile(max_size=size) as compressed:
+                crc = compress(fileobj, compressed, encoding)
+                compressed_size = compressed.tell()
+                if compressed_size >= size:
+                    continue
+                compressed.seek(0)
+                content = File(compressed)
+                content.size = compressed_size
+                variant_path = self.publish_func(
+                    self.storage,
+                    path + ENCODINGS[encoding],
+                    content,
+                    self.get_headers(path, encoding=encoding),
+                )
+            variants.append((variant_path, compressed_size, crc))
+            with self._lock:
+                self.compressed_bytes[encoding] += compressed_size
+        if variants:
+            with self._lock:
+                self.original_bytes += size
+        return variants
+
+
+def compress(source, dest, encoding):
+    """
+    Compress the `source` file object to `dest` and return the CRC-32 of the compressed
+    data. Compressed data do not depend on the time, such that variants of identical
+    files are identical.
+    """
+    crc = 0
+    if encoding == "gzip":
+        writer = CrcWriter(dest)
+        with gzip.GzipFile(fileobj=writer, mode="wb", mtime=0, filename="") as f:
+            shutil.copyfileobj(source, f)
+        return writer.crc
+    compressor = brotli.Compressor()
+    while True:
+        chunk = source.read(shutil.COPY_BUFSIZE)
+        data = compressor.process(chunk) if chunk else compressor.finish()
+        dest.write(data)
+        crc = zlib.crc32(data, crc)
+        if not chunk:
+            return crc
+
+
+class CrcWriter:
+    """
+    File object that computes the CRC-32 of the data that are written to it.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.crc = 0
+
+    def write(self, data):
+        self.crc = zlib.crc32(data, self.crc)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
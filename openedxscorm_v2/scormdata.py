@@ -0,0 +1,174 @@
+"""
+Compact encoding of the SCORM runtime data that is stored in the learner state.
+
+The runtime data is a flat dict of CMI elements, such as::
+
+    {
+        "cmi.location": "page3",
+        "cmi.suspend_data": "...",
+        "cmi.interactions.0.id": "q1",
+        "cmi.interactions.0.result": "correct",
+    }
+
+In the packed format, the elements of CMI arrays are collapsed in lists of dicts, and
+large suspend data is compressed::
+
+    {
+        "__format__": 1,
+        "cmi.location": "page3",
+        "cmi.interactions": [{"id": "q1", "result": "correct"}],
+        "__compressed__": {"cmi.suspend_data": "<base64-encoded zlib data>"},
+    }
+
+Dicts without the "__format__" key are unpacked as-is, such that learner states that
+were stored by previous versions are transparently migrated on the next write.
+
+Array elements with an index larger than MAX_COLLAPSED_INDEX are stored as flat keys,
+such that a single element with a huge index does not allocate a huge list. Element
+names must start with "cmi." or "adl.": other names, which might collide with the keys
+of the packed format, are rejected by `is_valid_name` and dropped by `pack`.
+"""
+import base64
+import json
+import re
+import zlib
+
+
+FORMAT_KEY = "__format__"
+FORMAT_VERSION = 1
+COMPRESSED_KEY = "__compressed__"
+
+# Elements of these arrays are collapsed in lists
+COLLAPSED_ARRAYS = ["cmi.interactions", "cmi.objectives"]
+# These elements are compressed when they are larger than COMPRESSION_THRESHOLD
+COMPRESSED_ELEMENTS = ["cmi.suspend_data"]
+COMPRESSION_THRESHOLD = 1024
+# SCORM 2004 requires at least 250 interactions and 100 objectives
+MAX_COLLAPSED_INDEX = 1000
+VALID_PREFIXES = ("cmi.", "adl.")
+
+ARRAY_ELEMENT_PATTERN = re.compile(
+    r"^(?P<array>{})\.(?P<index>\d+)\.(?P<field>.+)$".format(
+        "|".join(re.escape(array) for array in COLLAPSED_ARRAYS)
+    )
+)
+
+
+def is_valid_name(name):
+    """
+    Return True if `name` may be stored in the runtime data.
+    """
+    return (
+        isinstance(name, str)
+        and name.startswith(VALID_PREFIXES)
+        and name not in COLLAPSED_ARRAYS
+    )
+
+
+def get_array_match(name):
+    """
+    Return the match of an array element that is collapsed in the packed format, or
+    None.
+    """
+    match = ARRAY_ELEMENT_PATTERN.match(name)
+    if match and int(match.group("index")) <= MAX_COLLAPSED_INDEX:
+        return match
+    return None
+
+
+def pack(data):
+    """
+    Encode a flat dict of CMI elements in the packed format. Invalid element names are
+    dropped.
+    """
+    packed = {FORMAT_KEY: FORMAT_VERSION}
+    compressed = {}
+    for name, value in data.items():
+        if not is_valid_name(name):
+            continue
+        match = get_array_match(name)
+        if match:
+            array = packed.setdefault(match.group("array"), [])
+            index = int(match.group("index"))
+            if index >= len(array):
+                array.extend([None] * (index + 1 - len(array)))
+            if array[index] is None:
+                array[index] = {}
+            array[index][match.group("field")] = value
+        elif name in COMPRESSED_ELEMENTS and is_compressible(value):
+            compressed[name] = compress(value)
+            if len(compressed[name]) >= len(value):
+                # Compression is not worth it
+                del compressed[name]
+                packed[name] = value
+        else:
+            packed[name] = value
+    if compressed:
+        packed[COMPRESSED_KEY] = compressed
+    return packed
+
+
+def unpack(packed):
+    """
+    Decode a dict in the packed format to a flat dict of CMI elements.
+    """
+    if FORMAT_KEY not in packed:
+        return dict(packed)
+    data = {}
+    for name, value in packed.items():
+        if name == FORMAT_KEY:
+            continue
+        if name == COMPRESSED_KEY:
+            for compressed_name, compressed_value in value.items():
+                data[compressed_name] = decompress(compressed_value)
+        elif name in COLLAPSED_ARRAYS and isinstance(value, list):
+            for index, fields in enumerate(value):
+                for field, field_value in (fields or {}).items():
+                    data["{}.{}.{}".format(name, index, field)] = field_value
+        else:
+            data[name] = value
+    return data
+
+
+def get_value(packed, name, default=None):
+    """
+    Return a single CMI element from packed data, without unpacking the other elements.
+    """
+    if FORMAT_KEY not in packed:
+        return packed.get(name, default)
+    compressed = packed.get(COMPRESSED_KEY, {})
+    if name in compressed:
+        return decompress(compressed[name])
+    match = get_array_match(name)
+    if match and isinstance(packed.get(match.group("array")), list):
+        array = packed[match.group("array")]
+        index = int(match.group("index"))
+        if index < len(array) and array[index]:
+            return array[index].get(match.group("field"), default)
+        return default
+    return packed.get(name, default)
+
+
+def packed_size(packed):
+    """
+    Approximate size of the packed data once it is serialized in the learner state.
+    """
+    return len(json.dumps(packed, separators=(",", ":")))
+
+
+def value_size(value):
+    if isinstance(value, str):
+        return len(value)
+    return len(json.dumps(value))
+
+
+def is_compressible(value):
+    return isinstance(value, str) and len(value) > COMPRESSION_THRESHOLD
+
+
+def compress(value):
+    return base64.b64encode(zlib.compress(value.encode("utf8"))).decode("ascii")
+
+
+def decompress(value):
+    return zlib.decompress(base64.b64decode(value)).decode("utf8")
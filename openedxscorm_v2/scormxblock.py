@@ -1,12 +1,17 @@
+from collections import Counter
+import functools
 import json
 import hashlib
 import os
 import logging
-import re
+import sys
+import tempfile
+import time
+from urllib.parse import unquote, urlsplit
 import xml.etree.ElementTree as ET
 import zipfile
 
-from django.core.files.base import ContentFile
+from django.core.files.base import File
 from django.core.files.storage import default_storage
 from django.template import Context, Template
 from django.utils import timezone
@@ -22,6 +27,30 @@ from xblock.fields import Scope, String, Float, Boolean, Dict, DateTime, Integer
 
 from xmodule.contentstore.django import contentstore
 
+from . import (
+    cache,
+    fileindex,
+    hashing,
+    ingest,
+    instrumentation,
+    locks,
+    manifest,
+    packages,
+    publishing,
+    scormdata,
+    zipserving,
+)
+from .extraction import (
+    DEFAULT_LIMITS,
+    MAX_MANIFEST_SIZE,
+    BoundedReader,
+    ExtractionLimits,
+    UnsafePackageError,
+    ZipExtractor,
+    check_limits,
+    get_member_path,
+)
+
 
 # Make '_' a no-op so we can scrape strings
 def _(text):
@@ -30,6 +59,22 @@ def _(text):
 
 logger = logging.getLogger(__name__)
 
+# Number of completion and grade events that were published or skipped by this process
+publish_counters = Counter()
+
+RESOURCES = [
+    "static/css/scormxblock.css",
+    "static/js/src/scormxblock.js",
+    "static/js/src/studio.js",
+]
+TEMPLATES = [
+    "static/html/scormxblock.html",
+    "static/html/studio.html",
+]
+
+# Contentstore metadata of SCORM packages that are pinned and cached
+ASSET_FIELDS = ["asset_key", "md5", "length", "uploadDate"]
+
 
 @XBlock.wants("settings")
 class ScormXBlock(XBlock, CompletableXBlockMixin):
@@ -38,7 +83,14 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
 
         media/{org}/{course}/{block_type}/{block_id}/{sha1}{ext}
 
-    This zip file is then extracted to the media/{scorm_location}/{block_id}.
+    This zip file is then extracted to media/{scorm_location}/packages/{sha1}. This
+    folder is shared by all xblocks that use the same package, such as in course
+    reruns. Set the SHARED_PACKAGES xblock setting to False to extract packages to
+    media/{scorm_location}/{hashed_usage_id}/{sha1} instead, as in previous versions.
+    The "sha1" digest of new packages is computed with the HASH_ALGORITHM xblock
+    setting, which defaults to SHA-1: see the hashing module. With the "zip"
+    SERVING_MODE, packages are not extracted: the zip file is stored in this folder,
+    and its files are served by the `serve_asset` handler. See the zipserving module.
 
     The scorm location is defined by the LOCATION xblock setting. If undefined, this is
     "scorm". This setting can be set e.g:
@@ -47,8 +99,17 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             "LOCATION": "alternatevalue",
         }
 
-    Note that neither the folder the folder nor the package file are deleted when the
-    xblock is removed.
+    Package files are uploaded to the storage backend by a pool of EXTRACT_WORKERS
+    threads (4 by default). Set it to 1 to extract files one after the other:
+
+        XBLOCK_SETTINGS["ScormXBlock"] = {
+            "EXTRACT_WORKERS": 16,
+        }
+
+    Files are deleted from the storage backend by DELETE_WORKERS threads (8 by
+    default). Note that neither the folder the folder nor the package file are deleted
+    when the xblock is removed: unused folders are collected by
+    `cleanup.collect_garbage`.
 
     By default, static assets are stored in the default Django storage backend. To
     override this behaviour, you should define a custom storage function. This
@@ -118,6 +179,7 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
 
     # See the Scorm data model:
     # https://scorm.com/scorm-explained/technical-scorm/run-time/
+    # This data is stored in a compact format: use `cmi_data` to access it.
     scorm_data = Dict(scope=Scope.user_state, default={})
 
     icon_class = String(default="video", scope=Scope.settings)
@@ -136,15 +198,13 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
     has_author_view = True
 
     def render_template(self, template_path, context):
-        template_str = self.resource_string(template_path)
-        template = Template(template_str)
+        template = get_template(template_path)
         return template.render(Context(context))
 
     @staticmethod
     def resource_string(path):
         """Handy helper for getting static resources from our kit."""
-        data = pkg_resources.resource_string(__name__, path)
-        return data.decode("utf8")
+        return get_resource_string(path)
 
     def author_view(self, context=None):
         context = context or {}
@@ -154,15 +214,21 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             ] = "Click 'Edit' to modify this module and upload a new SCORM package."
         return self.student_view(context=context)
 
+    @instrumentation.timed("student_view")
     def student_view(self, context=None):
-        self._get_package_file_and_extract()
+        is_extracted = self._get_package_file_and_extract()
 
         student_context = {
-            "index_page_url": self.index_page_url,
+            "index_page_url": self.index_page_url if is_extracted else "",
             "completion_status": self.lesson_status,
             "grade": self.get_grade(),
             "scorm_xblock": self,
         }
+        if not is_extracted:
+            student_context["message"] = _(
+                "This content is being prepared. Please reload the page in a few "
+                "moments."
+            )
         student_context.update(context or {})
         template = self.render_template("static/html/scormxblock.html", student_context)
         frag = Fragment(template)
@@ -172,7 +238,15 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             "ScormXBlock",
             json_args={
                 "scorm_version": self.scorm_version,
-                "scorm_data": self.scorm_data,
+                "scorm_data": self.cmi_data,
+                "lesson_status": self.lesson_status,
+                "success_status": self.success_status,
+                "lesson_score": self.lesson_score,
+                "has_score": self.has_score,
+                "set_values_debounce": self.xblock_settings.get("SET_VALUES_DEBOUNCE"),
+                "set_values_batch_size": self.xblock_settings.get(
+                    "SET_VALUES_BATCH_SIZE"
+                ),
             },
         )
         return frag
@@ -196,7 +270,10 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         frag = Fragment(template)
         frag.add_css(self.resource_string("static/css/scormxblock.css"))
         frag.add_javascript(self.resource_string("static/js/src/studio.js"))
-        frag.initialize_js("ScormStudioXBlock")
+        frag.initialize_js(
+            "ScormStudioXBlock",
+            json_args={"ingest_job": self.package_meta.get("ingest_job")},
+        )
         return frag
 
     @staticmethod
@@ -214,6 +291,7 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         self.weight = parse_float(request.params["weight"], 1)
         self.icon_class = "problem" if self.has_score else "video"
         self.scorm_file = request.params.get("scorm_file")
+        self.clear_cached_package_state()
 
         response = {"result": "success", "errors": []}
 
@@ -221,150 +299,791 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             # File not uploaded
             return self.json_response(response)
 
-        try:
-            package_file = self._get_package_file()
-        except Exception:
-            response["errors"].append(
-                "SCORM package not found. Make sure the name is correct and the file type is '.zip' "
-            )
+        if self.is_package_unchanged():
+            # Settings-only changes do not require a new ingestion
+            response["skipped"] = True
             return self.json_response(response)
 
-        self.update_package_meta(package_file)
+        if self.xblock_settings.get("ASYNC_INGEST"):
+            job_id = ingest.create_job(str(self.scope_ids.usage_id), self.scorm_file)
+            self.package_meta["ingest_job"] = job_id
+            self.ingest_executor(self, job_id)
+            response["job_id"] = job_id
+            return self.json_response(response)
 
-        # Clean storage folder, if it already exists
-        self.clean_storage()
+        result = self.ingest_package()
+        response["errors"] += result["errors"]
+        response["skipped"] = result.get("skipped", False)
+        self.apply_ingest_result(result)
+        return self.json_response(response)
 
-        # Extract zip file
+    def is_package_unchanged(self):
+        """
+        Return True if the contentstore asset of the scorm file is the one that was last
+        ingested, as identified by its md5, length and upload date. Only the asset
+        metadata is fetched from the contentstore.
+        """
+        if (
+            "asset" not in self.package_meta
+            or "ingest_job" in self.package_meta
+            or self.package_meta.get("name") != self.scorm_file
+            or self.package_meta.get("layout") != self.package_layout
+            or self.package_meta.get("serving_mode", zipserving.EXTRACT_MODE)
+            != self.serving_mode
+        ):
+            return False
         try:
-            self.extract_package(package_file)
-            self.update_package_fields()
-        except ScormError as e:
-            response["errors"].append(e.args[0])
+            scorm_package = self._search_scorm_package()
+        except Exception:  # pylint: disable=broad-except
+            return False
+        fingerprint = get_asset_fingerprint(scorm_package)
+        return fingerprint is not None and fingerprint == self.package_meta["asset"]
 
-        return self.json_response(response)
+    @XBlock.json_handler
+    def ingest_status(self, data, _suffix):
+        """
+        Report the progress of a background ingestion job. When the job is done, its
+        result is applied to the xblock fields.
+        """
+        job_id = data.get("job_id")
+        job = ingest.get_job(job_id)
+        if job is None or job["usage_id"] != str(self.scope_ids.usage_id):
+            if job_id is not None and self.package_meta.get("ingest_job") == job_id:
+                # The job expired, or its worker died before it was saved
+                self.package_meta.pop("ingest_job")
+            return {"state": ingest.DONE, "errors": ["Unknown ingestion job"]}
+        status = {
+            "state": job["state"],
+            "files_extracted": job["files_extracted"],
+            "bytes_written": job["bytes_written"],
+            "total_files": job["total_files"],
+            "total_bytes": job["total_bytes"],
+            "bytes_copied": job.get("bytes_copied", 0),
+            "errors": [],
+        }
+        if job["state"] == ingest.DONE:
+            status["errors"] = job["result"]["errors"]
+            status["skipped"] = job["result"].get("skipped", False)
+            if self.package_meta.get("ingest_job") == job_id:
+                self.apply_ingest_result(job["result"])
+        return status
+
+    def run_ingest_job(self, job_id, apply=False):
+        """
+        Run a background ingestion job, which was created by `studio_submit`. The result
+        is stored in the job, and it is applied when the job status is polled. With
+        `apply`, it is also applied to the xblock fields right away, which the caller
+        must then save: this is meant for xblocks that were loaded by the worker, such
+        that the result does not depend on an editor polling the job.
+        """
+        job = ingest.get_job(job_id)
+        if job is None:
+            logger.warning("SCORM ingestion job %s has expired", job_id)
+            return
+        job["state"] = ingest.RUNNING
+        ingest.save_job(job_id, job)
+        if self.scorm_file != job["scorm_file"]:
+            # The xblock was loaded from a modulestore that is not up-to-date yet
+            self.scorm_file = job["scorm_file"]
+        progress = ingest.ProgressReporter(job_id, job)
+        try:
+            result = self.ingest_package(on_progress=progress)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.exception("SCORM ingestion job %s failed", job_id)
+            result = {"errors": ["SCORM package ingestion failed: {}".format(e)]}
+        progress.update_job()
+        job["state"] = ingest.DONE
+        job["result"] = result
+        ingest.save_job(job_id, job)
+        if apply and self.package_meta.get("ingest_job") == job_id:
+            self.apply_ingest_result(result)
+
+    def ingest_package(self, on_progress=None):
+        """
+        Fetch the SCORM package from the contentstore and extract it to a new folder.
+        Return the new values of the package fields, together with the list of errors.
+
+        The xblock fields are left untouched, such that the previous package can be
+        served until the new one is completely extracted. The new values should then be
+        saved with `apply_ingest_result`.
+        """
+        result = {"errors": [], "skipped": False}
+        peak_rss = get_peak_rss()
+        try:
+            scorm_package = self._search_scorm_package()
+            package_file = spool_asset(
+                scorm_package["asset_key"],
+                self.scorm_file,
+                hash_algorithm=self.hash_algorithm,
+            )
+        except Exception:
+            result["errors"].append(
+                "SCORM package not found. Make sure the name is correct and the file type is '.zip' "
+            )
+            return result
+
+        with package_file:
+            package_meta = self.get_package_meta(
+                package_file, digest=package_file.digest
+            )
+            package_meta["asset"] = get_asset_fingerprint(scorm_package)
+            package_meta["layout"] = self.package_layout
+            package_meta["serving_mode"] = self.serving_mode
+            shared = package_meta["layout"] == packages.SHARED_LAYOUT
+            extract_folder_path = self.get_extract_folder_path(package_meta)
+
+            # Extract zip file, unless it was already extracted for this xblock or
+            # another one
+            try:
+                if (
+                    package_meta["sha1"] == self.package_meta.get("sha1")
+                    and package_meta["layout"] == self.package_meta.get("layout")
+                    and "manifest" in self.package_meta
+                    and self.is_package_stored(package_meta)
+                ):
+                    logger.info(
+                        'SCORM package is unchanged and extracted in "%s"',
+                        extract_folder_path,
+                    )
+                    manifest_model = self.package_meta["manifest"]
+                    result["skipped"] = True
+                elif (
+                    shared
+                    and packages.get_references(
+                        self.storage, self.scorm_location(), package_meta["sha1"]
+                    )
+                    and self.is_package_stored(package_meta)
+                ):
+                    logger.info(
+                        'Reusing SCORM package extracted in "%s"', extract_folder_path
+                    )
+                    manifest_model = self.get_package_manifest(package_file)
+                elif package_meta["serving_mode"] == zipserving.ZIP_MODE:
+                    manifest_model = self.save_package_zip(
+                        package_file, extract_folder_path
+                    )
+                else:
+                    manifest_model = self.extract_package(
+                        package_file,
+                        extract_folder_path,
+                        on_progress=on_progress,
+                        previous_folder_path=self.get_previous_folder_path(
+                            package_meta
+                        ),
+                    )
+                result.update(self.get_package_fields(manifest_model))
+                self.check_index_page(package_meta, result["index_page_path"])
+                package_meta["manifest"] = manifest_model
+                index = self.get_file_index(extract_folder_path)
+                if index is not None:
+                    file_count, extracted_size = fileindex.get_totals(index)
+                    package_meta["file_count"] = file_count
+                    package_meta["extracted_size"] = extracted_size
+            except ScormError as e:
+                result["errors"].append(e.args[0])
+            result["package_meta"] = package_meta
+        log_peak_rss("SCORM package ingest", peak_rss)
+        return result
+
+    def apply_ingest_result(self, result):
+        """
+        Switch to the package that was extracted by `ingest_package`, unless there was
+        an error, and remove the previously extracted packages. The reference to the
+        previous shared package is kept: it is shared with the published version of
+        the xblock, which may still use that package. References that are no longer
+        used by any version are removed by `cleanup.collect_garbage`.
+        """
+        self.package_meta.pop("ingest_job", None)
+        if result["errors"]:
+            return
+        self.package_meta.update(result["package_meta"])
+        self.index_page_path = result["index_page_path"]
+        self.scorm_version = result["scorm_version"]
+        self.clear_cached_package_state()
+        sha1 = self.package_meta["sha1"]
+        if self.package_meta["layout"] == packages.SHARED_LAYOUT:
+            self.add_package_reference()
+            # Remove packages that were extracted in the folder of this xblock
+            self.clean_storage()
+        else:
+            self.clean_storage(keep=sha1)
+
+    def add_package_reference(self):
+        """
+        Mark the shared package folder as being used by this xblock, such that it is
+        not garbage-collected.
+        """
+        packages.add_reference(
+            self.storage,
+            self.scorm_location(),
+            self.package_meta["sha1"],
+            self.hashed_usage_id,
+        )
 
     # This function has been borrowed from Abstract-Tech
     # https://github.com/Abstract-Tech/abstract-scorm-xblock/blob/11c2f0ec61dbc4d4e1af37b5a203c2f8be7eb944/abstract_scorm_xblock/abstract_scorm_xblock/scormxblock.py#L319
-    def _search_scorm_package(self):
+    @instrumentation.timed("search_scorm_package")
+    def _search_scorm_package(self, use_cache=False, name=None):
         """
-        Search the mongo contentstore for the filename and return the file metadata
+        Search the mongo contentstore for the filename, which defaults to the scorm
+        file, and return the file metadata, as a dict with the ASSET_FIELDS keys.
+        Results are cached by course and filename, but cached results may be stale:
+        they are only returned if `use_cache` is True.
         """
-        scorm_content, count = contentstore().get_all_content_for_course(
-            self.runtime.course_id,
-            filter_params={
-                "contentType": {
-                    "$in": ["application/zip", "application/x-zip-compressed"]
+        name = name or self.scorm_file
+        cache_key = (str(self.runtime.course_id), name)
+        if use_cache:
+            scorm_package = self.asset_cache.get(cache_key)
+            if scorm_package is not None:
+                return scorm_package
+        with instrumentation.track("contentstore", "get_all_content_for_course"):
+            scorm_content, count = contentstore().get_all_content_for_course(
+                self.runtime.course_id,
+                filter_params={
+                    "contentType": {
+                        "$in": ["application/zip", "application/x-zip-compressed"]
+                    },
+                    "displayname": name,
                 },
-                "displayname": self.scorm_file,
-            },
-        )
+            )
         if not count:
-            raise Exception('SCORM package "{}" not found'.format(self.scorm_file))
+            raise Exception('SCORM package "{}" not found'.format(name))
         # Since course content names are unique we are sure that we
         # can't have multiple results, so we just pop the first.
-        return scorm_content.pop()
+        scorm_package = get_asset_metadata(scorm_content.pop())
+        self.asset_cache.set(cache_key, scorm_package)
+        return scorm_package
 
     def _get_package_file_and_extract(self):
         """
         If the SCORM package is not already extracted, then
         get and extract the SCORM package
+
+        Concurrent calls are coordinated by a lock, such that a single worker extracts
+        the package while the others wait for at most EXTRACT_WAIT seconds. Return
+        False if the package is still being extracted after that, or if it could not
+        be extracted.
         """
         # Check if the `package_meta` has `sha1` key to make sure
         # if the package name is not empty
-        if "sha1" in self.package_meta and not self.storage.exists(
-            self.extract_folder_path
-        ):
+        if "sha1" not in self.package_meta:
+            return True
+        if self.get_cached_package_state("extracted"):
+            return True
+        # Locks are only taken when the package is missing
+        if self.is_package_extracted():
+            self.set_cached_package_state(extracted=True)
+            return True
+        if self.has_recent_extraction_failure():
+            return False
+        with locks.single_flight(
+            self.extract_folder_path,
+            lock_factory=self.extract_lock,
+            wait=parse_float(
+                self.xblock_settings.get("EXTRACT_WAIT"), locks.DEFAULT_WAIT
+            ),
+            timeout=parse_int(
+                self.xblock_settings.get("EXTRACT_LOCK_TIMEOUT"), locks.DEFAULT_TIMEOUT
+            ),
+        ) as acquired:
+            if not acquired:
+                logger.info(
+                    'SCORM package is being extracted in "%s" by another worker',
+                    self.extract_folder_path,
+                )
+                return False
+            # The package may have been extracted while we were waiting
+            if self.is_package_extracted():
+                self.set_cached_package_state(extracted=True)
+                return True
+            if self.has_recent_extraction_failure():
+                return False
             logger.info(
                 'SCORM package is not extracted in "%s". Extracting it now.',
                 self.extract_folder_path,
             )
+            peak_rss = get_peak_rss()
+            extracted = True
             try:
-                package_file = self._get_package_file()
-                self.extract_package(package_file)
+                with self._get_package_file() as package_file:
+                    if package_file.digest != self.package_meta["sha1"]:
+                        # The asset was replaced, e.g. by an upload that is still
+                        # being ingested: it must not be extracted to this folder
+                        raise ScormError(
+                            'SCORM package "{}" does not match its digest'.format(
+                                package_file.name
+                            )
+                        )
+                    if self.serves_zip:
+                        self.save_package_zip(package_file, self.extract_folder_path)
+                    else:
+                        self.extract_package(package_file)
+                if self.package_meta.get("layout") == packages.SHARED_LAYOUT:
+                    self.add_package_reference()
+                self.set_cached_package_state(extracted=True)
             except Exception as e:
                 logger.warning(e)
+                # Failures are not retried on every view: the package would be
+                # downloaded again every time
+                self.set_cached_package_state(extraction_failed=time.time())
+                extracted = False
+            log_peak_rss("SCORM package extraction", peak_rss)
+        return extracted
+
+    def has_recent_extraction_failure(self):
+        """
+        Return True if the extraction of the current package failed less than
+        EXTRACT_RETRY_DELAY seconds ago, in this process or, with a shared CACHE_ALIAS,
+        in any process.
+        """
+        failed_at = self.get_cached_package_state("extraction_failed")
+        return failed_at is not None and time.time() - failed_at < parse_float(
+            self.xblock_settings.get("EXTRACT_RETRY_DELAY"), 60
+        )
 
-    def _get_package_file(self):
+    def is_package_extracted(self):
         """
-        Convert the file content (in bytes) to a ContentFile and return it
+        Return True if the current package is completely extracted. Packages that were
+        extracted by this version have a file index, which is saved last and which must
+        match the number of files and size recorded in the package metadata. Older
+        packages only have to exist. Packages that are served from their zip file must
+        have a zip index.
         """
-        scorm_package = self._search_scorm_package()
-        # We are actually loading the whole zipfile in memory.
-        # This step should probably be handled more carefully.
+        if self.serves_zip:
+            return self.get_zip_index(self.extract_folder_path) is not None
+        index = self.get_file_index(self.extract_folder_path)
+        if index is None:
+            return "file_count" not in self.package_meta and self.storage.exists(
+                self.extract_folder_path
+            )
+        if "file_count" not in self.package_meta:
+            return True
+        return fileindex.get_totals(index) == (
+            self.package_meta["file_count"],
+            self.package_meta["extracted_size"],
+        )
+
+    @property
+    def package_cache(self):
+        return cache.get_cache("package", self.xblock_settings)
 
-        # Code snippet borrowed from
-        # https://github.com/Abstract-Tech/abstract-scorm-xblock/blob/11c2f0ec61dbc4d4e1af37b5a203c2f8be7eb944/abstract_scorm_xblock/abstract_scorm_xblock/scormxblock.py#L343
-        scorm_zipfile_data = contentstore().find(scorm_package["asset_key"]).data
+    @property
+    def asset_cache(self):
+        return cache.get_cache("asset", self.xblock_settings)
 
-        return ContentFile(scorm_zipfile_data)
+    @property
+    def package_cache_key(self):
+        return (str(self.scope_ids.usage_id), self.package_meta.get("sha1"))
 
-    def clean_storage(self):
+    def get_cached_package_state(self, name):
+        """
+        Return a value from the cached state of the current package, or None. This
+        state is used to avoid storage requests when rendering the xblock.
+        """
+        return (self.package_cache.get(self.package_cache_key) or {}).get(name)
+
+    def set_cached_package_state(self, **values):
+        state = dict(self.package_cache.get(self.package_cache_key) or {})
+        state.update(values)
+        self.package_cache.set(self.package_cache_key, state)
+
+    def clear_cached_package_state(self):
+        self.package_cache.delete(self.package_cache_key)
+
+    @instrumentation.timed("get_package_file")
+    def _get_package_file(self):
+        """
+        Spool the package from the contentstore to a temporary file and return it as a
+        seekable File. The package is never loaded in memory as a whole. The caller is
+        responsible for closing the returned file, which deletes the temporary copy.
+
+        The package that is described by the package metadata is fetched, which may
+        differ from the scorm file while a new package is being ingested. It is fetched
+        from the asset that was pinned when it was ingested, if any, without searching
+        the contentstore. The digest of the returned file is computed with the hash
+        algorithm of the package, such that it can be checked by the caller.
+        """
+        name = self.package_meta.get("name") or self.scorm_file
+        hash_algorithm = self.package_meta.get(
+            "hash_algorithm", hashing.DEFAULT_ALGORITHM
+        )
+        asset_key = (self.package_meta.get("asset") or {}).get("asset_key")
+        if asset_key:
+            try:
+                return spool_asset(asset_key, name, hash_algorithm=hash_algorithm)
+            except Exception as e:  # pylint: disable=broad-except
+                logger.warning(
+                    'Could not fetch SCORM package from asset "%s": %s', asset_key, e
+                )
+        scorm_package = self._search_scorm_package(use_cache=True, name=name)
+        return spool_asset(
+            scorm_package["asset_key"], name, hash_algorithm=hash_algorithm
+        )
+
+    @instrumentation.timed("clean_storage")
+    def clean_storage(self, keep=None):
+        """
+        Remove previously unzipped packages. The `keep` sub-folder of the base folder,
+        if any, is not removed.
+        """
         if self.storage.exists(self.extract_folder_base_path):
             logger.info(
                 'Removing previously unzipped "%s"', self.extract_folder_base_path
             )
-            self.recursive_delete(self.extract_folder_base_path)
+            self.recursive_delete(self.extract_folder_base_path, exclude=keep)
 
-    def recursive_delete(self, root):
+    def recursive_delete(self, root, exclude=None, keep=None):
         """
         Recursively delete the contents of a directory in the Django default storage.
-        Unfortunately, this will not delete empty folders, as the default FileSystemStorage
-        implementation does not allow it.
+        See `packages.delete_folder`.
         """
-        directories, files = self.storage.listdir(root)
-        for directory in directories:
-            self.recursive_delete(os.path.join(root, directory))
-        for f in files:
-            self.storage.delete(os.path.join(root, f))
+        packages.delete_folder(
+            self.storage, root, exclude=exclude, workers=self.delete_workers, keep=keep
+        )
+        self.package_cache.delete(("file_index", root))
+        self.package_cache.delete(("zip_index", root))
+
+    @instrumentation.timed("save_package_zip")
+    def save_package_zip(self, package_file, extract_folder_path=None):
+        """
+        Upload the package zip file to `extract_folder_path`, which defaults to the
+        current extraction folder, together with the index of its members, and return
+        its manifest model. The package is not extracted: its files are served by the
+        `serve_asset` handler.
+        """
+        extract_folder_path = extract_folder_path or self.extract_folder_path
+        with zipfile.ZipFile(package_file, "r") as scorm_zipfile:
+            # The package is also checked against the extraction limits
+            root_path, manifest_model = self.read_manifest(
+                scorm_zipfile, self.extraction_limits
+            )
+        try:
+            index = zipserving.make_index(package_file, root_path)
+        except UnsafePackageError as e:
+            raise ScormError(e.args[0]) from e
+        zipserving.save_package(self.storage, extract_folder_path, package_file, index)
+        self.package_cache.set(("zip_index", extract_folder_path), index)
+        instrumentation.add("uploaded_bytes", index["size"])
+        return manifest_model
+
+    @instrumentation.timed("extract_package")
+    def extract_package(
+        self,
+        package_file,
+        extract_folder_path=None,
+        on_progress=None,
+        previous_folder_path=None,
+    ):
+        """
+        Extract the package to `extract_folder_path`, which defaults to the current
+        extraction folder, and return its manifest model. `on_progress` is passed to
+        the ZipExtractor.
 
-    def extract_package(self, package_file):
+        Files that are identical in the package extracted in `previous_folder_path`
+        are copied from there, when the storage supports server-side copies.
+
+        With the EXTRACT_CHECKPOINT_INTERVAL xblock setting, the list of saved files is
+        periodically saved as a checkpoint, and an interrupted extraction is resumed
+        from its last checkpoint.
+        """
+        extract_folder_path = extract_folder_path or self.extract_folder_path
         with zipfile.ZipFile(package_file, "r") as scorm_zipfile:
             zipinfos = scorm_zipfile.infolist()
-            root_path = None
-            root_depth = -1
-            # Find root folder which contains imsmanifest.xml
-            for zipinfo in zipinfos:
-                if os.path.basename(zipinfo.filename) == "imsmanifest.xml":
-                    depth = len(os.path.split(zipinfo.filename))
-                    if depth < root_depth or root_depth < 0:
-                        root_path = os.path.dirname(zipinfo.filename)
-                        root_depth = depth
-
-            if root_path is None:
-                raise ScormError(
-                    "Could not find 'imsmanifest.xml' file in the scorm package"
-                )
+            root_path, manifest_model = self.read_manifest(
+                scorm_zipfile, self.extraction_limits
+            )
 
+            members = []
+            index_entries = []
             for zipinfo in zipinfos:
+                # Do not unzip folders, only files. In Python 3.6 we will have access to
+                # the is_dir() method to verify whether a ZipInfo object points to a
+                # directory.
+                # https://docs.python.org/3.6/library/zipfile.html#zipfile.ZipInfo.is_dir
+                if zipinfo.filename.endswith("/"):
+                    continue
+                try:
+                    relpath = get_member_path(zipinfo.filename, root_path)
+                except UnsafePackageError as e:
+                    raise ScormError(e.args[0]) from e
                 # Extract only files that are below the root
-                if zipinfo.filename.startswith(root_path):
-                    # Do not unzip folders, only files. In Python 3.6 we will have access to
-                    # the is_dir() method to verify whether a ZipInfo object points to a
-                    # directory.
-                    # https://docs.python.org/3.6/library/zipfile.html#zipfile.ZipInfo.is_dir
-                    if not zipinfo.filename.endswith("/"):
-                        dest_path = os.path.join(
-                            self.extract_folder_path,
-                            os.path.relpath(zipinfo.filename, root_path),
-                        )
-                        self.storage.save(
-                            dest_path,
-                            ContentFile(scorm_zipfile.read(zipinfo.filename)),
-                        )
+                if relpath is not None:
+                    dest_path = os.path.join(extract_folder_path, relpath)
+                    members.append((zipinfo, dest_path))
+                    index_entries.append((relpath, zipinfo.file_size, zipinfo.CRC))
+            publisher = self.get_asset_publisher()
+            sources = self.get_unchanged_files(
+                previous_folder_path, extract_folder_path, index_entries, publisher
+            )
+            checkpoint = None
+            on_saved = None
+            if self.checkpoint_interval:
+                checkpoint = fileindex.Checkpoint(
+                    self.storage, extract_folder_path, self.checkpoint_interval
+                )
+                member_entries = {
+                    dest_path: entry
+                    for (_zipinfo, dest_path), entry in zip(members, index_entries)
+                }
+
+                def on_saved(dest_path, variants):
+                    checkpoint.add(
+                        [member_entries[dest_path]]
+                        + [
+                            (os.path.relpath(path, extract_folder_path), size, crc)
+                            for path, size, crc in variants
+                        ]
+                    )
+
+            extractor = ZipExtractor(
+                self.storage,
+                workers=self.extract_workers,
+                on_progress=on_progress,
+                limits=self.extraction_limits,
+                copy=packages.get_copy_function(self.storage) if sources else None,
+                publisher=publisher,
+                on_saved=on_saved,
+                # Saved files are kept, such that the extraction can be resumed
+                rollback=checkpoint is None,
+            )
+            pending_members = members
+            resumed_entries = []
+            try:
+                # Reject unsafe packages before anything is written
+                extractor.check(members)
+                if checkpoint is not None and checkpoint.load():
+                    pending_members, resumed_entries = self.resume_extraction(
+                        extract_folder_path, members, index_entries, checkpoint
+                    )
+                elif self.storage.exists(extract_folder_path):
+                    # Clean destination folder, if it already exists. Shared folders
+                    # may also hold the zip file of the package, which is served to
+                    # other xblocks.
+                    self.recursive_delete(
+                        extract_folder_path, keep=zipserving.FILENAMES
+                    )
+                extractor.extract(scorm_zipfile, pending_members, sources=sources)
+            except UnsafePackageError as e:
+                if checkpoint is not None and self.storage.exists(extract_folder_path):
+                    # Unsafe packages must not be resumed
+                    self.recursive_delete(extract_folder_path)
+                raise ScormError(e.args[0]) from e
+            except BaseException:
+                if checkpoint is not None:
+                    checkpoint.save()
+                raise
+            members_count = len(index_entries)
+            members_size = sum(entry[1] for entry in index_entries)
+            index_entries += resumed_entries
+            for variants in extractor.variants.values():
+                for path, size, crc in variants:
+                    index_entries.append(
+                        (os.path.relpath(path, extract_folder_path), size, crc)
+                    )
+            # The index is saved last: packages that were only partially extracted
+            # do not have one.
+            if checkpoint is not None:
+                checkpoint.delete()
+            index = fileindex.make_index(
+                index_entries, file_count=members_count, size=members_size
+            )
+            fileindex.save_index(self.storage, extract_folder_path, index)
+            self.package_cache.set(("file_index", extract_folder_path), index)
+            instrumentation.add("extracted_files", extractor.files_extracted)
+            instrumentation.add("extracted_bytes", extractor.bytes_written)
+            logger.info(
+                'Extracted %d files (%d bytes) to "%s"',
+                extractor.files_extracted,
+                extractor.bytes_written,
+                extract_folder_path,
+            )
+            if publisher.original_bytes:
+                logger.info(
+                    "Precompressed %d bytes of text files: %s",
+                    publisher.original_bytes,
+                    ", ".join(
+                        "{} {} bytes".format(encoding, size)
+                        for encoding, size in publisher.compressed_bytes.items()
+                    ),
+                )
+            if extractor.files_copied:
+                logger.info(
+                    'Copied %d unchanged files from "%s" (%d bytes saved)',
+                    extractor.files_copied,
+                    previous_folder_path,
+                    extractor.bytes_copied,
+                )
+        return manifest_model
+
+    def get_previous_folder_path(self, package_meta):
+        """
+        Return the extraction folder of the current package, if it is about to be
+        replaced by the package described by `package_meta`, and incremental extraction
+        is enabled with the INCREMENTAL_EXTRACTION xblock setting (the default).
+        """
+        if not self.xblock_settings.get("INCREMENTAL_EXTRACTION", True):
+            return None
+        if self.package_meta.get("sha1") in [None, package_meta["sha1"]]:
+            return None
+        return self.extract_folder_path
+
+    def resume_extraction(self, extract_folder_path, members, entries, checkpoint):
+        """
+        Prepare the resumption of an interrupted extraction from its checkpoint: files
+        that were saved after the checkpoint, or that do not match the package, are
+        deleted. Return the members that remain to be extracted, and the
+        (path, size, crc) entries of the precompressed variants that were already saved.
+        """
+        committed = checkpoint.files
+        member_paths = set()
+        pending_members = []
+        for member, (path, size, crc) in zip(members, entries):
+            member_paths.add(path)
+            if committed.get(path, [None, None])[:2] != [size, crc]:
+                pending_members.append(member)
+                committed.pop(path, None)
+                for extension in publishing.ENCODINGS.values():
+                    committed.pop(path + extension, None)
+        for path in list(packages.list_folder_files(self.storage, extract_folder_path)):
+            relpath = os.path.relpath(path, extract_folder_path)
+            if (
+                relpath not in committed
+                and relpath != fileindex.CHECKPOINT_FILENAME
+                and relpath not in zipserving.FILENAMES
+            ):
+                self.storage.delete(path)
+        logger.info(
+            'Resuming the extraction of "%s": %d/%d files were already extracted',
+            extract_folder_path,
+            len(members) - len(pending_members),
+            len(members),
+        )
+        resumed_entries = [
+            (path, entry[0], entry[1])
+            for path, entry in committed.items()
+            if path not in member_paths
+        ]
+        return pending_members, resumed_entries
+
+    def get_unchanged_files(
+        self, previous_folder_path, extract_folder_path, entries, publisher
+    ):
+        """
+        Compare the (path, size, crc) entries of the new package with the file index of
+        the previous package. Return the paths of the unchanged files in the previous
+        folder, indexed by their destination path. Files that have precompressed
+        variants are not included, as their variants must be written, too.
+        """
+        if previous_folder_path is None:
+            return {}
+        previous_index = self.get_file_index(previous_folder_path)
+        if previous_index is None:
+            return {}
+        sources = {}
+        for path, size, crc in entries:
+            previous = previous_index["files"].get(path)
+            if publisher.is_compressible(path, size):
+                continue
+            if previous is not None and previous[:2] == [size, crc]:
+                sources[os.path.join(extract_folder_path, path)] = os.path.join(
+                    previous_folder_path, path
+                )
+        return sources
+
+    def get_package_manifest(self, package_file):
+        """
+        Return the manifest model of a package, without extracting it.
+        """
+        with zipfile.ZipFile(package_file, "r") as scorm_zipfile:
+            return self.read_manifest(scorm_zipfile, self.extraction_limits)[1]
+
+    @staticmethod
+    def read_manifest(scorm_zipfile, limits=DEFAULT_LIMITS):
+        """
+        Find the root folder of the package, which contains imsmanifest.xml, and parse
+        the manifest in a single pass. Return the root path and the manifest model.
+        When the manifest does not define an index page, the first "index.html" file
+        below the root is used instead.
+
+        The package is checked against the extraction `limits` before anything is
+        decompressed, and at most MAX_MANIFEST_SIZE bytes of the manifest are read.
+        """
+        try:
+            check_limits(
+                [
+                    (zipinfo, zipinfo.filename)
+                    for zipinfo in scorm_zipfile.infolist()
+                    if not zipinfo.filename.endswith("/")
+                ],
+                limits,
+            )
+        except UnsafePackageError as e:
+            raise ScormError(e.args[0]) from e
+        root_path = None
+        root_depth = -1
+        # Find root folder which contains imsmanifest.xml
+        for zipinfo in scorm_zipfile.infolist():
+            if os.path.basename(zipinfo.filename) == "imsmanifest.xml":
+                depth = zipinfo.filename.count("/")
+                if depth < root_depth or root_depth < 0:
+                    root_path = os.path.dirname(zipinfo.filename)
+                    root_depth = depth
+
+        if root_path is None:
+            raise ScormError(
+                "Could not find 'imsmanifest.xml' file in the scorm package"
+            )
+
+        with scorm_zipfile.open(os.path.join(root_path, "imsmanifest.xml")) as f:
+            try:
+                manifest_model = manifest.parse_manifest(
+                    BoundedReader(f, MAX_MANIFEST_SIZE, "imsmanifest.xml")
+                )
+            except ET.ParseError as e:
+                raise ScormError("Invalid imsmanifest.xml file: {}".format(e)) from e
+            except UnsafePackageError as e:
+                raise ScormError(e.args[0]) from e
+
+        if manifest_model["index_page_path"] is None:
+            index_depth = -1
+            for zipinfo in scorm_zipfile.infolist():
+                if os.path.basename(zipinfo.filename) == "index.html":
+                    relpath = os.path.relpath(zipinfo.filename, root_path)
+                    depth = relpath.count("/")
+                    if relpath.startswith("..") or 0 <= index_depth <= depth:
+                        continue
+                    manifest_model["index_page_path"] = relpath
+                    index_depth = depth
+        return root_path, manifest_model
 
     @property
     def index_page_url(self):
         if not self.package_meta or not self.index_page_path:
             return ""
+        if self.serves_zip:
+            # Relative urls in package files resolve to the same handler
+            parts = urlsplit(self.index_page_path)
+            return self.runtime.handler_url(
+                self,
+                "serve_asset",
+                "{}/{}".format(self.package_meta["sha1"], parts.path),
+                query=parts.query,
+            )
+        index_page_url = self.get_cached_package_state("index_page_url")
+        if index_page_url and index_page_url[0] == self.index_page_path:
+            return index_page_url[1]
         folder = self.extract_folder_path
-        if self.storage.exists(
+        shared = self.package_meta.get("layout") == packages.SHARED_LAYOUT
+        if not shared and self.storage.exists(
             os.path.join(self.extract_folder_base_path, self.index_page_path)
         ):
             # For backward-compatibility, we must handle the case when the xblock data
             # is stored in the base folder.
             folder = self.extract_folder_base_path
             logger.warning("Serving SCORM content from old-style path: %s", folder)
-        return self.storage.url(os.path.join(folder, self.index_page_path))
+        url = self.storage.url(os.path.join(folder, self.index_page_path))
+        self.set_cached_package_state(index_page_url=(self.index_page_path, url))
+        return url
 
     @property
     def extract_folder_path(self):
@@ -372,7 +1091,17 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         This path needs to depend on the content of the scorm package. Otherwise,
         served media files might become stale when the package is update.
         """
-        return os.path.join(self.extract_folder_base_path, self.package_meta["sha1"])
+        return self.get_extract_folder_path(self.package_meta)
+
+    def get_extract_folder_path(self, package_meta):
+        """
+        Packages with the "shared" layout are extracted to a content-addressed folder
+        that is shared by all xblocks. Other packages are extracted to a sub-folder of
+        the xblock base folder.
+        """
+        if package_meta.get("layout") == packages.SHARED_LAYOUT:
+            return packages.package_path(self.scorm_location(), package_meta["sha1"])
+        return os.path.join(self.extract_folder_base_path, package_meta["sha1"])
 
     @property
     def extract_folder_base_path(self):
@@ -380,14 +1109,21 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         Path to the folder where packages will be extracted.
         Compute hash of the unique block usage_id and use that as our directory name.
         """
-        # For backwards compatibility, we return the old path if the directory exists
-        if self.storage.exists(self.extract_old_folder_base_path):
-            if 'scorm_v2' not in self.extract_old_folder_base_path:
-                return self.extract_old_folder_base_path
+        base_folder = self.get_cached_package_state("base_folder")
+        if base_folder is None:
+            base_folder = os.path.join(self.scorm_location(), self.hashed_usage_id)
+            # For backwards compatibility, we return the old path if it exists
+            if self.storage.exists(self.extract_old_folder_base_path):
+                if "scorm_v2" not in self.extract_old_folder_base_path:
+                    base_folder = self.extract_old_folder_base_path
+            self.set_cached_package_state(base_folder=base_folder)
+        return base_folder
+
+    @property
+    def hashed_usage_id(self):
         sha1 = hashlib.sha1()
         sha1.update(str(self.scope_ids.usage_id).encode())
-        hashed_usage_id = sha1.hexdigest()
-        return os.path.join(self.scorm_location(), hashed_usage_id)
+        return sha1.hexdigest()
 
     @property
     def extract_old_folder_base_path(self):
@@ -411,17 +1147,88 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             return {"value": self.success_status}
         if name in ["cmi.core.score.raw", "cmi.score.raw"]:
             return {"value": self.lesson_score * 100}
-        return {"value": self.scorm_data.get(name, "")}
+        return {"value": self.cmi_data.get(name, "")}
 
     @XBlock.json_handler
+    @instrumentation.timed("scorm_set_values")
     def scorm_set_values(self, data_list, _suffix):
-        return [self.set_value(data) for data in data_list]
+        instrumentation.add("values", len(data_list))
+        return self.set_values(data_list)
 
     @XBlock.json_handler
     def scorm_set_value(self, data, _suffix):
-        return self.set_value(data)
+        return self.set_values([data])[0]
 
-    def set_value(self, data):
+    @XBlock.handler
+    @instrumentation.timed("serve_asset")
+    def serve_asset(self, request, suffix=""):
+        """
+        Serve a file of a package that is served from its zip file. The suffix is
+        "{sha1}/{path}", such that urls change with the package and responses can be
+        cached. See the zipserving module.
+        """
+        sha1, _, path = suffix.partition("/")
+        if not self.serves_zip or sha1 != self.package_meta.get("sha1"):
+            return Response(status=404)
+        if not self._get_package_file_and_extract():
+            # The package zip file is being uploaded by another worker
+            return Response(status=503, headers={"Retry-After": "5"})
+        extract_folder_path = self.extract_folder_path
+        index = self.get_zip_index(extract_folder_path)
+        member = index["members"].get(os.path.normpath(path)) if index else None
+        if member is None:
+            return Response(status=404)
+        data = zipserving.get_local_copy(
+            self.storage,
+            zipserving.package_path(extract_folder_path),
+            "{}.zip".format(sha1),
+            index["size"],
+            directory=self.xblock_settings.get("ZIP_CACHE_DIR"),
+            max_size=parse_int(
+                self.xblock_settings.get("ZIP_CACHE_MAX_SIZE"),
+                zipserving.DEFAULT_CACHE_MAX_SIZE,
+            ),
+        )
+        return zipserving.serve_member(
+            request, data, path, member, etag="{}-{:08x}".format(sha1, member[3])
+        )
+
+    def set_values(self, data_list):
+        """
+        Apply a batch of values to the learner state. Then publish at most one
+        completion and one grade event, and only if the learner state changed.
+        """
+        initial_status = (self.lesson_status, self.success_status)
+        initial_score = self.lesson_score
+        pending_events = Counter()
+        results = [self.set_value(data, pending_events) for data in data_list]
+        changes = getattr(self, "_cmi_data_changes", None)
+        if changes:
+            if not self.save_cmi_data():
+                for data, result in zip(data_list, results):
+                    if data.get("name") in changes:
+                        result.update({"result": "error", "error": "Data is too large"})
+
+        status_changed = (self.lesson_status, self.success_status) != initial_status
+        score_changed = self.lesson_score != initial_score
+        if pending_events["completion"]:
+            if status_changed or score_changed:
+                self.publish_completion()
+                pending_events["completion"] -= 1
+            publish_counters["completion_skipped"] += pending_events["completion"]
+        if pending_events["grade"]:
+            if score_changed:
+                self.publish_grade()
+                pending_events["grade"] -= 1
+            publish_counters["grade_skipped"] += pending_events["grade"]
+        return results
+
+    def set_value(self, data, pending_events=None):
+        """
+        Apply a single value to the learner state. If `pending_events` is a Counter,
+        completion and grade events are not published but counted in it, such that
+        they can be published once per batch by the caller.
+        """
         name = data.get("name")
         completion_percent = None
         success_status = None
@@ -448,7 +1255,17 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             except (ValueError, TypeError):
                 pass
         else:
-            self.scorm_data[name] = data.get("value", "")
+            value = data.get("value", "")
+            if not scormdata.is_valid_name(name):
+                logger.warning("Discarding SCORM value with invalid name: %s", name)
+                return {"result": "error", "error": "Invalid element name"}
+            if scormdata.value_size(value) > self.scorm_data_max_value_size:
+                logger.warning("Discarding SCORM value that is too large: %s", name)
+                return {"result": "error", "error": "Value is too large"}
+            self.cmi_data[name] = value
+            self._cmi_data_changes.add(name)
+            if pending_events is None:
+                self.save_cmi_data()
 
         context = {"result": "success"}
         if lesson_score is not None:
@@ -467,20 +1284,75 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             or completion_status == "completed"
             or (is_completed and lesson_score)
         ):
-            self.publish_completion()
-        if (self.has_score and lesson_score and lesson_score > 0):
-            self.publish_grade()
+            if pending_events is None:
+                self.publish_completion()
+            else:
+                pending_events["completion"] += 1
+        if self.has_score and lesson_score and lesson_score > 0:
+            if pending_events is None:
+                self.publish_grade()
+            else:
+                pending_events["grade"] += 1
 
         return context
 
+    @property
+    def cmi_data(self):
+        """
+        Flat dict of the SCORM runtime data of the learner. It is decoded from the
+        scorm_data field once per xblock instance. Changes must be saved with
+        `save_cmi_data`.
+        """
+        if getattr(self, "_cmi_data", None) is None:
+            self._cmi_data = scormdata.unpack(self.scorm_data)
+            self._cmi_data_changes = set()
+        return self._cmi_data
+
+    def save_cmi_data(self):
+        """
+        Encode the runtime data to the scorm_data field. If the encoded data is larger
+        than the SCORM_DATA_MAX_SIZE xblock setting, the changes are discarded and
+        False is returned.
+        """
+        packed = scormdata.pack(self.cmi_data)
+        self._cmi_data_changes = set()
+        if scormdata.packed_size(packed) > self.scorm_data_max_size:
+            logger.warning(
+                "Discarding SCORM data changes: data exceeds %d characters",
+                self.scorm_data_max_size,
+            )
+            self._cmi_data = None
+            return False
+        self.scorm_data = packed
+        return True
+
+    @property
+    def scorm_data_max_value_size(self):
+        """
+        Maximum size of a single runtime data value, defined by the
+        SCORM_DATA_MAX_VALUE_SIZE xblock setting. The default is the largest
+        suspend_data size that SCORM 2004 packages may expect.
+        """
+        return parse_int(self.xblock_settings.get("SCORM_DATA_MAX_VALUE_SIZE"), 64000)
+
+    @property
+    def scorm_data_max_size(self):
+        """
+        Maximum size of the encoded runtime data of a learner, defined by the
+        SCORM_DATA_MAX_SIZE xblock setting.
+        """
+        return parse_int(self.xblock_settings.get("SCORM_DATA_MAX_SIZE"), 512000)
+
     def publish_completion(self):
         """
         Utility method used to mark a vertical block as complete.
         """
         completion_percent = 1.0
         self.emit_completion(completion_percent)
+        publish_counters["completion_published"] += 1
 
     def publish_grade(self):
+        publish_counters["grade_published"] += 1
         self.runtime.publish(
             self,
             "grade",
@@ -526,57 +1398,85 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         return self.weight if self.has_score else None
 
     def update_package_meta(self, package_file):
-        self.package_meta["sha1"] = self.get_sha1(package_file)
-        self.package_meta["name"] = package_file.name
-        self.package_meta["last_updated"] = timezone.now().strftime(
-            DateTime.DATETIME_FORMAT
-        )
-        self.package_meta["size"] = package_file.seek(0, 2)
+        self.package_meta.update(self.get_package_meta(package_file))
+
+    def get_package_meta(self, package_file, digest=None):
+        """
+        Return the metadata of a package file. The package `digest` may have been
+        computed with the HASH_ALGORITHM while the file was spooled; otherwise, the file
+        is read once more. For compatibility, the digest is stored as "sha1", whatever
+        the algorithm.
+        """
+        algorithm = self.hash_algorithm
+        if digest is None:
+            if algorithm == hashing.DEFAULT_ALGORITHM:
+                digest = self.get_sha1(package_file)
+            else:
+                digest = hashing.get_digest(package_file, algorithm)
+        package_meta = {
+            "sha1": digest,
+            "name": package_file.name,
+            "last_updated": timezone.now().strftime(DateTime.DATETIME_FORMAT),
+            "size": package_file.seek(0, 2),
+            "hash_algorithm": algorithm,
+        }
         package_file.seek(0)
+        return package_meta
 
+    @instrumentation.timed("update_package_fields")
     def update_package_fields(self):
         """
         Update version and index page path fields.
         """
-        imsmanifest_path = self.find_file_path("imsmanifest.xml")
-        imsmanifest_file = self.storage.open(imsmanifest_path)
-        tree = ET.parse(imsmanifest_file)
-        imsmanifest_file.seek(0)
-        namespace = ""
-        for _, node in ET.iterparse(imsmanifest_file, events=["start-ns"]):
-            if node[0] == "":
-                namespace = node[1]
-                break
-        root = tree.getroot()
-
-        prefix = "{" + namespace + "}" if namespace else ""
-        resource = root.find(
-            "{prefix}resources/{prefix}resource[@href]".format(prefix=prefix)
-        )
-        schemaversion = root.find(
-            "{prefix}metadata/{prefix}schemaversion".format(prefix=prefix)
-        )
+        if "manifest" not in self.package_meta:
+            # Packages that were extracted by previous versions
+            self.package_meta["manifest"] = self.read_extracted_manifest(
+                self.extract_folder_path
+            )
+        fields = self.get_package_fields(self.package_meta["manifest"])
+        self.index_page_path = fields["index_page_path"]
+        self.scorm_version = fields["scorm_version"]
 
-        if resource is not None:
-            self.index_page_path = resource.get("href")
-        else:
-            self.index_page_path = self.find_relative_file_path("index.html")
-        if (schemaversion is not None) and (
-            re.match("^1.2$", schemaversion.text) is None
-        ):
-            self.scorm_version = "SCORM_2004"
-        else:
-            self.scorm_version = "SCORM_12"
+    @staticmethod
+    def get_package_fields(manifest_model):
+        """
+        Return the values of the version and index page path fields, as defined by the
+        manifest model.
+        """
+        if manifest_model["index_page_path"] is None:
+            raise ScormError("Invalid package: could not find 'index.html' file")
+        return {
+            "index_page_path": manifest_model["index_page_path"],
+            "scorm_version": manifest_model["scorm_version"],
+        }
 
-    def find_relative_file_path(self, filename):
-        return os.path.relpath(self.find_file_path(filename), self.extract_folder_path)
+    def read_extracted_manifest(self, extract_folder_path):
+        """
+        Parse the manifest of the package extracted in `extract_folder_path` and return
+        the manifest model.
+        """
+        imsmanifest_path = self.find_file_path("imsmanifest.xml", extract_folder_path)
+        with self.storage.open(imsmanifest_path) as imsmanifest_file:
+            manifest_model = manifest.parse_manifest(imsmanifest_file)
+        if manifest_model["index_page_path"] is None:
+            path = self.get_file_path("index.html", extract_folder_path)
+            if path is not None:
+                manifest_model["index_page_path"] = os.path.relpath(
+                    path, extract_folder_path
+                )
+        return manifest_model
 
-    def find_file_path(self, filename):
+    def find_relative_file_path(self, filename, root=None):
+        root = root or self.extract_folder_path
+        return os.path.relpath(self.find_file_path(filename, root), root)
+
+    def find_file_path(self, filename, root=None):
         """
-        Search recursively in the extracted folder for a given file. Path of the first
-        found file will be returned. Raise a ScormError if file cannot be found.
+        Search recursively in the extracted folder (or `root`) for a given file. Path of
+        the first found file will be returned. Raise a ScormError if file cannot be
+        found.
         """
-        path = self.get_file_path(filename, self.extract_folder_path)
+        path = self.get_file_path(filename, root or self.extract_folder_path)
         if path is None:
             raise ScormError(
                 "Invalid package: could not find '{}' file".format(filename)
@@ -587,6 +1487,10 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         """
         Same as `find_file_path`, but don't raise error on file not found.
         """
+        index = self.get_file_index(root)
+        if index is not None:
+            path = fileindex.find_file(index, filename)
+            return None if path is None else os.path.join(root, path)
         subfolders, files = self.storage.listdir(root)
         for f in files:
             if f == filename:
@@ -597,6 +1501,62 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
                 return path
         return None
 
+    def get_file_index(self, extract_folder_path):
+        """
+        Return the file index of the package extracted in `extract_folder_path`, or
+        None if the package was extracted by a previous version. Extraction folders
+        are immutable, so that their index is cached.
+        """
+        key = ("file_index", extract_folder_path)
+        index = self.package_cache.get(key)
+        if index is None:
+            index = fileindex.load_index(self.storage, extract_folder_path)
+            if index is not None:
+                self.package_cache.set(key, index)
+        return index
+
+    def get_zip_index(self, extract_folder_path):
+        """
+        Return the index of the package zip file stored in `extract_folder_path`, or
+        None. Like file indexes, zip indexes are immutable and cached.
+        """
+        key = ("zip_index", extract_folder_path)
+        index = self.package_cache.get(key)
+        if index is None:
+            index = zipserving.load_index(self.storage, extract_folder_path)
+            if index is not None:
+                self.package_cache.set(key, index)
+        return index
+
+    def is_package_stored(self, package_meta):
+        """
+        Return True if the package described by `package_meta` was completely stored,
+        either extracted or as a zip file, depending on its serving mode.
+        """
+        extract_folder_path = self.get_extract_folder_path(package_meta)
+        if package_meta.get("serving_mode") == zipserving.ZIP_MODE:
+            return self.get_zip_index(extract_folder_path) is not None
+        return self.get_file_index(extract_folder_path) is not None
+
+    def check_index_page(self, package_meta, index_page_path):
+        """
+        Raise a ScormError if the index page is not part of the stored package.
+        """
+        extract_folder_path = self.get_extract_folder_path(package_meta)
+        if package_meta.get("serving_mode") == zipserving.ZIP_MODE:
+            index = self.get_zip_index(extract_folder_path)
+            files = index["members"] if index else None
+        else:
+            index = self.get_file_index(extract_folder_path)
+            files = index["files"] if index else None
+        if files is None:
+            return
+        path = unquote(urlsplit(index_page_path).path)
+        if os.path.normpath(path) not in files:
+            raise ScormError(
+                "Invalid package: could not find '{}' file".format(index_page_path)
+            )
+
     def scorm_location(self):
         """
         Unzipped files will be stored in a media folder with this name, and thus
@@ -605,20 +1565,159 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         default_scorm_location = "scorm"
         return self.xblock_settings.get("LOCATION", default_scorm_location)
 
+    @property
+    def ingest_executor(self):
+        """
+        Function that runs background ingestion jobs, when the ASYNC_INGEST xblock
+        setting is enabled. This is defined by the INGEST_EXECUTOR xblock setting.
+        """
+        executor = self.xblock_settings.get(
+            "INGEST_EXECUTOR", ingest.thread_pool_executor
+        )
+        if isinstance(executor, string_types):
+            executor = import_string(executor)
+        return executor
+
+    @property
+    def extract_workers(self):
+        """
+        Number of threads that concurrently upload package files to the storage backend
+        during extraction. This is defined by the EXTRACT_WORKERS xblock setting.
+        """
+        default_extract_workers = 4
+        return parse_int(
+            self.xblock_settings.get("EXTRACT_WORKERS"), default_extract_workers
+        )
+
+    def get_asset_publisher(self):
+        """
+        Return the publishing.AssetPublisher that saves extracted files to the storage.
+        It is configured with the PRECOMPRESS, CACHE_CONTROL and PUBLISH_FUNC xblock
+        settings.
+        """
+        publish_func = self.xblock_settings.get("PUBLISH_FUNC")
+        if isinstance(publish_func, string_types):
+            publish_func = import_string(publish_func)
+        return publishing.AssetPublisher(
+            self.storage,
+            publish_func=publish_func,
+            encodings=self.xblock_settings.get("PRECOMPRESS", []),
+            cache_control=self.xblock_settings.get(
+                "CACHE_CONTROL", publishing.IMMUTABLE_CACHE_CONTROL
+            ),
+        )
+
+    @property
+    def package_layout(self):
+        """
+        Layout of the extracted packages, as defined by the SHARED_PACKAGES xblock
+        setting.
+        """
+        if self.xblock_settings.get("SHARED_PACKAGES", True):
+            return packages.SHARED_LAYOUT
+        return packages.BLOCK_LAYOUT
+
+    @property
+    def serving_mode(self):
+        """
+        Serving mode of new packages, as defined by the SERVING_MODE xblock setting:
+        "extract", the default, or "zip". See the zipserving module.
+        """
+        serving_mode = self.xblock_settings.get(
+            "SERVING_MODE", zipserving.EXTRACT_MODE
+        )
+        if serving_mode not in [zipserving.EXTRACT_MODE, zipserving.ZIP_MODE]:
+            logger.warning('Unsupported SCORM serving mode "%s"', serving_mode)
+            return zipserving.EXTRACT_MODE
+        return serving_mode
+
+    @property
+    def serves_zip(self):
+        """
+        True if the current package is served from its zip file.
+        """
+        return self.package_meta.get("serving_mode") == zipserving.ZIP_MODE
+
+    @property
+    def hash_algorithm(self):
+        """
+        Algorithm of the digest of new packages, as defined by the HASH_ALGORITHM
+        xblock setting. Unsupported algorithms fall back to SHA-1.
+        """
+        algorithm = self.xblock_settings.get(
+            "HASH_ALGORITHM", hashing.DEFAULT_ALGORITHM
+        )
+        if not hashing.is_supported(algorithm):
+            logger.warning('Unsupported SCORM package hash algorithm "%s"', algorithm)
+            return hashing.DEFAULT_ALGORITHM
+        return algorithm
+
+    @property
+    def checkpoint_interval(self):
+        """
+        Number of saved files after which the extraction checkpoint is saved. This is
+        defined by the EXTRACT_CHECKPOINT_INTERVAL xblock setting. Extractions are not
+        resumable when it is 0, which is the default.
+        """
+        return parse_int(self.xblock_settings.get("EXTRACT_CHECKPOINT_INTERVAL"), 0)
+
+    @property
+    def extract_lock(self):
+        """
+        Function that returns the cross-process lock of package extractions. This is
+        defined by the EXTRACT_LOCK xblock setting. See the locks module.
+        """
+        lock_factory = self.xblock_settings.get("EXTRACT_LOCK", locks.CacheLock)
+        if isinstance(lock_factory, string_types):
+            lock_factory = import_string(lock_factory)
+        return lock_factory
+
+    @property
+    def metrics(self):
+        """
+        Metrics sink, which is defined by the METRICS xblock setting. See the
+        instrumentation module.
+        """
+        return instrumentation.get_metrics(self.xblock_settings)
+
+    @property
+    def extraction_limits(self):
+        """
+        Limits on the total uncompressed size, number of files and compression ratio of
+        extracted packages. These are defined by the MAX_UNCOMPRESSED_SIZE,
+        MAX_FILE_COUNT and MAX_COMPRESSION_RATIO xblock settings.
+        """
+        return ExtractionLimits(
+            max_uncompressed_size=parse_int(
+                self.xblock_settings.get("MAX_UNCOMPRESSED_SIZE"),
+                DEFAULT_LIMITS.max_uncompressed_size,
+            ),
+            max_file_count=parse_int(
+                self.xblock_settings.get("MAX_FILE_COUNT"),
+                DEFAULT_LIMITS.max_file_count,
+            ),
+            max_ratio=parse_float(
+                self.xblock_settings.get("MAX_COMPRESSION_RATIO"),
+                DEFAULT_LIMITS.max_ratio,
+            ),
+        )
+
+    @property
+    def delete_workers(self):
+        """
+        Number of threads that concurrently delete files from the storage backend. This
+        is defined by the DELETE_WORKERS xblock setting.
+        """
+        return parse_int(
+            self.xblock_settings.get("DELETE_WORKERS"), packages.DEFAULT_DELETE_WORKERS
+        )
+
     @staticmethod
     def get_sha1(file_descriptor):
         """
         Get file hex digest (fingerprint).
         """
-        block_size = 8 * 1024
-        sha1 = hashlib.sha1()
-        while True:
-            block = file_descriptor.read(block_size)
-            if not block:
-                break
-            sha1.update(block)
-        file_descriptor.seek(0)
-        return sha1.hexdigest()
+        return hashing.get_digest(file_descriptor, "sha1")
 
     def student_view_data(self):
         """
@@ -627,9 +1726,7 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
 
         Note: we are not sure what this view is for and it might be removed in the future.
         """
-        self._get_package_file_and_extract()
-
-        if self.index_page_url:
+        if self._get_package_file_and_extract() and self.index_page_url:
             return {
                 "last_modified": self.package_meta.get("last_updated", ""),
                 "size": self.package_meta.get("size", 0),
@@ -663,7 +1760,9 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
             storage_func = self.xblock_settings.get("STORAGE_FUNC", get_default_storage)
             if isinstance(storage_func, string_types):
                 storage_func = import_string(storage_func)
-            self._storage = storage_func(self)
+            self._storage = instrumentation.instrument_storage(
+                storage_func(self), self.metrics
+            )
 
         return self._storage
 
@@ -678,6 +1777,133 @@ class ScormXBlock(XBlock, CompletableXBlockMixin):
         return settings_service.get_settings_bucket(self)
 
 
+@functools.lru_cache(maxsize=None)
+def get_resource_string(path):
+    """
+    Return the decoded content of a static resource. Resources are read only once per
+    process.
+    """
+    data = pkg_resources.resource_string(__name__, path)
+    return data.decode("utf8")
+
+
+@functools.lru_cache(maxsize=None)
+def get_template(path):
+    """
+    Return the compiled template from a static resource. Templates are compiled only
+    once per process.
+    """
+    return Template(get_resource_string(path))
+
+
+def warm_up():
+    """
+    Load and compile all static resources and templates. This is not required, but it
+    may be called at worker startup such that the first xblock views are rendered
+    faster.
+    """
+    for path in RESOURCES:
+        get_resource_string(path)
+    for path in TEMPLATES:
+        get_template(path)
+
+
+def spool_asset(asset_key, name=None, hash_algorithm=None):
+    """
+    Copy a contentstore asset chunk by chunk to an anonymous temporary file and return
+    it wrapped in a File object, rewound to the start. The asset key may be serialized
+    as a string.
+
+    If `hash_algorithm` is defined, the hex digest of the asset is computed while it is
+    copied, such that the file does not have to be read again, and it is stored in the
+    `digest` attribute of the returned file. Otherwise, `digest` is None.
+
+    Code snippet originally borrowed from
+    https://github.com/Abstract-Tech/abstract-scorm-xblock/blob/11c2f0ec61dbc4d4e1af37b5a203c2f8be7eb944/abstract_scorm_xblock/abstract_scorm_xblock/scormxblock.py#L343
+    where the whole asset was loaded in memory.
+    """
+    if isinstance(asset_key, str):
+        asset_key = parse_asset_key(asset_key)
+    digest = hashing.new_hash(hash_algorithm) if hash_algorithm else None
+    spooled = tempfile.TemporaryFile()
+    with instrumentation.track("contentstore", "stream_data"):
+        content = contentstore().find(asset_key, as_stream=True)
+        try:
+            for chunk in content.stream_data():
+                spooled.write(chunk)
+                if digest is not None:
+                    digest.update(chunk)
+        except Exception:
+            spooled.close()
+            raise
+        finally:
+            content.close()
+    instrumentation.add("contentstore_bytes", spooled.tell())
+    spooled.seek(0)
+    package_file = File(spooled, name=name)
+    package_file.digest = digest.hexdigest() if digest is not None else None
+    return package_file
+
+
+def parse_asset_key(asset_key):
+    # pylint: disable=import-outside-toplevel
+    from opaque_keys.edx.keys import AssetKey
+
+    return AssetKey.from_string(asset_key)
+
+
+def get_asset_metadata(scorm_package):
+    """
+    Return the ASSET_FIELDS of a contentstore asset, with a serialized asset key, such
+    that they can be cached.
+    """
+    metadata = {key: scorm_package.get(key) for key in ASSET_FIELDS}
+    metadata["asset_key"] = str(metadata["asset_key"])
+    return metadata
+
+
+def get_asset_fingerprint(scorm_package):
+    """
+    Return the contentstore metadata that identify an uploaded asset, or None if the
+    contentstore does not provide them. The asset key is included, such that the
+    package can later be fetched without searching the contentstore.
+    """
+    fingerprint = {key: scorm_package.get(key) for key in ASSET_FIELDS}
+    if fingerprint["md5"] is None and fingerprint["uploadDate"] is None:
+        return None
+    # Package meta must be JSON-serializable, and upload dates are datetimes
+    return {key: str(value) for key, value in fingerprint.items()}
+
+
+def get_peak_rss():
+    """
+    Return the peak resident set size of the current process, in kB. Return None on
+    platforms where this information is not available.
+    """
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        # ru_maxrss is expressed in bytes on macOS
+        peak_rss //= 1024
+    return peak_rss
+
+
+def log_peak_rss(label, peak_rss_before):
+    """
+    Log the process peak RSS and how much it increased since `peak_rss_before` was
+    measured with `get_peak_rss`.
+    """
+    peak_rss = get_peak_rss()
+    if peak_rss is None or peak_rss_before is None:
+        return
+    logger.info(
+        "%s: peak RSS %d kB (+%d kB)", label, peak_rss, peak_rss - peak_rss_before
+    )
+
+
 def parse_int(value, default):
     try:
         return int(value)
@@ -0,0 +1,291 @@
+// Tests for the LMS-side SCORM API. They do not depend on a browser: run them with
+//
+//     node openedxscorm_v2/static/js/spec/scormxblock_spec.js
+//
+// jQuery, the xblock runtime and the DOM are replaced by minimal fakes.
+var assert = require("assert");
+var fs = require("fs");
+var path = require("path");
+var vm = require("vm");
+
+var source = fs.readFileSync(
+  path.join(__dirname, "..", "src", "scormxblock.js"),
+  "utf8"
+);
+
+function loadScormXBlock(settings, acceptBeacons) {
+  var requests = [];
+  var beacons = [];
+  var fetches = [];
+  var timers = [];
+  var listeners = {};
+  var fakeElement = {
+    on: function () {
+      return fakeElement;
+    },
+    addClass: function () {},
+    removeClass: function () {},
+    html: function () {},
+    find: function () {
+      return fakeElement;
+    },
+  };
+  var $ = function (arg) {
+    if (typeof arg === "function") {
+      arg($);
+      return;
+    }
+    return fakeElement;
+  };
+  $.extend = Object.assign;
+  $.ajax = function (options) {
+    requests.push(options);
+    return {};
+  };
+  var context = {
+    $: $,
+    URLSearchParams: URLSearchParams,
+    Blob: Blob,
+    Event: function () {},
+    window: {
+      location: { search: "" },
+      dispatchEvent: function () {},
+      addEventListener: function (name, listener) {
+        listeners[name] = listener;
+      },
+    },
+    navigator: {
+      sendBeacon: function (url, data) {
+        var accepted = acceptBeacons !== false;
+        beacons.push({ url: url, data: data, accepted: accepted });
+        return accepted;
+      },
+    },
+    fetch: function (url, options) {
+      fetches.push({ url: url, options: options });
+      return Promise.resolve();
+    },
+    setTimeout: function (callback) {
+      timers.push(callback);
+      return timers.length;
+    },
+    clearTimeout: function (id) {
+      timers[id - 1] = null;
+    },
+    console: console,
+  };
+  vm.createContext(context);
+  vm.runInContext(source, context);
+  context.ScormXBlock(
+    {
+      handlerUrl: function (element, handler) {
+        return "/handler/" + handler;
+      },
+    },
+    {},
+    settings
+  );
+  return {
+    context: context,
+    requests: requests,
+    beacons: beacons,
+    fetches: fetches,
+    listeners: listeners,
+    runTimers: function () {
+      var callbacks = timers.splice(0, timers.length);
+      callbacks.forEach(function (callback) {
+        if (callback) {
+          callback();
+        }
+      });
+    },
+  };
+}
+
+function sentValues(request) {
+  return JSON.parse(request.data);
+}
+
+function defaultSettings(overrides) {
+  return Object.assign(
+    {
+      scorm_version: "SCORM_2004",
+      scorm_data: {},
+      lesson_status: "not attempted",
+      success_status: "unknown",
+      lesson_score: 0,
+      has_score: true,
+    },
+    overrides
+  );
+}
+
+var tests = {
+  "GetValue is served from the learner state": function () {
+    var loaded = loadScormXBlock({
+      scorm_version: "SCORM_12",
+      scorm_data: { "cmi.core.lesson_location": "page2" },
+      lesson_status: "incomplete",
+      success_status: "unknown",
+      lesson_score: 0.2,
+      has_score: true,
+    });
+    var API = loaded.context.API;
+    assert.strictEqual(API.LMSGetValue("cmi.core.lesson_location"), "page2");
+    assert.strictEqual(API.LMSGetValue("cmi.core.lesson_status"), "incomplete");
+    assert.strictEqual(API.LMSGetValue("cmi.core.score.raw"), 20);
+    assert.strictEqual(API.LMSGetValue("cmi.suspend_data"), "");
+    assert.strictEqual(API.LMSGetValue("constructor"), "");
+    assert.strictEqual(loaded.requests.length, 0);
+  },
+
+  "SetValue updates the local copy": function () {
+    var loaded = loadScormXBlock({
+      scorm_version: "SCORM_2004",
+      scorm_data: {},
+      lesson_status: "not attempted",
+      success_status: "unknown",
+      lesson_score: 0,
+      has_score: true,
+    });
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.location", "page3");
+    API.SetValue("cmi.completion_status", "completed");
+    API.SetValue("cmi.success_status", "passed");
+    API.SetValue("cmi.score.raw", "85");
+    assert.strictEqual(API.GetValue("cmi.location"), "page3");
+    assert.strictEqual(API.GetValue("cmi.completion_status"), "completed");
+    assert.strictEqual(API.GetValue("cmi.success_status"), "passed");
+    assert.strictEqual(API.GetValue("cmi.score.raw"), "85");
+    loaded.requests.forEach(function (request) {
+      assert.notStrictEqual(request.async, false);
+    });
+  },
+
+  "SCORM 1.2 lesson status is split like on the server": function () {
+    var loaded = loadScormXBlock({
+      scorm_version: "SCORM_12",
+      scorm_data: {},
+      lesson_status: "completed",
+      success_status: "unknown",
+      lesson_score: 0,
+      has_score: false,
+    });
+    var API = loaded.context.API;
+    API.LMSSetValue("cmi.core.lesson_status", "passed");
+    assert.strictEqual(API.LMSGetValue("cmi.core.lesson_status"), "completed");
+    API.LMSSetValue("cmi.core.score.raw", "50");
+    assert.strictEqual(API.LMSGetValue("cmi.core.score.raw"), 0);
+  },
+
+  "SetValue calls are coalesced until the debounce timer fires": function () {
+    var loaded = loadScormXBlock(defaultSettings());
+    var API = loaded.context.API_1484_11;
+    for (var i = 0; i < 50; i += 1) {
+      API.SetValue("cmi.session_time", "PT" + i + "S");
+    }
+    API.SetValue("cmi.location", "page1");
+    assert.strictEqual(loaded.requests.length, 0);
+    loaded.runTimers();
+    assert.strictEqual(loaded.requests.length, 1);
+    assert.deepStrictEqual(sentValues(loaded.requests[0]), [
+      { name: "cmi.session_time", value: "PT49S" },
+      { name: "cmi.location", value: "page1" },
+    ]);
+  },
+
+  "Commit flushes pending values after the running request": function () {
+    var loaded = loadScormXBlock(defaultSettings());
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.location", "page1");
+    assert.strictEqual(API.Commit(""), "true");
+    assert.strictEqual(loaded.requests.length, 1);
+    API.SetValue("cmi.location", "page2");
+    API.Terminate("");
+    // Only one request may run at a time
+    assert.strictEqual(loaded.requests.length, 1);
+    loaded.requests[0].complete();
+    assert.strictEqual(loaded.requests.length, 2);
+    assert.deepStrictEqual(sentValues(loaded.requests[1]), [
+      { name: "cmi.location", value: "page2" },
+    ]);
+  },
+
+  "Batches are limited in size": function () {
+    var loaded = loadScormXBlock(defaultSettings({ set_values_batch_size: 2 }));
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.interactions.0.id", "q1");
+    API.SetValue("cmi.interactions.1.id", "q2");
+    API.SetValue("cmi.interactions.2.id", "q3");
+    assert.strictEqual(loaded.requests.length, 1);
+    assert.strictEqual(sentValues(loaded.requests[0]).length, 2);
+    loaded.requests[0].complete();
+    loaded.runTimers();
+    assert.strictEqual(loaded.requests.length, 2);
+    assert.strictEqual(sentValues(loaded.requests[1]).length, 1);
+  },
+
+  "Pending values are sent with beacons when the page is hidden": function () {
+    var loaded = loadScormXBlock(defaultSettings());
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.suspend_data", "state");
+    loaded.listeners.pagehide();
+    assert.strictEqual(loaded.requests.length, 0);
+    assert.strictEqual(loaded.beacons.length, 1);
+    assert.strictEqual(loaded.beacons[0].url, "/handler/scorm_set_values");
+    loaded.runTimers();
+    assert.strictEqual(loaded.requests.length, 0);
+  },
+
+  "Oversized beacon batches are split": function () {
+    var loaded = loadScormXBlock(defaultSettings());
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.suspend_data", "x".repeat(40000));
+    API.SetValue("cmi.comments_from_learner.0.comment", "y".repeat(40000));
+    loaded.listeners.pagehide();
+    assert.strictEqual(loaded.beacons.length, 2);
+    assert.strictEqual(loaded.fetches.length, 0);
+    assert.strictEqual(loaded.requests.length, 0);
+  },
+
+  "Rejected beacons are sent with keepalive requests": function () {
+    var loaded = loadScormXBlock(defaultSettings(), false);
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.location", "page1");
+    API.SetValue("cmi.suspend_data", "state");
+    loaded.listeners.pagehide();
+    // The batch, and then every value, was refused
+    assert.strictEqual(loaded.beacons.length, 3);
+    assert.strictEqual(loaded.fetches.length, 2);
+    loaded.fetches.forEach(function (sent) {
+      assert.strictEqual(sent.url, "/handler/scorm_set_values");
+      assert.strictEqual(sent.options.keepalive, true);
+    });
+    assert.strictEqual(loaded.requests.length, 0);
+  },
+
+  "Values that are too large for beacons are sent synchronously": function () {
+    var loaded = loadScormXBlock(defaultSettings());
+    var API = loaded.context.API_1484_11;
+    API.SetValue("cmi.suspend_data", "x".repeat(70000));
+    loaded.listeners.pagehide();
+    assert.strictEqual(loaded.beacons.length, 0);
+    assert.strictEqual(loaded.fetches.length, 0);
+    assert.strictEqual(loaded.requests.length, 1);
+    assert.strictEqual(loaded.requests[0].async, false);
+    assert.strictEqual(sentValues(loaded.requests[0])[0].value.length, 70000);
+  },
+};
+
+var failures = 0;
+Object.keys(tests).forEach(function (name) {
+  try {
+    tests[name]();
+    console.log("ok - " + name);
+  } catch (e) {
+    failures += 1;
+    console.log("not ok - " + name);
+    console.log(e.stack);
+  }
+});
+process.exit(failures ? 1 : 0);
@@ -4,16 +4,12 @@ function ScormXBlock(runtime, element, settings) {
       return "true";
     };
 
-    this.LMSFinish = function () {
-      return "true";
-    };
+    this.LMSFinish = CommitValues;
 
     this.LMSGetValue = GetValue;
     this.LMSSetValue = SetValue;
 
-    this.LMSCommit = function () {
-      return "true";
-    };
+    this.LMSCommit = CommitValues;
 
     this.LMSGetLastError = function () {
       return "0";
@@ -33,16 +29,12 @@ function ScormXBlock(runtime, element, settings) {
       return "true";
     };
 
-    this.Terminate = function () {
-      return "true";
-    };
+    this.Terminate = CommitValues;
 
     this.GetValue = GetValue;
     this.SetValue = SetValue;
 
-    this.Commit = function () {
-      return "true";
-    };
+    this.Commit = CommitValues;
 
     this.GetLastError = function () {
       return "0";
@@ -59,36 +51,78 @@ function ScormXBlock(runtime, element, settings) {
 
   var fullscreenOnNextEvent = true;
 
-  // We only make calls to the get_value handler when absolutely required.
-  // These calls are synchronous and they can easily clog the scorm display.
-  var uncachedValues = [
-    "cmi.core.lesson_status",
-    "cmi.completion_status",
-    "cmi.success_status",
-    "cmi.core.score.raw",
-    "cmi.score.raw",
-  ];
-  var getValueUrl = runtime.handlerUrl(element, "scorm_get_value");
-  var GetValue = function (cmi_element) {
-    if (cmi_element in uncachedValues) {
-      var response = $.ajax({
-        type: "POST",
-        url: getValueUrl,
-        data: JSON.stringify({
-          name: cmi_element,
-        }),
-        async: false,
-      });
-      response = JSON.parse(response.responseText);
-      return response.value;
-    } else if (cmi_element in settings.scorm_data) {
-      return settings.scorm_data[cmi_element];
+  // Local copy of the learner CMI data model, seeded with the learner state. This
+  // copy mirrors the changes that are made on the server by the set_value handler,
+  // such that GetValue calls are served locally and never block the package with a
+  // synchronous request to the server.
+  function CmiDataStore(settings) {
+    this.values = $.extend({}, settings.scorm_data);
+    this.hasScore = settings.has_score;
+    this.lessonStatus = settings.lesson_status || "not attempted";
+    this.successStatus = settings.success_status || "unknown";
+    this.scoreRaw = Math.round((settings.lesson_score || 0) * 10000) / 100;
+  }
+  CmiDataStore.prototype.get = function (cmi_element) {
+    switch (cmi_element) {
+      case "cmi.core.lesson_status":
+      case "cmi.completion_status":
+        return this.lessonStatus;
+      case "cmi.success_status":
+        return this.successStatus;
+      case "cmi.core.score.raw":
+      case "cmi.score.raw":
+        return this.scoreRaw;
+    }
+    if (Object.prototype.hasOwnProperty.call(this.values, cmi_element)) {
+      return this.values[cmi_element];
     }
     return "";
   };
+  CmiDataStore.prototype.set = function (cmi_element, value) {
+    switch (cmi_element) {
+      case "cmi.core.lesson_status":
+        // In SCORM 1.2, the lesson status holds both the success and the completion
+        // status.
+        if (value === "passed" || value === "failed") {
+          this.successStatus = value;
+        } else if (value === "completed" || value === "incomplete") {
+          this.lessonStatus = value;
+        }
+        return;
+      case "cmi.success_status":
+        this.successStatus = value;
+        return;
+      case "cmi.completion_status":
+        this.lessonStatus = value;
+        return;
+      case "cmi.core.score.raw":
+      case "cmi.score.raw":
+        if (this.hasScore) {
+          this.scoreRaw = value;
+          return;
+        }
+        break;
+      case "cmi.progress_measure":
+        return;
+    }
+    this.values[cmi_element] = value;
+  };
+
+  var cmiData = new CmiDataStore(settings);
+  var GetValue = function (cmi_element) {
+    return cmiData.get(cmi_element);
+  };
 
-  var setValueEvents = [];
-  var processingSetValueEventsQueue = false;
+  // SetValue calls are coalesced: only the last value of every element is sent to the
+  // server. Pending values are sent at most every setValuesDebounce milliseconds, or
+  // as soon as there are setValuesBatchSize of them, or when the package commits
+  // its data. At most one request is running at any time.
+  var pendingValues = new Map();
+  var setValuesDebounce = settings.set_values_debounce || 500;
+  var setValuesBatchSize = settings.set_values_batch_size || 100;
+  var flushTimeout = null;
+  var flushRequest = null;
+  var flushRequested = false;
   var setValuesUrl = runtime.handlerUrl(element, "scorm_set_values");
   var SetValue = function (cmi_element, value) {
     // The first event causes the module to go fullscreen
@@ -96,47 +130,58 @@ function ScormXBlock(runtime, element, settings) {
     if (fullscreenOnNextEvent) {
       fullscreenOnNextEvent = false;
     }
+    cmiData.set(cmi_element, value);
     SetValueAsync(cmi_element, value);
     return "true";
   };
   function SetValueAsync(cmi_element, value) {
-    setValueEvents.push([cmi_element, value]);
-    if (!processingSetValueEventsQueue) {
-      // There is no running queue processor so we start one
-      processSetValueQueueItems();
+    // Move the element to the end of the queue, such that values are sent in the
+    // order of their last update
+    pendingValues.delete(cmi_element);
+    pendingValues.set(cmi_element, value);
+    if (pendingValues.size >= setValuesBatchSize) {
+      FlushValues();
+    } else if (flushTimeout === null) {
+      flushTimeout = setTimeout(FlushValues, setValuesDebounce);
     }
   }
-  function processSetValueQueueItems() {
-    if (setValueEvents.length === 0) {
-      // Exit if there is no event left in the queue
-      processingSetValueEventsQueue = false;
-      return;
-    }
-    processingSetValueEventsQueue = true;
+  function takePendingValues() {
     var data = [];
-    while (setValueEvents.length > 0) {
-      params = setValueEvents.shift();
-      cmi_element = params[0];
-      value = params[1];
-      if (!cmi_element in uncachedValues) {
-        // Update the local scorm data copy to fetch results faster with get_value
-        settings.scorm_data[cmi_element] = value;
+    pendingValues.forEach(function (value, cmi_element) {
+      if (data.length < setValuesBatchSize) {
+        data.push({
+          name: cmi_element,
+          value: value,
+        });
       }
-      data.push({
-        name: cmi_element,
-        value: value,
-      });
+    });
+    data.forEach(function (item) {
+      pendingValues.delete(item.name);
+    });
+    return data;
+  }
+  function FlushValues() {
+    if (flushTimeout !== null) {
+      clearTimeout(flushTimeout);
+      flushTimeout = null;
     }
-    $.ajax({
+    if (flushRequest !== null) {
+      // Flush again as soon as the running request is complete
+      flushRequested = true;
+      return;
+    }
+    if (pendingValues.size === 0) {
+      return;
+    }
+    flushRequest = $.ajax({
       type: "POST",
       url: setValuesUrl,
-      data: JSON.stringify(data),
+      data: JSON.stringify(takePendingValues()),
       success: function (results) {
         for (var i = 0; i < results.length; i += 1) {
           var result = results[i];
           if (typeof result.grade != "undefined") {
             // Properly display at most two decimals
-            console.log(result.grade, Math.round(result.grade * 100) / 100);
             $(element)
               .find(".grade")
               .html(Math.round(result.grade * 100) / 100);
@@ -145,11 +190,69 @@ function ScormXBlock(runtime, element, settings) {
         }
       },
       complete: function () {
-        // Recursive call to itself
-        processSetValueQueueItems();
+        flushRequest = null;
+        if (flushRequested || pendingValues.size >= setValuesBatchSize) {
+          flushRequested = false;
+          FlushValues();
+        } else if (pendingValues.size > 0 && flushTimeout === null) {
+          flushTimeout = setTimeout(FlushValues, setValuesDebounce);
+        }
       },
     });
   }
+  // When the page is hidden, asynchronous requests might be cancelled: instead, we
+  // send the pending values with beacons.
+  function BeaconValues() {
+    if (flushTimeout !== null) {
+      clearTimeout(flushTimeout);
+      flushTimeout = null;
+    }
+    if (typeof navigator === "undefined" || !navigator.sendBeacon) {
+      FlushValues();
+      return;
+    }
+    while (pendingValues.size > 0) {
+      sendBeacon(takePendingValues());
+    }
+  }
+  // Browsers refuse beacons beyond a quota of 64 KB. Batches that are too large, or
+  // that are refused, are split in halves. Single values that are still refused are
+  // sent with a keepalive request, or with a synchronous request when they are too
+  // large for it.
+  var maxBeaconSize = 60000;
+  function sendBeacon(data) {
+    var body = JSON.stringify(data);
+    var blob = new Blob([body], { type: "application/json" });
+    if (blob.size <= maxBeaconSize && navigator.sendBeacon(setValuesUrl, blob)) {
+      return;
+    }
+    if (data.length > 1) {
+      var middle = Math.ceil(data.length / 2);
+      sendBeacon(data.slice(0, middle));
+      sendBeacon(data.slice(middle));
+      return;
+    }
+    if (blob.size <= maxBeaconSize && typeof fetch === "function") {
+      fetch(setValuesUrl, {
+        method: "POST",
+        body: blob,
+        credentials: "same-origin",
+        keepalive: true,
+      }).catch(function () {});
+      return;
+    }
+    $.ajax({
+      type: "POST",
+      url: setValuesUrl,
+      data: body,
+      async: false,
+    });
+  }
+  window.addEventListener("pagehide", BeaconValues);
+  var CommitValues = function () {
+    FlushValues();
+    return "true";
+  };
 
   // Added to fix MCM Score issue
   // TODO::Implement rest of the LMS API
@@ -173,6 +276,7 @@ function ScormXBlock(runtime, element, settings) {
     }
   };
   var CommitData = function () {
+    FlushValues();
     return true;
   };
 
@@ -1,5 +1,47 @@
-function ScormStudioXBlock(runtime, element) {
+function ScormStudioXBlock(runtime, element, settings) {
   var handlerUrl = runtime.handlerUrl(element, "studio_submit");
+  var ingestStatusUrl = runtime.handlerUrl(element, "ingest_status");
+  var ingestStatusInterval = 2000;
+
+  function notifyErrors(errors) {
+    errors.forEach(function (error) {
+      runtime.notify("error", {
+        message: error,
+        title: "Scorm component save error",
+      });
+    });
+  }
+
+  // Poll the status of a background package ingestion job until it is done
+  function pollIngestStatus(jobId) {
+    $.ajax({
+      url: ingestStatusUrl,
+      type: "POST",
+      data: JSON.stringify({ job_id: jobId }),
+      success: function (status) {
+        if (status.state !== "done") {
+          var message = "Extracting SCORM package";
+          if (status.total_files > 0) {
+            message +=
+              " (" + status.files_extracted + "/" + status.total_files + " files)";
+          }
+          runtime.notify("save", {
+            state: "start",
+            message: message,
+          });
+          setTimeout(function () {
+            pollIngestStatus(jobId);
+          }, ingestStatusInterval);
+        } else if (status.errors.length > 0) {
+          notifyErrors(status.errors);
+        } else {
+          runtime.notify("save", {
+            state: "end",
+          });
+        }
+      },
+    });
+  }
 
   $(element)
     .find(".save-button")
@@ -36,12 +78,9 @@ function ScormStudioXBlock(runtime, element) {
         },
         success: function (response) {
           if (response.errors.length > 0) {
-            response.errors.forEach(function (error) {
-              runtime.notify("error", {
-                message: error,
-                title: "Scorm component save error",
-              });
-            });
+            notifyErrors(response.errors);
+          } else if (response.job_id) {
+            pollIngestStatus(response.job_id);
           } else {
             runtime.notify("save", {
               state: "end",
@@ -51,6 +90,11 @@ function ScormStudioXBlock(runtime, element) {
       });
     });
 
+  if (settings && settings.ingest_job) {
+    // A package is still being ingested in the background
+    pollIngestStatus(settings.ingest_job);
+  }
+
   $(element)
     .find(".cancel-button")
     .bind("click", function () {
@@ -1,14 +1,47 @@
 # -*- coding: utf-8 -*-
+import datetime
+import gc
+import gzip
+import hashlib
+import io
 import json
+import os
+import shutil
+import tempfile
+import time
 import unittest
+import zipfile
+import zlib
 
 
 from ddt import ddt, data
-from freezegun import freeze_time
+from django.core.files.base import ContentFile, File
+from django.core.files.storage import FileSystemStorage
 import mock
+from webob import Request
 from xblock.field_data import DictFieldData
 
-from .scormxblock import ScormXBlock
+from . import (
+    cleanup,
+    export,
+    fileindex,
+    hashing,
+    instrumentation,
+    locks,
+    manifest,
+    packages,
+    publishing,
+    scormdata,
+    zipserving,
+)
+from .cache import TTLCache
+from .extraction import (
+    ExtractionLimits,
+    UnsafePackageError,
+    ZipExtractor,
+    get_member_path,
+)
+from .scormxblock import ScormError, ScormXBlock, spool_asset, warm_up
 
 
 @ddt
@@ -23,11 +56,15 @@ class ScormXBlockTests(unittest.TestCase):
         block.location = mock.Mock(
             block_id="block_id", org="org", course="course", block_type="block_type"
         )
+        storage = mock.Mock()
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "STORAGE_FUNC": lambda _xblock: storage,
+        }
         return block
 
     def test_fields_xblock(self):
         block = self.make_one()
-        self.assertEqual(block.display_name, "Scorm")
+        self.assertEqual(block.display_name, "Scorm module v2")
         self.assertEqual(block.index_page_url, "")
         self.assertEqual(block.package_meta, {})
         self.assertEqual(block.scorm_version, "SCORM_12")
@@ -36,7 +73,7 @@ class ScormXBlockTests(unittest.TestCase):
         self.assertEqual(block.scorm_data, {})
         self.assertEqual(block.lesson_score, 0)
         self.assertEqual(block.weight, 1)
-        self.assertEqual(block.has_score, False)
+        self.assertEqual(block.has_score, True)
         self.assertEqual(block.icon_class, "video")
         self.assertEqual(block.width, None)
         self.assertEqual(block.height, 450)
@@ -46,189 +83,163 @@ class ScormXBlockTests(unittest.TestCase):
 
         fields = {
             "display_name": "Test Block",
-            "has_score": "True",
-            "file": None,
-            "width": 800,
-            "height": 450,
+            "has_score": "1",
+            "weight": "2",
+            "width": "800",
+            "height": "450",
+            "scorm_file": "",
         }
 
-        block.studio_submit(mock.Mock(method="POST", params=fields))
+        response = block.studio_submit(mock.Mock(method="POST", params=fields), "")
+        self.assertEqual({"result": "success", "errors": []}, json.loads(response.body))
         self.assertEqual(block.display_name, fields["display_name"])
-        self.assertEqual(block.has_score, fields["has_score"])
+        self.assertEqual(block.has_score, True)
+        self.assertEqual(block.weight, 2)
         self.assertEqual(block.icon_class, "problem")
         self.assertEqual(block.width, 800)
         self.assertEqual(block.height, 450)
 
-    @freeze_time("2018-05-01")
-    @mock.patch("openedxscorm.ScormXBlock.update_package_fields")
-    @mock.patch("openedxscorm.scormxblock.os")
-    @mock.patch("openedxscorm.scormxblock.zipfile")
-    @mock.patch("openedxscorm.scormxblock.File", return_value="call_file")
-    @mock.patch("openedxscorm.scormxblock.default_storage")
-    @mock.patch(
-        "openedxscorm.ScormXBlock._file_storage_path", return_value="file_storage_path"
-    )
-    @mock.patch("openedxscorm.ScormXBlock.get_sha1", return_value="sha1")
-    def test_save_scorm_zipfile(
-        self,
-        get_sha1,
-        file_storage_path,
-        default_storage,
-        mock_file,
-        zipfile,
-        mock_os,
-        update_package_fields,
-    ):
-        block = self.make_one()
-        mock_file_object = mock.Mock()
-        mock_file_object.configure_mock(name="scorm_file_name")
-        default_storage.configure_mock(size=mock.Mock(return_value="1234"))
-        mock_os.configure_mock(path=mock.Mock(join=mock.Mock(return_value="path_join")))
-
+    @mock.patch("openedxscorm_v2.ScormXBlock.clean_storage")
+    @mock.patch("openedxscorm_v2.ScormXBlock.ingest_package")
+    def test_save_scorm_package(self, ingest_package, clean_storage):
+        block = self.make_one(package_meta={"sha1": "old_sha1", "layout": "block"})
+        ingest_package.return_value = {
+            "errors": [],
+            "package_meta": {"sha1": "sha1", "name": "package.zip", "size": 1234},
+            "index_page_path": "index.html",
+            "scorm_version": "SCORM_2004",
+        }
         fields = {
             "display_name": "Test Block",
-            "has_score": "True",
-            "file": mock.Mock(file=mock_file_object),
-            "width": None,
-            "height": 450,
-        }
-
-        block.studio_submit(mock.Mock(method="POST", params=fields))
-
-        expected_package_meta = {
-            "path": "file_storage_path",
-            "sha1": "sha1",
-            "name": "scorm_file_name",
-            "last_updated": "2018-05-01T00:00:00.000000",
-            "size": "1234",
+            "has_score": "1",
+            "weight": "1",
+            "width": "",
+            "height": "450",
+            "scorm_file": "package.zip",
         }
 
-        get_sha1.assert_called_once_with(mock_file_object)
-        file_storage_path.assert_called_once_with()
-        default_storage.exists.assert_called_once_with("file_storage_path")
-        default_storage.delete.assert_called_once_with("file_storage_path")
-        default_storage.save.assert_called_once_with("file_storage_path", "call_file")
-        mock_file.assert_called_once_with(mock_file_object)
+        response = block.studio_submit(mock.Mock(method="POST", params=fields), "")
 
-        self.assertEqual(block.package_meta, expected_package_meta)
-
-        zipfile.ZipFile.assert_called_once_with(mock_file_object, "r")
-        update_package_fields.assert_called_once_with()
+        ingest_package.assert_called_once_with()
+        self.assertEqual([], json.loads(response.body)["errors"])
+        self.assertEqual(
+            block.package_meta,
+            {"sha1": "sha1", "name": "package.zip", "size": 1234, "layout": "block"},
+        )
+        self.assertEqual(block.index_page_path, "index.html")
+        self.assertEqual(block.scorm_version, "SCORM_2004")
+        clean_storage.assert_called_once_with(keep="sha1")
 
-    def test_build_file_storage_path(self):
-        block = self.make_one(
-            package_meta={"sha1": "sha1", "name": "scorm_file_name.html"}
+    @mock.patch("openedxscorm_v2.ScormXBlock.clean_storage")
+    def test_apply_ingest_result_keeps_references(self, _clean_storage):
+        block = self.make_one(package_meta={"sha1": "old_sha1", "layout": "shared"})
+        block.storage.exists.return_value = False
+        block.apply_ingest_result(
+            {
+                "errors": [],
+                "package_meta": {"sha1": "sha1", "layout": "shared"},
+                "index_page_path": "index.html",
+                "scorm_version": "SCORM_2004",
+            }
+        )
+        # The published version may still use the previous package
+        block.storage.delete.assert_not_called()
+        block.storage.save.assert_called_once_with(
+            "scorm/refs/sha1/" + block.hashed_usage_id, mock.ANY
         )
 
-        file_storage_path = block.package_path
+    def test_build_extract_folder_path(self):
+        block = self.make_one(package_meta={"sha1": "sha1", "layout": "block"})
+        block.storage.exists.return_value = False
 
-        self.assertEqual(file_storage_path, "org/course/block_type/block_id/sha1.html")
+        self.assertEqual(
+            "scorm/{}/sha1".format(block.hashed_usage_id), block.extract_folder_path
+        )
+        block.package_meta["layout"] = "shared"
+        self.assertEqual("scorm/packages/sha1", block.extract_folder_path)
 
     @mock.patch(
-        "openedxscorm.ScormXBlock._file_storage_path", return_value="file_storage_path"
+        "openedxscorm_v2.ScormXBlock._get_package_file_and_extract", return_value=True
     )
-    @mock.patch("openedxscorm.scormxblock.default_storage")
-    def test_student_view_data(self, default_storage, file_storage_path):
+    def test_student_view_data(self, get_package_file_and_extract):
         block = self.make_one(
-            package_meta={"last_updated": "2018-05-01", "size": 1234}
+            package_meta={
+                "sha1": "sha1",
+                "layout": "shared",
+                "last_updated": "2018-05-01",
+                "size": 1234,
+            },
+            index_page_path="index.html",
         )
-        default_storage.configure_mock(url=mock.Mock(return_value="url_zip_file"))
 
         student_view_data = block.student_view_data()
 
-        file_storage_path.assert_called_once_with()
-        default_storage.url.assert_called_once_with("file_storage_path")
+        get_package_file_and_extract.assert_called_once_with()
+        block.storage.url.assert_called_once_with("scorm/packages/sha1/index.html")
         self.assertEqual(
             student_view_data,
-            {"last_modified": "2018-05-01", "scorm_data": "url_zip_file", "size": 1234},
+            {"last_modified": "2018-05-01", "size": 1234, "index_page": "index.html"},
         )
 
-    @mock.patch(
-        "openedxscorm.ScormXBlock.get_completion_status",
-        return_value="completion_status",
-    )
-    @mock.patch("openedxscorm.ScormXBlock.publish_grade")
+    @staticmethod
+    def make_request(data):
+        return mock.Mock(method="POST", body=json.dumps(data).encode())
+
+    @mock.patch("openedxscorm_v2.ScormXBlock.publish_completion")
+    @mock.patch("openedxscorm_v2.ScormXBlock.publish_grade")
     @data(
         {"name": "cmi.core.lesson_status", "value": "completed"},
-        {"name": "cmi.completion_status", "value": "failed"},
+        {"name": "cmi.completion_status", "value": "incomplete"},
         {"name": "cmi.success_status", "value": "unknown"},
     )
-    def test_set_status(self, value, publish_grade, get_completion_status):
+    def test_set_status(self, value, publish_grade, publish_completion):
         block = self.make_one(has_score=True)
 
-        response = block.scorm_set_value(
-            mock.Mock(method="POST", body=json.dumps(value))
-        )
-
-        publish_grade.assert_called_once_with()
-        get_completion_status.assert_called_once_with()
+        response = block.scorm_set_value(self.make_request(value), "")
 
+        publish_grade.assert_not_called()
         if value["name"] == "cmi.success_status":
             self.assertEqual(block.success_status, value["value"])
+            self.assertEqual(response.json, {"result": "success"})
         else:
             self.assertEqual(block.lesson_status, value["value"])
-
+            self.assertEqual(
+                response.json,
+                {"completion_status": value["value"], "result": "success"},
+            )
         self.assertEqual(
-            response.json,
-            {
-                "completion_status": "completion_status",
-                "lesson_score": 0,
-                "result": "success",
-            },
+            value["value"] == "completed", publish_completion.call_count == 1
         )
 
-    @mock.patch(
-        "openedxscorm.ScormXBlock.get_completion_status",
-        return_value="completion_status",
-    )
+    @mock.patch("openedxscorm_v2.ScormXBlock.publish_grade")
     @data(
         {"name": "cmi.core.score.raw", "value": "20"},
         {"name": "cmi.score.raw", "value": "20"},
     )
-    def test_set_lesson_score(self, value, get_completion_status):
+    def test_set_lesson_score(self, value, publish_grade):
         block = self.make_one(has_score=True)
 
-        response = block.scorm_set_value(
-            mock.Mock(method="POST", body=json.dumps(value))
-        )
-
-        get_completion_status.assert_called_once_with()
+        response = block.scorm_set_value(self.make_request(value), "")
 
+        publish_grade.assert_called_once_with()
         self.assertEqual(block.lesson_score, 0.2)
+        self.assertEqual(response.json, {"grade": 0.2, "result": "success"})
 
-        self.assertEqual(
-            response.json,
-            {
-                "completion_status": "completion_status",
-                "lesson_score": 0.2,
-                "result": "success",
-            },
-        )
-
-    @mock.patch(
-        "openedxscorm.ScormXBlock.get_completion_status",
-        return_value="completion_status",
-    )
     @data(
         {"name": "cmi.core.lesson_location", "value": 1},
         {"name": "cmi.location", "value": 2},
         {"name": "cmi.suspend_data", "value": [1, 2]},
     )
-    def test_set_other_scorm_values(self, value, get_completion_status):
+    def test_set_other_scorm_values(self, value):
         block = self.make_one(has_score=True)
 
-        response = block.scorm_set_value(
-            mock.Mock(method="POST", body=json.dumps(value))
-        )
-
-        get_completion_status.assert_called_once_with()
-
-        self.assertEqual(block.scorm_data[value["name"]], value["value"])
+        response = block.scorm_set_value(self.make_request(value), "")
 
+        self.assertEqual(block.cmi_data[value["name"]], value["value"])
         self.assertEqual(
-            response.json,
-            {"completion_status": "completion_status", "result": "success"},
+            scormdata.unpack(block.scorm_data)[value["name"]], value["value"]
         )
+        self.assertEqual(response.json, {"result": "success"})
 
     @data(
         {"name": "cmi.core.lesson_status"},
@@ -238,9 +249,7 @@ class ScormXBlockTests(unittest.TestCase):
     def test_scorm_get_status(self, value):
         block = self.make_one(lesson_status="status", success_status="status")
 
-        response = block.scorm_get_value(
-            mock.Mock(method="POST", body=json.dumps(value))
-        )
+        response = block.scorm_get_value(self.make_request(value), "")
 
         self.assertEqual(response.json, {"value": "status"})
 
@@ -250,9 +259,7 @@ class ScormXBlockTests(unittest.TestCase):
     def test_scorm_get_lesson_score(self, value):
         block = self.make_one(lesson_score=0.2)
 
-        response = block.scorm_get_value(
-            mock.Mock(method="POST", body=json.dumps(value))
-        )
+        response = block.scorm_get_value(self.make_request(value), "")
 
         self.assertEqual(response.json, {"value": 20})
 
@@ -270,8 +277,1297 @@ class ScormXBlockTests(unittest.TestCase):
             }
         )
 
-        response = block.scorm_get_value(
-            mock.Mock(method="POST", body=json.dumps(value))
-        )
+        response = block.scorm_get_value(self.make_request(value), "")
 
         self.assertEqual(response.json, {"value": block.scorm_data[value["name"]]})
+
+    @mock.patch("openedxscorm_v2.scormxblock.contentstore")
+    def test_spool_asset(self, mock_contentstore):
+        content = mock_contentstore.return_value.find.return_value
+        content.stream_data.return_value = iter([b"abc", b"def"])
+
+        asset_key = mock.Mock()
+        package_file = spool_asset(asset_key, "package.zip")
+
+        mock_contentstore.return_value.find.assert_called_once_with(
+            asset_key, as_stream=True
+        )
+        content.close.assert_called_once_with()
+        with package_file:
+            self.assertEqual(package_file.name, "package.zip")
+            self.assertEqual(package_file.read(), b"abcdef")
+        self.assertIsNone(package_file.digest)
+
+    @mock.patch("openedxscorm_v2.scormxblock.contentstore")
+    def test_spool_asset_digest(self, mock_contentstore):
+        content = mock_contentstore.return_value.find.return_value
+        content.stream_data.return_value = iter([b"abc", b"def"])
+
+        with spool_asset(mock.Mock(), hash_algorithm="sha1") as package_file:
+            self.assertEqual(hashlib.sha1(b"abcdef").hexdigest(), package_file.digest)
+            self.assertEqual(package_file.read(), b"abcdef")
+
+    def test_get_package_meta_hash_algorithm(self):
+        package_file = File(io.BytesIO(b"abcdef"), name="package.zip")
+        block = self.make_one()
+        package_meta = block.get_package_meta(package_file)
+        self.assertEqual(hashlib.sha1(b"abcdef").hexdigest(), package_meta["sha1"])
+        self.assertEqual("sha1", package_meta["hash_algorithm"])
+        self.assertEqual(6, package_meta["size"])
+
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "HASH_ALGORITHM": "blake2b",
+        }
+        package_meta = block.get_package_meta(package_file)
+        self.assertEqual(
+            hashlib.blake2b(b"abcdef", digest_size=20).hexdigest(),
+            package_meta["sha1"],
+        )
+        self.assertEqual("blake2b", package_meta["hash_algorithm"])
+        self.assertEqual(0, package_file.tell())
+
+    def test_hash_algorithm_supported(self):
+        self.assertTrue(hashing.is_supported("sha1"))
+        self.assertTrue(hashing.is_supported("blake2b"))
+        self.assertFalse(hashing.is_supported("shake_128"))
+        self.assertFalse(hashing.is_supported("unknown"))
+
+        block = self.make_one()
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "HASH_ALGORITHM": "shake_256",
+        }
+        self.assertEqual("sha1", block.hash_algorithm)
+
+    def test_get_digest(self):
+        content = bytes(range(256)) * 100
+        self.assertEqual(
+            hashlib.sha1(content).hexdigest(),
+            hashing.get_digest(io.BytesIO(content), buffer_size=1000),
+        )
+
+    @mock.patch("openedxscorm_v2.ScormXBlock.clean_storage")
+    @mock.patch("openedxscorm_v2.ScormXBlock.ingest_package")
+    def test_studio_submit_async(self, ingest_package, clean_storage):
+        block = self.make_one(package_meta={"sha1": "old_sha1"})
+        executor = mock.Mock()
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "ASYNC_INGEST": True,
+            "INGEST_EXECUTOR": executor,
+        }
+        ingest_package.return_value = {
+            "errors": [],
+            "package_meta": {"sha1": "new_sha1", "layout": "block"},
+            "index_page_path": "index.html",
+            "scorm_version": "SCORM_2004",
+        }
+        fields = {
+            "display_name": "Test Block",
+            "has_score": "1",
+            "weight": "1",
+            "width": "",
+            "height": "450",
+            "scorm_file": "package.zip",
+        }
+
+        response = block.studio_submit(mock.Mock(method="POST", params=fields), "")
+        job_id = json.loads(response.body)["job_id"]
+        executor.assert_called_once_with(block, job_id)
+
+        # The previous package is served until the job result is polled
+        block.run_ingest_job(job_id)
+        self.assertEqual(block.package_meta["sha1"], "old_sha1")
+        # ...unless the worker applies the result itself
+        applied_block = self.make_one(
+            package_meta={"sha1": "old_sha1", "ingest_job": job_id}
+        )
+        applied_block.runtime.service.return_value.get_settings_bucket.return_value = {}
+        applied_block.run_ingest_job(job_id, apply=True)
+        self.assertEqual(
+            applied_block.package_meta, {"sha1": "new_sha1", "layout": "block"}
+        )
+        clean_storage.reset_mock()
+
+        status = block.ingest_status(
+            mock.Mock(method="POST", body=json.dumps({"job_id": job_id}).encode()),
+            "",
+        )
+        self.assertEqual(status.json_body["state"], "done")
+        self.assertEqual(block.package_meta, {"sha1": "new_sha1", "layout": "block"})
+        self.assertEqual(block.index_page_path, "index.html")
+        self.assertEqual(block.scorm_version, "SCORM_2004")
+        clean_storage.assert_called_once_with(keep="new_sha1")
+
+    @mock.patch("openedxscorm_v2.ScormXBlock.ingest_package")
+    @mock.patch("openedxscorm_v2.ScormXBlock._search_scorm_package")
+    def test_studio_submit_unchanged_package(
+        self, search_scorm_package, ingest_package
+    ):
+        block = self.make_one(
+            package_meta={
+                "sha1": "sha1",
+                "name": "package.zip",
+                "layout": "shared",
+                "asset": {
+                    "asset_key": "asset_key",
+                    "md5": "md5",
+                    "length": "1234",
+                    "uploadDate": "2020-01-01",
+                },
+            }
+        )
+        block.runtime.service.return_value.get_settings_bucket.return_value = {}
+        search_scorm_package.return_value = {
+            "asset_key": "asset_key",
+            "md5": "md5",
+            "length": 1234,
+            "uploadDate": "2020-01-01",
+        }
+        fields = {
+            "display_name": "New name",
+            "has_score": "1",
+            "weight": "2",
+            "width": "",
+            "height": "450",
+            "scorm_file": "package.zip",
+        }
+
+        response = block.studio_submit(mock.Mock(method="POST", params=fields), "")
+        self.assertTrue(json.loads(response.body)["skipped"])
+        self.assertEqual(block.display_name, "New name")
+        ingest_package.assert_not_called()
+
+        # The package is ingested again when it is uploaded again
+        search_scorm_package.return_value["uploadDate"] = "2020-01-02"
+        ingest_package.return_value = {"errors": ["error"]}
+        response = block.studio_submit(mock.Mock(method="POST", params=fields), "")
+        self.assertFalse(json.loads(response.body)["skipped"])
+        ingest_package.assert_called_once_with()
+
+    @mock.patch("openedxscorm_v2.scormxblock.spool_asset")
+    @mock.patch("openedxscorm_v2.scormxblock.contentstore")
+    def test_get_package_file_from_pinned_asset(self, mock_contentstore, spool):
+        # The scorm file was changed, but the new package was not ingested yet
+        block = self.make_one(
+            scorm_file="new.zip",
+            package_meta={
+                "name": "package.zip",
+                "hash_algorithm": "sha1",
+                "asset": {"asset_key": "pinned"},
+            },
+        )
+        block.runtime.service.return_value.get_settings_bucket.return_value = {}
+
+        block._get_package_file()  # pylint: disable=protected-access
+        spool.assert_called_once_with("pinned", "package.zip", hash_algorithm="sha1")
+        mock_contentstore.assert_not_called()
+
+        # The contentstore is searched when the pinned asset cannot be fetched
+        spool.side_effect = [Exception("not found"), mock.Mock()]
+        mock_contentstore.return_value.get_all_content_for_course.return_value = (
+            [{"asset_key": "found", "md5": "md5", "length": 1234}],
+            1,
+        )
+        block._get_package_file()  # pylint: disable=protected-access
+        spool.assert_called_with("found", "package.zip", hash_algorithm="sha1")
+        filters = mock_contentstore.return_value.get_all_content_for_course.call_args[
+            1
+        ]["filter_params"]
+        self.assertEqual("package.zip", filters["displayname"])
+
+    @mock.patch("openedxscorm_v2.ScormXBlock.add_package_reference")
+    @mock.patch("openedxscorm_v2.ScormXBlock.is_package_extracted")
+    @mock.patch("openedxscorm_v2.ScormXBlock.extract_package")
+    @mock.patch("openedxscorm_v2.ScormXBlock._get_package_file")
+    def test_get_package_file_digest_mismatch(
+        self, get_package_file, extract_package, is_package_extracted, _add_reference
+    ):
+        block = self.make_one(package_meta={"sha1": "sha1", "layout": "shared"})
+        block.runtime.service.return_value.get_settings_bucket.return_value = {}
+        is_package_extracted.return_value = False
+        package_file = get_package_file.return_value.__enter__.return_value
+        package_file.name = "package.zip"
+        package_file.digest = "other_sha1"
+
+        # pylint: disable=protected-access
+        self.assertFalse(block._get_package_file_and_extract())
+        extract_package.assert_not_called()
+
+        package_file.digest = "sha1"
+        block.clear_cached_package_state()
+        self.assertTrue(block._get_package_file_and_extract())
+        extract_package.assert_called_once_with(package_file)
+
+    @mock.patch("openedxscorm_v2.ScormXBlock.is_package_extracted", return_value=False)
+    @mock.patch("openedxscorm_v2.ScormXBlock._get_package_file")
+    def test_extraction_failures_are_cached(self, get_package_file, _is_extracted):
+        block = self.make_one(package_meta={"sha1": "sha1", "layout": "shared"})
+        get_package_file.side_effect = Exception("Asset not found")
+
+        # pylint: disable=protected-access
+        for _view in range(3):
+            self.assertFalse(block._get_package_file_and_extract())
+        get_package_file.assert_called_once_with()
+
+        # The extraction is retried after EXTRACT_RETRY_DELAY seconds
+        later = time.time() + 61
+        with mock.patch("openedxscorm_v2.scormxblock.time.time", return_value=later):
+            self.assertFalse(block._get_package_file_and_extract())
+        self.assertEqual(2, get_package_file.call_count)
+
+    def test_ingest_status_expired_job(self):
+        block = self.make_one(package_meta={"sha1": "sha1", "ingest_job": "expired"})
+        status = block.ingest_status(
+            mock.Mock(method="POST", body=json.dumps({"job_id": "expired"}).encode()),
+            "",
+        )
+        self.assertEqual(["Unknown ingestion job"], status.json_body["errors"])
+        self.assertEqual({"sha1": "sha1"}, block.package_meta)
+
+    @mock.patch("openedxscorm_v2.scormxblock.contentstore")
+    def test_search_scorm_package_cache(self, mock_contentstore):
+        block = self.make_one(scorm_file="package.zip")
+        block.runtime.service.return_value.get_settings_bucket.return_value = {}
+        get_all_content = mock_contentstore.return_value.get_all_content_for_course
+        get_all_content.side_effect = lambda *args, **kwargs: (
+            [{"asset_key": "asset_key", "md5": "md5", "length": 1234}],
+            1,
+        )
+
+        # pylint: disable=protected-access
+        self.assertEqual(
+            {
+                "asset_key": "asset_key",
+                "md5": "md5",
+                "length": 1234,
+                "uploadDate": None,
+            },
+            block._search_scorm_package(),
+        )
+        block._search_scorm_package(use_cache=True)
+        self.assertEqual(1, get_all_content.call_count)
+        # Cached results are never used to check for package updates
+        block._search_scorm_package()
+        self.assertEqual(2, get_all_content.call_count)
+
+    def test_templates_are_compiled_once(self):
+        warm_up()
+        block = self.make_one()
+        with mock.patch(
+            "openedxscorm_v2.scormxblock.pkg_resources.resource_string"
+        ) as resource_string:
+            block.render_template("static/html/scormxblock.html", {})
+            block.resource_string("static/css/scormxblock.css")
+        resource_string.assert_not_called()
+
+    @mock.patch("openedxscorm_v2.ScormXBlock.publish_completion")
+    @mock.patch("openedxscorm_v2.ScormXBlock.publish_grade")
+    def test_set_values_publishes_once_per_batch(
+        self, publish_grade, publish_completion
+    ):
+        block = self.make_one(has_score=True)
+        data_list = [
+            {"name": "cmi.score.raw", "value": "20"},
+            {"name": "cmi.completion_status", "value": "completed"},
+            {"name": "cmi.score.raw", "value": "80"},
+            {"name": "cmi.completion_status", "value": "completed"},
+        ]
+
+        results = block.set_values(data_list)
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(block.lesson_score, 0.8)
+        publish_grade.assert_called_once_with()
+        publish_completion.assert_called_once_with()
+
+        # Nothing is published when the values did not change
+        block.set_values(data_list[2:])
+        publish_grade.assert_called_once_with()
+        publish_completion.assert_called_once_with()
+
+    def test_set_values_packs_scorm_data(self):
+        block = self.make_one(scorm_data={"cmi.location": "page1"})
+        block.runtime.service.return_value.get_settings_bucket.return_value = {}
+
+        block.set_values(
+            [
+                {"name": "cmi.suspend_data", "value": "a" * 2000},
+                {"name": "cmi.interactions.0.id", "value": "q1"},
+            ]
+        )
+
+        self.assertEqual(block.scorm_data["__format__"], 1)
+        self.assertIn("cmi.suspend_data", block.scorm_data["__compressed__"])
+        self.assertEqual(block.scorm_data["cmi.interactions"], [{"id": "q1"}])
+        self.assertEqual(
+            scormdata.unpack(block.scorm_data),
+            {
+                "cmi.location": "page1",
+                "cmi.suspend_data": "a" * 2000,
+                "cmi.interactions.0.id": "q1",
+            },
+        )
+
+    def test_set_values_invalid_names(self):
+        block = self.make_one(scorm_data={"cmi.location": "page1"})
+        block.runtime.service.return_value.get_settings_bucket.return_value = {}
+
+        results = block.set_values(
+            [
+                {"name": "__compressed__", "value": "x"},
+                {"name": "cmi.interactions", "value": "x"},
+                {"name": "cmi.interactions.20000000.id", "value": "q1"},
+            ]
+        )
+
+        self.assertEqual(
+            ["error", "error", "success"], [result["result"] for result in results]
+        )
+        # Huge indexes are not collapsed in lists
+        self.assertEqual("q1", block.scorm_data["cmi.interactions.20000000.id"])
+        self.assertEqual(
+            "q1",
+            scormdata.get_value(block.scorm_data, "cmi.interactions.20000000.id"),
+        )
+        self.assertEqual(
+            {"cmi.location": "page1", "cmi.interactions.20000000.id": "q1"},
+            scormdata.unpack(block.scorm_data),
+        )
+        # Names that collide with the packed format are dropped
+        self.assertEqual(
+            {"__format__": 1, "cmi.location": "page1"},
+            scormdata.pack({"__compressed__": "x", "cmi.location": "page1"}),
+        )
+
+    def test_set_values_size_limits(self):
+        block = self.make_one()
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "SCORM_DATA_MAX_VALUE_SIZE": 10,
+            "SCORM_DATA_MAX_SIZE": 50,
+        }
+
+        results = block.set_values(
+            [
+                {"name": "cmi.location", "value": "a" * 11},
+                {"name": "cmi.interactions.0.id", "value": "q1"},
+            ]
+        )
+        self.assertEqual(results[0]["result"], "error")
+        self.assertEqual(results[1]["result"], "success")
+        self.assertEqual(block.cmi_data, {"cmi.interactions.0.id": "q1"})
+
+        results = block.set_values(
+            [
+                {"name": "cmi.interactions.{}.id".format(i), "value": "q"}
+                for i in range(5)
+            ]
+        )
+        self.assertEqual(results[0]["result"], "error")
+        self.assertEqual(block.cmi_data, {"cmi.interactions.0.id": "q1"})
+
+
+class ZipExtractorTests(unittest.TestCase):
+    @staticmethod
+    def make_zipfile(files):
+        zip_data = io.BytesIO()
+        with zipfile.ZipFile(zip_data, "w") as scorm_zipfile:
+            for name, content in files.items():
+                scorm_zipfile.writestr(name, content)
+        return zipfile.ZipFile(zip_data)
+
+    @staticmethod
+    def make_storage():
+        storage = mock.Mock()
+        storage.saved = {}
+
+        def save(name, content):
+            storage.saved[name] = content.read()
+            return name
+
+        storage.save.side_effect = save
+        return storage
+
+    def test_extract_concurrently(self):
+        files = {"file{}.txt".format(i): "content{}".format(i) for i in range(20)}
+        scorm_zipfile = self.make_zipfile(files)
+        storage = self.make_storage()
+        members = [
+            (zipinfo, "dest/" + zipinfo.filename)
+            for zipinfo in scorm_zipfile.infolist()
+        ]
+
+        extractor = ZipExtractor(storage, workers=4)
+        saved = extractor.extract(scorm_zipfile, members)
+
+        self.assertEqual(saved, ["dest/" + name for name in files])
+        self.assertEqual(
+            storage.saved,
+            {"dest/" + name: content.encode() for name, content in files.items()},
+        )
+        self.assertEqual(extractor.files_extracted, 20)
+        self.assertEqual(
+            extractor.bytes_written, sum(len(content) for content in files.values())
+        )
+
+    def test_extract_failure_rolls_back(self):
+        scorm_zipfile = self.make_zipfile({"a.txt": "a", "b.txt": "b"})
+        storage = mock.Mock()
+        storage.save.side_effect = ["dest/a.txt", IOError("upload failed")]
+        members = [
+            (zipinfo, "dest/" + zipinfo.filename)
+            for zipinfo in scorm_zipfile.infolist()
+        ]
+
+        with self.assertRaises(IOError):
+            ZipExtractor(storage, workers=1).extract(scorm_zipfile, members)
+        storage.delete.assert_called_once_with("dest/a.txt")
+
+    def test_extract_copies_unchanged_files(self):
+        files = {"file{}.txt".format(i): "content{}".format(i) for i in range(10)}
+        scorm_zipfile = self.make_zipfile(files)
+        members = [
+            (zipinfo, "dest/" + zipinfo.filename)
+            for zipinfo in scorm_zipfile.infolist()
+        ]
+        sources = {"dest/file1.txt": "old/file1.txt", "dest/file2.txt": "old/file2.txt"}
+
+        def copy_file(source, dest):
+            if source == "old/file1.txt":
+                raise IOError("copy failed")
+            return dest
+
+        for workers in [1, 4]:
+            storage = self.make_storage()
+            copy = mock.Mock(side_effect=copy_file)
+            extractor = ZipExtractor(storage, workers=workers, copy=copy)
+            saved = extractor.extract(scorm_zipfile, members, sources=sources)
+
+            self.assertEqual(saved, ["dest/" + name for name in files])
+            self.assertEqual(2, copy.call_count)
+            # The file that could not be copied was extracted instead
+            self.assertEqual(
+                sorted(["dest/" + name for name in files if name != "file2.txt"]),
+                sorted(storage.saved),
+            )
+            self.assertEqual(1, extractor.files_copied)
+            self.assertEqual(len("content2"), extractor.bytes_copied)
+            self.assertEqual(10, extractor.files_extracted)
+
+    def test_extract_limits(self):
+        scorm_zipfile = self.make_zipfile(
+            {"a.txt": "a" * 10, "b.txt": "b", "bomb.txt": "0" * 2 * 1024 * 1024}
+        )
+        members = [
+            (zipinfo, "dest/" + zipinfo.filename)
+            for zipinfo in scorm_zipfile.infolist()
+        ]
+        for limits in [
+            ExtractionLimits(10 ** 9, 2, 1000),
+            ExtractionLimits(1024, 10, 1000),
+        ]:
+            storage = self.make_storage()
+            with self.assertRaises(UnsafePackageError):
+                ZipExtractor(storage, limits=limits).extract(scorm_zipfile, members)
+            storage.save.assert_not_called()
+
+        with zipfile.ZipFile(io.BytesIO(), "w", zipfile.ZIP_DEFLATED) as bomb:
+            bomb.writestr("bomb.txt", "0" * 2 * 1024 * 1024)
+            with self.assertRaises(UnsafePackageError):
+                ZipExtractor(storage).check([(bomb.infolist()[0], "dest/bomb.txt")])
+
+    def test_extract_member_larger_than_declared(self):
+        scorm_zipfile = self.make_zipfile({"a.txt": "a"})
+        scorm_zipfile.open = mock.Mock(return_value=io.BytesIO(b"a" * 100))
+        storage = self.make_storage()
+        members = [(scorm_zipfile.infolist()[0], "dest/a.txt")]
+        with self.assertRaises(UnsafePackageError):
+            ZipExtractor(storage).extract(scorm_zipfile, members)
+
+    def test_get_member_path(self):
+        self.assertEqual("a/b.txt", get_member_path("root/a/b.txt", "root"))
+        self.assertEqual("a/b.txt", get_member_path("./a/b.txt", ""))
+        self.assertIsNone(get_member_path("root2/a.txt", "root"))
+        for filename in ["../a.txt", "a/../../b.txt", "/etc/passwd", "C:/a.txt"]:
+            with self.assertRaises(UnsafePackageError):
+                get_member_path(filename, "")
+
+
+class PackagesTests(unittest.TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = FileSystemStorage(location=location)
+        for sha1 in ["sha1_a", "sha1_b"]:
+            self.storage.save(
+                packages.package_path("scorm", sha1) + "/index.html",
+                ContentFile(b"<html></html>"),
+            )
+
+    def test_collect_unreferenced_packages(self):
+        packages.add_reference(self.storage, "scorm", "sha1_a", "block1")
+        packages.add_reference(self.storage, "scorm", "sha1_b", "block2")
+        packages.remove_reference(self.storage, "scorm", "sha1_b", "block2")
+
+        self.assertEqual(
+            packages.get_references(self.storage, "scorm", "sha1_a"), ["block1"]
+        )
+        # Recent packages are not collected
+        self.assertEqual(
+            packages.collect_unreferenced_packages(self.storage, "scorm"), []
+        )
+        self.assertEqual(
+            packages.collect_unreferenced_packages(
+                self.storage, "scorm", min_age=datetime.timedelta(0)
+            ),
+            ["sha1_b"],
+        )
+        self.assertFalse(self.storage.exists("scorm/packages/sha1_b/index.html"))
+        self.assertTrue(self.storage.exists("scorm/packages/sha1_a/index.html"))
+
+    def test_delete_indexed_folder(self):
+        folder = packages.package_path("scorm", "sha1_a")
+        index = fileindex.make_index([("index.html", 13, 0)])
+        fileindex.save_index(self.storage, folder, index)
+        self.assertEqual(index, fileindex.load_index(self.storage, folder))
+        self.assertEqual([13, 0, "text/html"], index["files"]["index.html"])
+        with mock.patch.object(self.storage, "listdir") as listdir:
+            packages.delete_folder(self.storage, folder)
+        listdir.assert_not_called()
+        self.assertFalse(self.storage.exists(folder + "/index.html"))
+        self.assertIsNone(fileindex.load_index(self.storage, folder))
+
+    def test_find_file(self):
+        index = fileindex.make_index(
+            [("a/b/index.html", 1, 0), ("b/index.html", 1, 0), ("a/index.html", 1, 0)]
+        )
+        self.assertEqual("a/index.html", fileindex.find_file(index, "index.html"))
+        self.assertIsNone(fileindex.find_file(index, "app.js"))
+
+    def test_bulk_delete_s3(self):
+        storage = mock.Mock(spec=["bucket", "_normalize_name", "delete"])
+        storage._normalize_name.side_effect = lambda name: "media/" + name
+        storage.bucket.delete_objects.side_effect = [
+            {"Errors": [{"Key": "media/scorm/a/2", "Message": "Access denied"}]},
+            {},
+        ]
+        deleter = packages.BulkDeleter(storage, workers=2)
+        deleter.delete(["scorm/a/{}".format(i) for i in range(1500)])
+
+        self.assertEqual(2, deleter.requests)
+        self.assertEqual(1499, deleter.files_deleted)
+        self.assertEqual(1, deleter.errors)
+        storage.delete.assert_not_called()
+        keys = [
+            obj["Key"]
+            for call in storage.bucket.delete_objects.call_args_list
+            for obj in call[1]["Delete"]["Objects"]
+        ]
+        self.assertEqual(1500, len(keys))
+        self.assertIn("media/scorm/a/1499", keys)
+
+
+class CleanupTests(unittest.TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = FileSystemStorage(location=location)
+        for path in [
+            "scorm/packages/sha1_a/index.html",
+            "scorm/packages/sha1_b/index.html",
+            "scorm/usage1/sha1_c/index.html",
+            "scorm/usage1/sha1_d/index.html",
+            "scorm/usage2/sha1_e/index.html",
+            "scorm/block2/index.html",
+            "scorm/block3/index.html",
+            # Folders of other SCORM xblocks
+            "scorm/other/sha1_f/index.html",
+            "scorm/block4/index.html",
+        ]:
+            self.storage.save(path, ContentFile(b"<html></html>"))
+        fileindex.save_index(
+            self.storage,
+            "scorm/usage2/sha1_e",
+            fileindex.make_index([("index.html", 13, 0)]),
+        )
+        packages.add_reference(self.storage, "scorm", "sha1_a", "usage3")
+        packages.add_reference(self.storage, "scorm", "sha1_b", "usage4")
+
+    @staticmethod
+    def make_xblock(hashed_usage_id, block_id, package_meta):
+        xblock = mock.Mock(hashed_usage_id=hashed_usage_id, package_meta=package_meta)
+        xblock.scorm_location.return_value = "scorm"
+        xblock.location.block_id = block_id
+        return xblock
+
+    def test_collect_garbage(self):
+        xblocks = [
+            self.make_xblock(
+                "usage1", "block1", {"sha1": "sha1_d", "layout": packages.BLOCK_LAYOUT}
+            ),
+            self.make_xblock(
+                "usage3", "block3", {"sha1": "sha1_a", "layout": packages.SHARED_LAYOUT}
+            ),
+        ]
+        report = cleanup.collect_garbage(
+            self.storage,
+            "scorm",
+            xblocks=xblocks,
+            min_age=datetime.timedelta(0),
+            allowed=["block2"],
+        )
+
+        self.assertEqual(["scorm/refs/sha1_b/usage4"], report["references"])
+        self.assertEqual(
+            [
+                "scorm/block2",
+                "scorm/usage1/sha1_c",
+                "scorm/usage2/sha1_e",
+                "scorm/packages/sha1_b",
+            ],
+            sorted(report["folders"][:-1]) + report["folders"][-1:],
+        )
+        self.assertEqual(6, report["files_deleted"])
+        for path in [
+            "scorm/packages/sha1_a/index.html",
+            "scorm/usage1/sha1_d/index.html",
+            "scorm/block3/index.html",
+            "scorm/refs/sha1_a/usage3",
+            "scorm/other/sha1_f/index.html",
+            "scorm/block4/index.html",
+        ]:
+            self.assertTrue(self.storage.exists(path))
+        self.assertFalse(self.storage.exists("scorm/packages/sha1_b/index.html"))
+
+    def test_collect_garbage_versions(self):
+        # The draft version uses a new package, and its reference was moved to it
+        # by a previous version, but the published version still uses the previous
+        # package
+        packages.remove_reference(self.storage, "scorm", "sha1_b", "usage4")
+        packages.add_reference(self.storage, "scorm", "sha1_a", "usage4")
+        xblocks = [
+            self.make_xblock(
+                "usage3", "block3", {"sha1": "sha1_a", "layout": packages.SHARED_LAYOUT}
+            ),
+            self.make_xblock(
+                "usage4", "block4", {"sha1": "sha1_a", "layout": packages.SHARED_LAYOUT}
+            ),
+            self.make_xblock(
+                "usage4", "block4", {"sha1": "sha1_b", "layout": packages.SHARED_LAYOUT}
+            ),
+        ]
+        report = cleanup.collect_garbage(
+            self.storage, "scorm", xblocks=xblocks, min_age=datetime.timedelta(0)
+        )
+        self.assertNotIn("scorm/packages/sha1_b", report["folders"])
+        self.assertTrue(self.storage.exists("scorm/packages/sha1_b/index.html"))
+
+    def test_collect_garbage_dry_run(self):
+        report = cleanup.collect_garbage(
+            self.storage,
+            "scorm",
+            xblocks=[],
+            min_age=datetime.timedelta(0),
+            dry_run=True,
+        )
+        self.assertIn("scorm/packages/sha1_a", report["folders"])
+        self.assertEqual(0, report["requests"])
+        self.assertTrue(self.storage.exists("scorm/packages/sha1_a/index.html"))
+
+    def test_collect_garbage_min_age(self):
+        report = cleanup.collect_garbage(self.storage, "scorm", xblocks=[])
+        self.assertEqual([], report["folders"])
+        self.assertEqual([], report["references"])
+        self.assertEqual(0, report["files_deleted"])
+
+
+class PublishingTests(unittest.TestCase):
+    def test_publish_variants(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = FileSystemStorage(location=location)
+        publisher = publishing.AssetPublisher(storage, encodings=["gzip"])
+        data = b"body { color: red; }\n" * 100
+
+        self.assertTrue(publisher.is_compressible("style.css", len(data)))
+        self.assertFalse(publisher.is_compressible("style.css", 10))
+        self.assertFalse(publisher.is_compressible("image.png", len(data)))
+        variants = publisher.publish_variants(
+            "pkg/style.css", io.BytesIO(data), len(data)
+        )
+
+        self.assertEqual(1, len(variants))
+        path, size, crc = variants[0]
+        self.assertEqual("pkg/style.css.gz", path)
+        with storage.open(path) as f:
+            compressed = f.read()
+        self.assertEqual(data, gzip.decompress(compressed))
+        self.assertEqual((len(compressed), zlib.crc32(compressed)), (size, crc))
+        self.assertEqual(len(data), publisher.original_bytes)
+
+    def test_publish_file_s3(self):
+        storage = mock.Mock(
+            spec=["bucket", "_normalize_name", "object_parameters", "default_acl"]
+        )
+        storage._normalize_name.side_effect = lambda name: "media/" + name
+        storage.object_parameters = {"ServerSideEncryption": "AES256"}
+        storage.default_acl = None
+        publisher = publishing.AssetPublisher(storage)
+        content = ContentFile(b"body {}")
+
+        self.assertEqual("pkg/style.css", publisher.publish("pkg/style.css", content))
+        storage.bucket.upload_fileobj.assert_called_once_with(
+            content,
+            "media/pkg/style.css",
+            ExtraArgs={
+                "ServerSideEncryption": "AES256",
+                "ContentType": "text/css",
+                "CacheControl": publishing.IMMUTABLE_CACHE_CONTROL,
+            },
+        )
+
+
+class RecordingMetrics(instrumentation.Metrics):
+    def __init__(self):
+        self.records = []
+
+    def timing(self, name, seconds, tags=None):
+        self.records.append(("timing", name, tags))
+
+    def increment(self, name, value=1, tags=None):
+        self.records.append(("increment", name, value, tags))
+
+    def gauge(self, name, value, tags=None):
+        self.records.append(("gauge", name, value, tags))
+
+
+class InstrumentationTests(unittest.TestCase):
+    def test_operations(self):
+        metrics = RecordingMetrics()
+        files = {"file{}.txt".format(i): "content" for i in range(10)}
+        scorm_zipfile = ZipExtractorTests.make_zipfile(files)
+        storage = instrumentation.instrument_storage(
+            ZipExtractorTests.make_storage(), metrics
+        )
+        members = [(zipinfo, zipinfo.filename) for zipinfo in scorm_zipfile.infolist()]
+
+        with instrumentation.operation(metrics, "view"):
+            storage.exists("file.txt")
+            with instrumentation.operation(metrics, "extract"):
+                # Uploads of the worker threads are attributed to both operations
+                ZipExtractor(storage, workers=4).extract(scorm_zipfile, members)
+                instrumentation.add("bytes", 70)
+            with instrumentation.track("contentstore", "find"):
+                pass
+
+        self.assertEqual(
+            [
+                ("timing", "extract", None),
+                ("timing", "extract.cpu", None),
+                ("timing", "extract.storage", None),
+                ("timing", "extract.contentstore", None),
+                (
+                    "increment",
+                    "storage.calls",
+                    10,
+                    {"operation": "extract", "method": "save"},
+                ),
+                ("gauge", "extract.bytes", 70, None),
+                ("timing", "view", None),
+                ("timing", "view.cpu", None),
+                ("timing", "view.storage", None),
+                ("timing", "view.contentstore", None),
+                (
+                    "increment",
+                    "storage.calls",
+                    1,
+                    {"operation": "view", "method": "exists"},
+                ),
+                (
+                    "increment",
+                    "storage.calls",
+                    10,
+                    {"operation": "view", "method": "save"},
+                ),
+                ("gauge", "view.bytes", 70, None),
+            ],
+            metrics.records,
+        )
+
+    def test_disabled_by_default(self):
+        metrics = instrumentation.get_metrics({})
+        storage = mock.Mock()
+        self.assertIs(storage, instrumentation.instrument_storage(storage, metrics))
+        with mock.patch.object(instrumentation, "report") as report:
+            with instrumentation.operation(metrics, "view"):
+                pass
+        report.assert_not_called()
+
+    def test_metrics_factory_called_once(self):
+        factory = mock.Mock(return_value=RecordingMetrics())
+        metrics = instrumentation.get_metrics({"METRICS": factory})
+        self.assertIs(factory.return_value, metrics)
+        self.assertIs(metrics, instrumentation.get_metrics({"METRICS": factory}))
+        factory.assert_called_once_with()
+
+    def test_statsd_metrics(self):
+        client = mock.Mock()
+        metrics = instrumentation.StatsdMetrics(client)
+        metrics.timing("student_view", 0.5)
+        metrics.increment(
+            "storage.calls", 3, tags={"operation": "view", "method": "exists"}
+        )
+        client.timing.assert_called_once_with("scorm.student_view", 500)
+        client.incr.assert_called_once_with("scorm.storage.calls.exists.view", 3)
+
+    def test_xblock_handler(self):
+        metrics = RecordingMetrics()
+        block = ScormXBlockTests.make_one()
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "METRICS": lambda: metrics
+        }
+        block.scorm_set_values(
+            mock.Mock(
+                method="POST",
+                body=json.dumps([{"name": "cmi.location", "value": "1"}]).encode(),
+            ),
+        )
+        self.assertIn(("timing", "scorm_set_values", None), metrics.records)
+        self.assertIn(("gauge", "scorm_set_values.values", 1, None), metrics.records)
+
+
+class LocksTests(unittest.TestCase):
+    def test_single_flight(self):
+        with locks.single_flight("key", lock_factory=locks.CacheLock) as acquired:
+            self.assertTrue(acquired)
+            with locks.single_flight("key", wait=0) as acquired_again:
+                self.assertFalse(acquired_again)
+
+        # Lock held by another process
+        other_lock = locks.CacheLock("key")
+        self.assertTrue(other_lock.acquire())
+        with locks.single_flight(
+            "key", lock_factory=locks.CacheLock, wait=0
+        ) as acquired:
+            self.assertFalse(acquired)
+        other_lock.release()
+        with locks.single_flight("key", lock_factory=locks.CacheLock) as acquired:
+            self.assertTrue(acquired)
+
+    def test_process_locks_are_dropped(self):
+        lock = locks.get_process_lock("key")
+        self.assertIs(lock, locks.get_process_lock("key"))
+        del lock
+        gc.collect()
+        # pylint: disable=protected-access
+        self.assertNotIn("key", locks._process_locks)
+
+    def test_file_lock(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        lock = locks.FileLock("key", directory=directory)
+        other_lock = locks.FileLock("key", directory=directory)
+        self.assertTrue(lock.acquire())
+        self.assertFalse(other_lock.acquire(timeout=0.2))
+        lock.release()
+        self.assertTrue(other_lock.acquire())
+        other_lock.release()
+
+    def test_extraction_in_progress(self):
+        storage = mock.Mock()
+        block = ScormXBlockTests.make_one(
+            package_meta={"sha1": "sha1", "layout": "shared"}
+        )
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "STORAGE_FUNC": lambda _xblock: storage,
+            "EXTRACT_WAIT": 0,
+        }
+        storage.exists.return_value = False
+        # pylint: disable=protected-access
+        with locks.single_flight(block.extract_folder_path):
+            self.assertFalse(block._get_package_file_and_extract())
+
+            # Package extracted by a previous version, without file index: the lock
+            # is not needed
+            storage.exists.side_effect = lambda path: not path.endswith(
+                fileindex.INDEX_FILENAME
+            )
+            self.assertTrue(block._get_package_file_and_extract())
+
+
+class ResumableExtractionTests(unittest.TestCase):
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = FileSystemStorage(location=location)
+        self.block = ScormXBlockTests.make_one(
+            package_meta={"sha1": "sha1", "layout": "shared"}
+        )
+        self.block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "STORAGE_FUNC": lambda _xblock: self.storage,
+            "EXTRACT_WORKERS": 1,
+            "EXTRACT_CHECKPOINT_INTERVAL": 1,
+        }
+        self.package = io.BytesIO()
+        with zipfile.ZipFile(self.package, "w") as scorm_zipfile:
+            scorm_zipfile.writestr("imsmanifest.xml", ManifestTests.MANIFEST)
+            for index in range(4):
+                scorm_zipfile.writestr(
+                    "lesson/file{}.js".format(index), "content{}".format(index)
+                )
+
+    def test_resume_interrupted_extraction(self):
+        folder = self.block.extract_folder_path
+        save = self.storage.save
+        saved = []
+
+        def fail_third_file(name, content, **kwargs):
+            if name.endswith(".js") and len(saved) == 2:
+                raise IOError("upload failed")
+            if name.endswith(".js"):
+                saved.append(name)
+            return save(name, content, **kwargs)
+
+        with mock.patch.object(self.storage, "save", side_effect=fail_third_file):
+            with self.assertRaises(IOError):
+                self.block.extract_package(self.package)
+        self.assertIsNone(fileindex.load_index(self.storage, folder))
+        self.assertTrue(
+            self.storage.exists(folder + "/" + fileindex.CHECKPOINT_FILENAME)
+        )
+
+        with mock.patch.object(self.storage, "save", wraps=save) as mock_save:
+            self.block.extract_package(self.package)
+        # Files that were saved before the interruption are not extracted again
+        self.assertEqual(
+            [fileindex.INDEX_FILENAME, "lesson/file2.js", "lesson/file3.js"],
+            sorted(
+                call[0][0][len(folder) + 1 :]
+                for call in mock_save.call_args_list
+                if not call[0][0].endswith(fileindex.CHECKPOINT_FILENAME)
+            ),
+        )
+        self.assertFalse(
+            self.storage.exists(folder + "/" + fileindex.CHECKPOINT_FILENAME)
+        )
+        index = fileindex.load_index(self.storage, folder)
+        self.assertEqual(5, len(index["files"]))
+        self.assertEqual(
+            (5, len(ManifestTests.MANIFEST) + 32), fileindex.get_totals(index)
+        )
+
+    def test_is_package_extracted(self):
+        self.assertFalse(self.block.is_package_extracted())
+        self.block.extract_package(self.package)
+        self.assertTrue(self.block.is_package_extracted())
+
+        # Index that does not match the package metadata
+        self.block.package_meta["file_count"] = 5
+        self.block.package_meta["extracted_size"] = 1
+        self.assertFalse(self.block.is_package_extracted())
+
+
+class ZipServingTests(unittest.TestCase):
+    CONTENT = b"".join(b"line %d\n" % index for index in range(30000))
+
+    def setUp(self):
+        self.package = io.BytesIO()
+        with zipfile.ZipFile(self.package, "w") as scorm_zipfile:
+            scorm_zipfile.writestr("root/imsmanifest.xml", ManifestTests.MANIFEST)
+            scorm_zipfile.writestr("root/lesson/index.html", b"<html></html>")
+            scorm_zipfile.writestr(
+                "root/lesson/stored.js", self.CONTENT, zipfile.ZIP_STORED
+            )
+            scorm_zipfile.writestr(
+                "root/lesson/deflated.js", self.CONTENT, zipfile.ZIP_DEFLATED
+            )
+            scorm_zipfile.writestr("other.txt", b"")
+        self.package.seek(0)
+
+    def test_iter_member(self):
+        index = zipserving.make_index(self.package, "root")
+        self.assertEqual(
+            [
+                "imsmanifest.xml",
+                "lesson/deflated.js",
+                "lesson/index.html",
+                "lesson/stored.js",
+            ],
+            sorted(index["members"]),
+        )
+        data = self.package.getvalue()
+        for path in ["lesson/stored.js", "lesson/deflated.js"]:
+            member = index["members"][path]
+            self.assertEqual(
+                self.CONTENT, b"".join(zipserving.iter_member(data, member))
+            )
+            for start, stop in [(0, 1), (100000, 200000), (70000, 300000)]:
+                self.assertEqual(
+                    self.CONTENT[start:stop],
+                    b"".join(zipserving.iter_member(data, member, start, stop)),
+                )
+
+    def test_iter_member_last_block(self):
+        # Highly compressible members fit in a single compressed chunk, and their
+        # output ends up in zlib when the input is used up
+        package = io.BytesIO()
+        contents = {
+            "a.txt": b"a" * (zipserving.CHUNK_SIZE + 1),
+            "b.txt": bytes(range(256)) * 768 + b"b" * 213,
+        }
+        with zipfile.ZipFile(package, "w", zipfile.ZIP_DEFLATED) as scorm_zipfile:
+            for name, content in contents.items():
+                scorm_zipfile.writestr(name, content)
+        index = zipserving.make_index(package, "")
+        data = package.getvalue()
+        for name, content in contents.items():
+            member = index["members"][name]
+            self.assertEqual(content, b"".join(zipserving.iter_member(data, member)))
+            for start, stop in [(65530, len(content)), (len(content) - 1, None)]:
+                self.assertEqual(
+                    content[start:stop],
+                    b"".join(zipserving.iter_member(data, member, start, stop)),
+                )
+
+    def test_serve_member(self):
+        index = zipserving.make_index(self.package, "root")
+        data = self.package.getvalue()
+        member = index["members"]["lesson/deflated.js"]
+
+        def serve(**headers):
+            return zipserving.serve_member(
+                Request.blank("/", headers=headers), data, "a.txt", member, "etag"
+            )
+
+        response = serve()
+        self.assertEqual(200, response.status_code)
+        self.assertEqual(self.CONTENT, response.body)
+        self.assertEqual("text/plain", response.headers["Content-Type"])
+        self.assertEqual('"etag"', response.headers["ETag"])
+        response = serve(Range="bytes=10-19")
+        self.assertEqual(206, response.status_code)
+        self.assertEqual(self.CONTENT[10:20], response.body)
+        self.assertEqual(
+            "bytes 10-19/{}".format(len(self.CONTENT)),
+            response.headers["Content-Range"],
+        )
+        self.assertEqual(304, serve(**{"If-None-Match": '"etag"'}).status_code)
+        self.assertEqual(416, serve(Range="bytes=1000000-").status_code)
+        # Stale ranges are ignored
+        response = serve(Range="bytes=10-19", **{"If-Range": '"other"'})
+        self.assertEqual(200, response.status_code)
+
+    def test_serve_asset(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        storage = FileSystemStorage(location=os.path.join(location, "storage"))
+        sha1 = ScormXBlock.get_sha1(self.package)
+        block = ScormXBlockTests.make_one(
+            package_meta={"sha1": sha1, "layout": "shared", "serving_mode": "zip"},
+            index_page_path="lesson/index.html",
+        )
+        block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "STORAGE_FUNC": lambda _xblock: storage,
+            "ZIP_CACHE_DIR": os.path.join(location, "cache"),
+        }
+        block.save_package_zip(self.package)
+
+        self.assertEqual(
+            [zipserving.PACKAGE_FILENAME, zipserving.INDEX_FILENAME],
+            sorted(storage.listdir(block.extract_folder_path)[1]),
+        )
+        self.assertEqual(block.runtime.handler_url.return_value, block.index_page_url)
+        block.runtime.handler_url.assert_called_once_with(
+            block, "serve_asset", sha1 + "/lesson/index.html", query=""
+        )
+        response = block.serve_asset(
+            Request.blank("/"), suffix=sha1 + "/lesson/index.html"
+        )
+        self.assertEqual(b"<html></html>", response.body)
+        self.assertTrue(os.path.exists(os.path.join(location, "cache", sha1 + ".zip")))
+        for suffix in ["sha1/lesson/index.html", sha1 + "/other.txt"]:
+            response = block.serve_asset(Request.blank("/"), suffix=suffix)
+            self.assertEqual(404, response.status_code)
+
+        # Extracting the package in the same shared folder preserves the zip file
+        extract_block = ScormXBlockTests.make_one(
+            package_meta={"sha1": sha1, "layout": "shared"}
+        )
+        extract_block.runtime.service.return_value.get_settings_bucket.return_value = {
+            "STORAGE_FUNC": lambda _xblock: storage,
+        }
+        storage.save(
+            os.path.join(block.extract_folder_path, "stale.html"), ContentFile(b"")
+        )
+        extract_block.extract_package(self.package)
+        files = storage.listdir(block.extract_folder_path)[1]
+        self.assertIn(zipserving.PACKAGE_FILENAME, files)
+        self.assertIn(zipserving.INDEX_FILENAME, files)
+        self.assertNotIn("stale.html", files)
+
+    def test_evict_local_copies(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        for index, name in enumerate(["a.zip", "b.zip", "c.zip", "d.zip.tmp"]):
+            path = os.path.join(directory, name)
+            with open(path, "wb") as f:
+                f.write(b"x" * 100)
+            os.utime(path, (1000 + index, 1000 + index))
+
+        keep = os.path.join(directory, "a.zip")
+        self.assertEqual(
+            1, zipserving.evict_local_copies(directory, max_size=250, keep=keep)
+        )
+        self.assertEqual(
+            ["a.zip", "c.zip", "d.zip.tmp"], sorted(os.listdir(directory))
+        )
+        self.assertEqual(0, zipserving.evict_local_copies(directory, max_size=250))
+
+
+class ExportTests(unittest.TestCase):
+    def make_record(self, user_id, state):
+        return (
+            user_id,
+            user_id,
+            "learner{}".format(user_id),
+            "block-v1:org+course+run+type@scorm_v2+block@abc",
+            json.dumps(state),
+            0.5,
+            1.0,
+            datetime.datetime(2024, 1, 1),
+        )
+
+    def test_export(self):
+        suspend_data = "abc" * 1000
+        records = [
+            self.make_record(
+                1,
+                {
+                    "lesson_status": "completed",
+                    "success_status": "passed",
+                    "lesson_score": 0.5,
+                    "scorm_data": scormdata.pack(
+                        {
+                            "cmi.location": "page2",
+                            "cmi.suspend_data": suspend_data,
+                            "cmi.interactions.0.result": "correct",
+                        }
+                    ),
+                },
+            ),
+            # Learners who did not start the xblock
+            self.make_record(2, {}),
+        ]
+        cmi_keys = ["cmi.location", "cmi.suspend_data", "cmi.interactions.0.result"]
+        chunks = [[export.get_row(record, cmi_keys) for record in records]]
+
+        rows = chunks[0]
+        self.assertEqual("learner1", rows[0]["username"])
+        self.assertEqual("completed", rows[0]["lesson_status"])
+        self.assertEqual("page2", rows[0]["cmi.location"])
+        self.assertEqual(suspend_data, rows[0]["cmi.suspend_data"])
+        self.assertEqual("correct", rows[0]["cmi.interactions.0.result"])
+        self.assertEqual("not attempted", rows[1]["lesson_status"])
+        self.assertIsNone(rows[1]["cmi.location"])
+
+        output = io.StringIO()
+        self.assertEqual(2, export.write_csv(chunks, output, cmi_keys=cmi_keys))
+        lines = output.getvalue().splitlines()
+        self.assertEqual(3, len(lines))
+        self.assertTrue(lines[0].startswith("user_id,username,usage_key,"))
+
+        output = io.StringIO()
+        self.assertEqual(2, export.write_jsonl(chunks, output))
+        self.assertEqual(
+            rows, [json.loads(line) for line in output.getvalue().splitlines()]
+        )
+
+
+class TTLCacheTests(unittest.TestCase):
+    @mock.patch("openedxscorm_v2.cache.time.monotonic", return_value=0)
+    def test_expiry(self, monotonic):
+        cache = TTLCache(timeout=10)
+        cache.set("key", "value")
+        self.assertEqual(cache.get("key"), "value")
+        monotonic.return_value = 11
+        self.assertIsNone(cache.get("key"))
+
+    def test_max_size(self):
+        cache = TTLCache(max_size=2)
+        cache.set("key1", 1)
+        cache.set("key2", 2)
+        cache.get("key1")
+        cache.set("key3", 3)
+        self.assertEqual(cache.get("key1"), 1)
+        self.assertIsNone(cache.get("key2"))
+        self.assertEqual(cache.get("key3"), 3)
+
+
+class ManifestTests(unittest.TestCase):
+    MANIFEST = b"""<?xml version="1.0"?>
+<manifest identifier="course1" xmlns="http://www.imsproject.org/xsd/imscp_rootv1p1p2"
+    xmlns:adlcp="http://www.adlnet.org/xsd/adlcp_rootv1p2">
+  <metadata><schemaversion>1.2</schemaversion></metadata>
+  <organizations default="org1">
+    <organization identifier="org1">
+      <title>Course</title>
+      <item identifier="item1" identifierref="res1">
+        <title>Lesson 1</title>
+        <adlcp:masteryscore>80</adlcp:masteryscore>
+      </item>
+    </organization>
+  </organizations>
+  <resources>
+    <resource identifier="res1" type="webcontent" adlcp:scormtype="sco"
+        href="lesson/index.html">
+      <file href="lesson/index.html"/>
+    </resource>
+  </resources>
+</manifest>
+"""
+
+    def test_parse_manifest(self):
+        model = manifest.parse_manifest(io.BytesIO(self.MANIFEST))
+        self.assertEqual("SCORM_12", model["scorm_version"])
+        self.assertEqual("lesson/index.html", model["index_page_path"])
+        self.assertEqual("org1", model["default_organization"])
+        item = model["organizations"][0]["items"][0]
+        self.assertEqual("Lesson 1", item["title"])
+        self.assertEqual("80", item["masteryscore"])
+        self.assertEqual(["res1"], model["scos"])
+        self.assertEqual(["lesson/index.html"], model["resources"][0]["files"])
+
+    def test_read_manifest_limits(self):
+        package = io.BytesIO()
+        with zipfile.ZipFile(package, "w", zipfile.ZIP_DEFLATED) as scorm_zipfile:
+            scorm_zipfile.writestr("imsmanifest.xml", self.MANIFEST + b" " * 100000)
+            scorm_zipfile.writestr("index.html", b"")
+        with zipfile.ZipFile(package) as scorm_zipfile:
+            with mock.patch.object(scorm_zipfile, "open") as open_member:
+                with self.assertRaises(ScormError):
+                    ScormXBlock.read_manifest(
+                        scorm_zipfile,
+                        ExtractionLimits(
+                            max_uncompressed_size=10**9, max_file_count=1, max_ratio=100
+                        ),
+                    )
+            # Limits are checked before anything is decompressed
+            open_member.assert_not_called()
+            with mock.patch("openedxscorm_v2.scormxblock.MAX_MANIFEST_SIZE", 10000):
+                with self.assertRaises(ScormError) as context:
+                    ScormXBlock.read_manifest(scorm_zipfile)
+            self.assertIn("too large", context.exception.args[0])
+
+    def test_read_manifest_index_fallback(self):
+        package = io.BytesIO()
+        with zipfile.ZipFile(package, "w") as scorm_zipfile:
+            scorm_zipfile.writestr(
+                "root/imsmanifest.xml",
+                b'<manifest><metadata><schemaversion>2004 4th Edition'
+                b"</schemaversion></metadata></manifest>",
+            )
+            scorm_zipfile.writestr("root/a/b/index.html", b"")
+            scorm_zipfile.writestr("root/a/index.html", b"")
+        with zipfile.ZipFile(package) as scorm_zipfile:
+            root_path, model = ScormXBlock.read_manifest(scorm_zipfile)
+        self.assertEqual("root", root_path)
+        self.assertEqual("a/index.html", model["index_page_path"])
+        self.assertEqual("SCORM_2004", model["scorm_version"])
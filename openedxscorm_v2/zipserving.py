@@ -0,0 +1,306 @@
+"""
+Serving of package files straight from the package zip file, without extraction.
+
+With the "zip" SERVING_MODE, packages are not extracted to thousands of storage objects:
+the zip file is uploaded as a single object, next to an index of its central directory,
+and package files are served by the `serve_asset` handler of the xblock::
+
+    XBLOCK_SETTINGS["ScormXBlock"] = {
+        "SERVING_MODE": "zip",
+        # Local copies of the package zip files
+        "ZIP_CACHE_DIR": "/tmp/openedxscorm_v2-packages",
+        # Total size of the local copies, in bytes
+        "ZIP_CACHE_MAX_SIZE": 10 * 1024 * 1024 * 1024,
+    }
+
+The index gives the offset, sizes, CRC-32 and compression method of every member below
+the package root. Package zip files are downloaded once per host to ZIP_CACHE_DIR, and
+they are memory-mapped, such that members are served without any storage request.
+Stored members are sliced from the map; deflated members are decompressed while they
+are streamed. Responses support conditional requests, with ETags, and byte ranges.
+Local copies may be deleted at any time: they are downloaded again when needed. After
+every download, the least recently used copies are deleted until their total size is
+below ZIP_CACHE_MAX_SIZE. Copies that are still mapped keep being served until their
+map is dropped.
+
+The mode of a package is recorded in its metadata when it is ingested, such that
+changing the SERVING_MODE only affects packages that are saved afterwards in Studio.
+"""
+from collections import OrderedDict
+import mimetypes
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+
+from django.core.files.base import File
+from webob import Response
+
+from . import fileindex, locks
+from .extraction import UnsafePackageError, get_member_path
+
+
+# Values of package_meta["serving_mode"]
+EXTRACT_MODE = "extract"
+ZIP_MODE = "zip"
+
+PACKAGE_FILENAME = ".scorm-package.zip"
+INDEX_FILENAME = ".scorm-zip-index.json"
+FILENAMES = (PACKAGE_FILENAME, INDEX_FILENAME)
+
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_BUFFER_SIZE = 1024 * 1024
+MAX_LOCAL_COPIES = 32
+DEFAULT_CACHE_MAX_SIZE = 10 * 1024 * 1024 * 1024
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "openedxscorm_v2-packages")
+# Responses are served to authenticated users, and their urls include the package
+# digest
+CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+SUPPORTED_COMPRESSION = (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED)
+LOCAL_HEADER = struct.Struct("<4s22xHH")
+LOCAL_HEADER_SIGNATURE = b"PK\x03\x04"
+
+_local_copies = OrderedDict()
+_local_copies_lock = threading.Lock()
+
+
+def package_path(folder):
+    return os.path.join(folder, PACKAGE_FILENAME)
+
+
+def index_path(folder):
+    return os.path.join(folder, INDEX_FILENAME)
+
+
+def make_index(package_file, root_path):
+    """
+    Create the index of the members of a package zip file that are below `root_path`.
+    Each member is described by [data offset, compressed size, size, CRC-32,
+    compression method], and indexed by its path relative to the root. Raise an
+    UnsafePackageError if a member cannot be served from the zip file.
+    """
+    members = {}
+    with zipfile.ZipFile(package_file, "r") as scorm_zipfile:
+        zipinfos = scorm_zipfile.infolist()
+    for zipinfo in zipinfos:
+        if zipinfo.filename.endswith("/"):
+            continue
+        relpath = get_member_path(zipinfo.filename, root_path)
+        if relpath is None:
+            continue
+        if zipinfo.compress_type not in SUPPORTED_COMPRESSION or zipinfo.flag_bits & 1:
+            raise UnsafePackageError(
+                "Unsupported compression or encryption of '{}'".format(
+                    zipinfo.filename
+                )
+            )
+        # The data offset is not part of the central directory: it depends on the
+        # lengths of the local header fields
+        package_file.seek(zipinfo.header_offset)
+        signature, name_length, extra_length = LOCAL_HEADER.unpack(
+            package_file.read(LOCAL_HEADER.size)
+        )
+        if signature != LOCAL_HEADER_SIGNATURE:
+            raise UnsafePackageError(
+                "Invalid local header of '{}'".format(zipinfo.filename)
+            )
+        members[relpath] = [
+            zipinfo.header_offset + LOCAL_HEADER.size + name_length + extra_length,
+            zipinfo.compress_size,
+            zipinfo.file_size,
+            zipinfo.CRC,
+            zipinfo.compress_type,
+        ]
+    size = package_file.seek(0, 2)
+    package_file.seek(0)
+    return {"version": fileindex.FORMAT_VERSION, "size": size, "members": members}
+
+
+def save_package(storage, folder, package_file, index):
+    """
+    Upload a package zip file and then its index, which marks the upload as complete.
+    """
+    path = package_path(folder)
+    if storage.exists(path):
+        storage.delete(path)
+    package_file.seek(0)
+    storage.save(path, File(package_file))
+    package_file.seek(0)
+    fileindex.save_json(storage, index_path(folder), index)
+
+
+def load_index(storage, folder):
+    """
+    Return the index of the package zip file stored in `folder`, or None if the folder
+    does not have one.
+    """
+    return fileindex.load_json(storage, index_path(folder))
+
+
+def list_files(storage, folder):
+    """
+    Iterate on the paths of the files of the package zip file stored in `folder`.
+    """
+    for path in [package_path(folder), index_path(folder)]:
+        if storage.exists(path):
+            yield path
+
+
+def get_local_copy(
+    storage, path, name, size, directory=None, max_size=DEFAULT_CACHE_MAX_SIZE
+):
+    """
+    Return a read-only memory map of the local copy of the `path` file of the storage.
+    The file is downloaded to `directory` as `name` if it does not exist yet, or if its
+    size does not match; then the directory is pruned to `max_size` bytes. Maps are
+    shared by all threads, and the least recently used ones are dropped, such that at
+    most MAX_LOCAL_COPIES files are kept open.
+    """
+    directory = directory or DEFAULT_CACHE_DIR
+    local_path = os.path.join(directory, name)
+    with _local_copies_lock:
+        if local_path in _local_copies:
+            _local_copies.move_to_end(local_path)
+            return _local_copies[local_path]
+    with locks.get_process_lock(local_path):
+        with _local_copies_lock:
+            if local_path in _local_copies:
+                return _local_copies[local_path]
+        if not os.path.exists(local_path) or os.path.getsize(local_path) != size:
+            download(storage, path, local_path)
+            evict_local_copies(directory, max_size, keep=local_path)
+        else:
+            # The modification time is the last use of the copy by any process
+            os.utime(local_path)
+        with open(local_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with _local_copies_lock:
+            _local_copies[local_path] = data
+            while len(_local_copies) > MAX_LOCAL_COPIES:
+                # Maps are closed once they are no longer used by any response
+                _local_copies.popitem(last=False)
+    return data
+
+
+def download(storage, path, local_path):
+    """
+    Download a file from the storage to a temporary file, which is then atomically
+    renamed, such that concurrent processes never read partial copies.
+    """
+    directory = os.path.dirname(local_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as dest, storage.open(path) as source:
+            shutil.copyfileobj(source, dest, DOWNLOAD_BUFFER_SIZE)
+        os.replace(tmp_path, local_path)
+    except BaseException:
+        os.remove(tmp_path)
+        raise
+
+
+def evict_local_copies(directory, max_size, keep=None):
+    """
+    Delete the least recently used local copies of `directory` until their total size
+    is at most `max_size`. The `keep` copy, as well as the copies that are mapped by
+    this process, are never deleted. Return the number of deleted copies.
+    """
+    copies = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.endswith(".tmp"):
+                # Temporary files are downloads in progress
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            copies.append((stat.st_mtime, stat.st_size, entry.path))
+    total_size = sum(copy[1] for copy in copies)
+    with _local_copies_lock:
+        mapped = set(_local_copies)
+    deleted = 0
+    for _mtime, copy_size, local_path in sorted(copies):
+        if total_size <= max_size:
+            break
+        if local_path == keep or local_path in mapped:
+            continue
+        try:
+            # Other processes that mapped the copy can still read it
+            os.remove(local_path)
+        except FileNotFoundError:
+            pass
+        total_size -= copy_size
+        deleted += 1
+    return deleted
+
+
+def iter_member(data, member, start=0, stop=None):
+    """
+    Iterate on the chunks of bytes of a member of the zip file mapped in `data`,
+    from the `start` to the `stop` offset of the uncompressed member.
+    """
+    offset, compress_size, size, _crc, compress_type = member
+    stop = size if stop is None else min(stop, size)
+    if compress_type == zipfile.ZIP_STORED:
+        for position in range(start, stop, CHUNK_SIZE):
+            yield data[offset + position : offset + min(position + CHUNK_SIZE, stop)]
+        return
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+    position = 0
+    chunk_offset = offset
+    end = offset + compress_size
+    while position < stop:
+        compressed = decompressor.unconsumed_tail
+        if not compressed and chunk_offset < end:
+            compressed = data[chunk_offset : min(chunk_offset + CHUNK_SIZE, end)]
+            chunk_offset += CHUNK_SIZE
+        # Output is bounded, such that highly compressed members are streamed, too
+        chunk = decompressor.decompress(compressed, CHUNK_SIZE)
+        if not chunk and not compressed:
+            # The input is used up: zlib may still hold some output
+            chunk = decompressor.flush()
+            if not chunk:
+                return
+        if position + len(chunk) > start:
+            yield chunk[max(0, start - position) : stop - position]
+        position += len(chunk)
+
+
+def serve_member(request, data, path, member, etag, cache_control=CACHE_CONTROL):
+    """
+    Return the webob Response to a request of the `path` member of the zip file mapped
+    in `data`. Conditional requests, with If-None-Match and If-Range headers, and single
+    byte ranges are supported.
+    """
+    size = member[2]
+    # The charset of package files is unknown
+    response = Response(
+        content_type=mimetypes.guess_type(path)[0] or "application/octet-stream",
+        charset=None,
+    )
+    response.etag = etag
+    response.cache_control = cache_control
+    response.accept_ranges = "bytes"
+    if etag in request.if_none_match:
+        response.status = 304
+        return response
+    start, stop = 0, size
+    if request.range is not None and response in request.if_range:
+        content_range = request.range.range_for_length(size)
+        if content_range is None:
+            response.status = 416
+            response.content_range = "bytes */{}".format(size)
+            return response
+        start, stop = content_range
+        response.status = 206
+        response.content_range = (start, stop, size)
+    if request.method != "HEAD":
+        response.app_iter = iter_member(data, member, start, stop)
+    response.content_length = stop - start
+    return response